@@ -4,50 +4,72 @@
 #
 # GitHub eArmada8/ed8_dlc_tables
 
-import json, glob, os, sys, struct
+import json, glob, os, sys, struct, hashlib, shutil, concurrent.futures
+from ed8_tbl_codec import load_tbl, read_tbl_header, read_tbl_records, tbl_writer
 
-def read_null_terminated_string(f):
-    null_term_string = f.read(1)
-    while null_term_string[-1] != 0:
-        null_term_string += f.read(1)
-    return(null_term_string[:-1].decode('utf-8'))
+# Number of .json files to read at the same time.  Set to 1 to read one at a time.
+read_workers = 8
 
 def read_id_numbers_with_offsets(table):
-    table_data = []
     game_type = 3 # CS3, CS4 and CS5 all have the same ShopItem so will all be 3
-    with open(table, 'rb') as f:
-        f.seek(0,2)
-        file_end = f.tell()
-        f.seek(0,0)
-        total_entries, num_sections = struct.unpack("<hi",f.read(6))
-        section_data = []
-        for i in range(num_sections):
-            section = {'name': read_null_terminated_string(f),\
-                'num_items': struct.unpack("<i", f.read(4))[0]}
-            section_data.append(section)
-        while f.tell() < file_end:
-            entry_type = read_null_terminated_string(f)
-            offset = f.tell()
-            block_size, = struct.unpack("<h", f.read(2))
-            block_data = f.read(block_size)
-            table_data.append({'type': entry_type, 'data': block_data})
-            if entry_type == 'ShopItem' and block_size == 10:
-                game_type = 2 # CS2 and TXe mode
+    data = load_tbl(table)
+    total_entries, section_data, offset = read_tbl_header(data)
+    table_data = [{'type': x['type'], 'data': x['data']} for x in read_tbl_records(data, offset)]
+    if any([x['type'] == 'ShopItem' and len(x['data']) == 10 for x in table_data]):
+        game_type = 2 # CS2 and TXe mode
     return(table_data, section_data, game_type)
 
 def read_shop_id_numbers (table_data):
     return([struct.unpack('<H',x['data'][0:2])[0] if x['type'] == 'ShopItem' else -1 for x in table_data])
 
-def read_items():
-    def read_json_for_item_id(json_file):
+def read_json_for_item_id(json_file):
+    try:
         with open(json_file, 'rb') as f:
             data = json.loads(f.read())
-            if 'item_id' in data:
-                return(data['item_id'])
-            else:
-                return(-1)
-    new_items_json_list = glob.glob('**/*.json',recursive=True)
-    return([{'shop_id': int(x.replace('\\','/').split('/')[0]), 'item_id': read_json_for_item_id(x)} for x in new_items_json_list])
+        if isinstance(data, dict) and isinstance(data.get('item_id'), int):
+            return(data['item_id'])
+    except (OSError, ValueError):
+        pass
+    return(-1)
+
+# Every .json in the folders named by shop_id (other folders and files are ignored), in the same order as glob
+def find_item_jsons():
+    item_jsons = []
+    shop_dirs = [x.name for x in os.scandir('.') if x.is_dir() and x.name.isdigit()]
+    for shop_dir in shop_dirs:
+        item_jsons.extend([(int(shop_dir), x) for x in glob.glob(os.path.join(shop_dir, '**', '*.json'), recursive = True)])
+    return(item_jsons)
+
+# The item_id of each .json is cached by size and modification time, and the ones that are not cached (or have
+# changed) are read in a pool of worker threads.  Files without a valid item_id are skipped.
+def read_items(cache_file = '.ed8cache/shop_item_ids.json'):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.loads(f.read())
+    except (OSError, ValueError):
+        cache = {}
+    item_jsons = find_item_jsons()
+    stats = [os.stat(x[1]) for x in item_jsons]
+    keys = [x[1].replace('\\','/') for x in item_jsons]
+    item_ids = [cache[keys[i]][2] if keys[i] in cache and cache[keys[i]][0:2] == [stats[i].st_size, stats[i].st_mtime_ns] else None\
+        for i in range(len(item_jsons))]
+    to_read = [i for i in range(len(item_jsons)) if item_ids[i] is None]
+    if read_workers > 1 and len(to_read) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers = read_workers) as executor:
+            results = list(executor.map(read_json_for_item_id, [item_jsons[i][1] for i in to_read]))
+    else:
+        results = [read_json_for_item_id(item_jsons[i][1]) for i in to_read]
+    for i in range(len(to_read)):
+        item_ids[to_read[i]] = results[i]
+    new_cache = {keys[i]:[stats[i].st_size, stats[i].st_mtime_ns, item_ids[i]] for i in range(len(item_jsons))}
+    if new_cache != cache:
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok = True)
+            with open(cache_file, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(new_cache))
+        except OSError:
+            pass # Failing to write the cache is not an error
+    return([{'shop_id': item_jsons[i][0], 'item_id': item_ids[i]} for i in range(len(item_jsons)) if item_ids[i] >= 0])
 
 def build_shop_item(shop_id, item_id, game_type = 4):
     if game_type in [3,4,5]:
@@ -57,43 +79,125 @@ def build_shop_item(shop_id, item_id, game_type = 4):
         entry = struct.pack('<5H', shop_id, item_id, 0, 0, 0)
     return({'type':'ShopItem','data':entry})
 
+# New items go after the last item already in their shop, or at the end of the table for new shops.  The last
+# position of every shop is found in one scan, and the new records are merged in one pass.
 def add_items_to_table(table_data, new_items, game_type = 4):
-    new_item_dict = {x:[y for y in new_items if y['shop_id'] == x] for x in list(set([z['shop_id'] for z in new_items]))}
+    new_item_dict = {}
+    for new_item in new_items:
+        new_item_dict.setdefault(new_item['shop_id'], []).append(build_shop_item(new_item['shop_id'], new_item['item_id'], game_type))
+    shop_id_column = read_shop_id_numbers(table_data)
+    last_position = {}
+    for i in range(len(shop_id_column)):
+        if shop_id_column[i] in new_item_dict:
+            last_position[shop_id_column[i]] = i
+    insert_after = {last_position[x]:new_item_dict[x] for x in last_position}
+    merged_table_data = []
+    for i in range(len(table_data)):
+        merged_table_data.append(table_data[i])
+        if i in insert_after:
+            merged_table_data.extend(insert_after[i])
     for shop_id in new_item_dict:
-        # Parsing the table every time is admittedly not efficient, but once per shop isn't bad
-        shop_id_column = read_shop_id_numbers(table_data)
-        if shop_id in shop_id_column:
-            #Find the index of the *last* item in the shop
-            insertion = len(shop_id_column)-shop_id_column[::-1].index(shop_id)
-        else:
-            #Append to the end of the list
-            insertion = len(shop_id_column)
-        for i in range(len(new_item_dict[shop_id])):
-            table_data.insert(insertion+i, build_shop_item(new_item_dict[shop_id][i]['shop_id'], new_item_dict[shop_id][i]['item_id'], game_type))
-    return(table_data)
+        if shop_id not in last_position:
+            merged_table_data.extend(new_item_dict[shop_id])
+    return(merged_table_data)
 
 def generate_table(table_data, section_data):
     if not all([x['type'] in [x['name'] for x in section_data] for x in table_data]):
         input("Attempting to add sections that do not belong!  Is the original table correct?  Press Enter to abort.")
         raise
-    section_counts = {x['name']:0 for x in section_data}
-    table_block_data = b''
+    table = tbl_writer([x['name'] for x in section_data])
     for i in range(len(table_data)):
-        table_block_data += table_data[i]['type'].encode() + b'\x00' + struct.pack('<H', len(table_data[i]['data'])) + table_data[i]['data']
-        section_counts[table_data[i]['type']] += 1
-    table_header_data = b''
-    for k in section_counts:
-        table_header_data += k.encode() + b'\x00' + struct.pack('<i', section_counts[k])
-    return(struct.pack('<hi', len(table_data), len(section_counts)) + table_header_data + table_block_data)
+        table.add_record(table_data[i]['type'], table_data[i]['data'])
+    return(table.getvalue())
+
+# The items added by this script are recorded in .ed8cache (which read_items() does not see), along with the hash of
+# the table that was written, so that update_tbl() knows which records it can remove.
+def read_shop_state (state_file = '.ed8cache/shop_items.json'):
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.loads(f.read())
+        return({'table_hash': state['table_hash'], 'items': set([tuple(x) for x in state['items']])})
+    except (OSError, ValueError, KeyError, TypeError):
+        return({'table_hash': '', 'items': set()})
+
+def write_shop_state (table_bytes, added_items, state_file = '.ed8cache/shop_items.json'):
+    os.makedirs(os.path.dirname(state_file), exist_ok = True)
+    with open(state_file, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'table_hash': hashlib.sha1(table_bytes).hexdigest(), 'items': sorted([list(x) for x in added_items])}))
+    return
+
+# Removes one record for each (shop_id, item_id), the last one in the table (the one added after the shop's own items)
+def remove_items_from_table(table_data, old_items):
+    to_remove = {}
+    for old_item in old_items:
+        to_remove[(old_item['shop_id'], old_item['item_id'])] = to_remove.get((old_item['shop_id'], old_item['item_id']), 0) + 1
+    shop_id_column = read_shop_id_numbers(table_data)
+    kept_table_data = []
+    for i in reversed(range(len(table_data))):
+        if shop_id_column[i] != -1:
+            key = (shop_id_column[i], struct.unpack('<H', table_data[i]['data'][2:4])[0])
+            if to_remove.get(key, 0) > 0:
+                to_remove[key] -= 1
+                continue
+        kept_table_data.append(table_data[i])
+    return(kept_table_data[::-1])
 
 def process_tbl (table = 't_shop.tbl', game_type = 4):
     original_table = table + '.original'
     table_data, section_data, game_type = read_id_numbers_with_offsets(original_table)
-    table_data = add_items_to_table(table_data, read_items(), game_type)
+    new_items = read_items()
+    table_data = add_items_to_table(table_data, new_items, game_type)
+    table_bytes = generate_table(table_data, section_data)
+    with open(table, 'wb') as f:
+        f.write(table_bytes)
+    write_shop_state(table_bytes, [(x['shop_id'], x['item_id']) for x in new_items])
+
+# Updates the existing table instead of starting over from the original.  Items that are already in their shop are
+# skipped, items added by this script whose .json files are gone are removed, and shops whose folders have not
+# changed are left alone.  The table is only written if something changed.
+def update_tbl (table = 't_shop.tbl', game_type = 4):
+    if not os.path.exists(table):
+        shutil.copy2(table + '.original', table)
+    with open(table, 'rb') as f:
+        table_hash = hashlib.sha1(f.read()).hexdigest()
+    state = read_shop_state()
+    if state['table_hash'] != table_hash:
+        if len(state['items']) > 0:
+            print("{0} has been changed since it was last written by this script, items it added before will not be removed.".format(table))
+        state['items'] = set()
+    table_data, section_data, game_type = read_id_numbers_with_offsets(table)
+    shop_id_column = read_shop_id_numbers(table_data)
+    current_items = set([(shop_id_column[i], struct.unpack('<H', table_data[i]['data'][2:4])[0]) for i in range(len(table_data)) if shop_id_column[i] != -1])
+    folder_items = [(x['shop_id'], x['item_id']) for x in read_items()]
+    to_remove = state['items'] - set(folder_items)
+    to_add = [] # In folder order, like process_tbl()
+    for folder_item in folder_items:
+        if folder_item not in state['items'] and folder_item not in current_items and folder_item not in to_add:
+            to_add.append(folder_item)
+    if len(to_remove) == 0 and len(to_add) == 0:
+        print("No changes to {0}.".format(table))
+        return
+    table_data = remove_items_from_table(table_data, [{'shop_id': x[0], 'item_id': x[1]} for x in to_remove])
+    table_data = add_items_to_table(table_data, [{'shop_id': x[0], 'item_id': x[1]} for x in to_add], game_type)
+    table_bytes = generate_table(table_data, section_data)
     with open(table, 'wb') as f:
-        f.write(generate_table(table_data, section_data))
+        f.write(table_bytes)
+    write_shop_state(table_bytes, (state['items'] - to_remove) | set(to_add))
+    print("Added {0} and removed {1} items in {2} shops.".format(len(to_add), len(to_remove),\
+        len(set([x[0] for x in to_remove] + [x[0] for x in to_add]))))
+    return
 
 if __name__ == "__main__":
     # Set current directory
     os.chdir(os.path.abspath(os.path.dirname(__file__)))
-    process_tbl('t_shop.tbl')
+    if len(sys.argv) > 1:
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument('-u', '--update', help="Update t_shop.tbl in place instead of starting over from t_shop.tbl.original.", action="store_true")
+        args = parser.parse_args()
+        if args.update:
+            update_tbl('t_shop.tbl')
+        else:
+            process_tbl('t_shop.tbl')
+    else:
+        process_tbl('t_shop.tbl')
@@ -3,29 +3,30 @@
 #
 # GitHub eArmada8/ed8_dlc_tables
 
-import struct, re, os, glob, sys, shutil
+import struct, os, glob, sys, json, mmap
+from ed8_tbl_codec import read_null_terminated_string, read_tbl_header, read_tbl_records, read_tbl, is_cle_encrypted,\
+    is_cle_encrypted_data
+from ed8_id_allocator import id_allocator
+from ed8_scan_cache import table_scan_cache, scan_tables
+from ed8_table_transaction import table_transaction, interrupted_commit_pending
+from ed8_tbl_repair import repair_tbl_data
+from ed8_install_tables import find_install_tables, select_tables, find_master_item_table, find_dlc_dats, table_kinds
+from ed8_cle_decrypt import decryption_available, decrypt_cle_data_cached, decrypt_tables
 
-try:
-    import blowfish
-    key = b'ed8psv5_steam'
-    cipher = blowfish.Cipher(key)
-except:
-    pass
-
-# This script skips encrypted tables by default, change to True to attempt decrypting tables.
+# This script skips encrypted tables by default, change to True to attempt decrypting tables.  Decrypted tables
+# replace the encrypted ones in the game folders, so that conflicts in them can be fixed.
 attempt_cle_decrypt = False
 
-# Thank you to authors of Kuro Tools for the original decrypt function and to wheat32 for the key
-# https://github.com/nnguyen259/KuroTools
-# https://github.com/wheat32/HajimariQuickTranslation
+# Parsed tables are cached in .ed8cache so that unchanged tables are not parsed again on the next run.
+# Change use_scan_cache to False to disable, or scan_cache_hash to True to also check the contents of cached
+# tables (slower, but does not rely on file modification times).
+use_scan_cache = True
+scan_cache_hash = False
 
-def read_null_terminated_string(f):
-    null_term_string = f.read(1)
-    while null_term_string[-1] != 0:
-        null_term_string += f.read(1)
-    return(null_term_string[:-1].decode('utf-8'))
+# Number of tables to read at the same time, which mostly helps on slow disks.  Set to 1 to read one at a time.
+scan_workers = 8
 
-def detect_ed8_game():
+def detect_ed8_game(interactive = True):
     game_type = 0
     if os.path.exists('bin/'):
         game_exes = [x.replace('\\','/').split('/')[-1] for x in glob.glob('bin/**/*.exe', recursive = True)]
@@ -42,7 +43,7 @@ def detect_ed8_game():
         game_type = 4
     elif 'ed8_ps5' in [x[0:7] for x in game_exes] or 'hnk.exe' in game_exes:
         game_type = 5
-    if game_type not in [2,3,4,5,18]:
+    if game_type not in [2,3,4,5,18] and interactive:
         game_input_raw = input("Game type detection failed (likely non-XSeed CS2, non-NISA CS3/CS4/Reverie or Aksys TXe).  Try with manual type?  Input 2, 3, 4, 5, 18 (TXe).  ")
         try:
             game_input = int(game_input_raw)
@@ -54,284 +55,230 @@ def detect_ed8_game():
             pass
     return(game_type)
 
-def is_cle_encrypted (table_filename):
-    with open(table_filename, 'rb') as f:
-        magic, = struct.unpack("<i", f.read(4))
-        return (magic == 0x40104241)
-
-def valid_tbl (table_filename):
-    with open(table_filename, 'rb') as f:
-        f.seek(0,2)
-        eof = f.tell()
-        f.seek(0,0)
-        total_entries, num_sections = struct.unpack("<hi",f.read(6))
-        section_data = {}
-        section_count = {}
-        for i in range(num_sections):
-            section_name = read_null_terminated_string(f)
-            section_data[section_name], = struct.unpack("<i", f.read(4))
-            section_count[section_name] = 0
-        while f.tell() < eof:
-            entry_type = read_null_terminated_string(f)
-            offset = f.tell()
-            if entry_type == '':
-                if all([x == 0 for x in f.read()]): # We have reached the padding
-                    return False
-            try:
-                block_size, = struct.unpack("<h", f.read(2))
-            except struct.error: 
-                return False
-            if not entry_type in section_data.keys():
-                return False
-            else: 
-                section_count[entry_type] += 1
-            f.seek(block_size,1)
-        for section_name in section_data:
-            if section_data[section_name] != section_count[section_name]:
-                return False
+# Changes to tables are staged in a table_transaction and only written on commit.  If no transaction is given,
+# the change is committed right away.
+def decrypt_haji_cle_file (table_filename, transaction = None):
+    if transaction is None:
+        transaction = table_transaction()
+        success = decrypt_haji_cle_file(table_filename, transaction)
+        transaction.commit()
+        return(success)
+    encrypted_data = bytes(transaction.read(table_filename))
+    if not is_cle_encrypted_data(encrypted_data):
+        return False
+    # Decrypted (or taken from the cache) and validated in memory before anything is staged
+    data = decrypt_cle_data_cached(encrypted_data)
+    if data is None:
+        return False
+    transaction.replace(table_filename, data)
     return True
 
-def decrypt_haji_cle_file (table_filename):
-    with open(table_filename, 'rb') as f:
-        magic, size = struct.unpack('<2I', f.read(8))
-        if (magic == 0x40104241):
-            data = b"".join(cipher.decrypt_ecb(f.read((size//8)*8)))
-        else:
-            return False
-    # Validate before writing!  This script assumes that all encrypted tables are valid.
-    with open(table_filename+'.tmp', 'wb') as f:
-        f.write(data)
-    if valid_tbl(table_filename+'.tmp'):
-        os.rename(table_filename, table_filename+'.original_encrypted')
-        os.rename(table_filename+'.tmp', table_filename)
-        return True
-    else:
-        os.remove(table_filename+'.tmp')
-        return True
-
-# Returns length (true block size)
-def read_table_section (f, entry_type, game_type = 0):
-    # 0 is null-terminated string
-    schema = {2: {'item': [4, 0, 60, 0, 0, 9], 'item_q': [4, 0, 60, 0, 0, 9], 'dlc': [12, 0, 0, 80]}, \
-        3: {'item': [4, 0, 127, 0, 0, 8], 'item_q': [4, 0, 127, 0, 0, 20], 'dlc': [8, 0, 0, 80]}, \
-        4: {'item': [4, 0, 150, 0, 0, 8], 'item_q': [4, 0, 150, 0, 0, 20], 'dlc':  [20, 0, 0, 80]}, \
-        5: {'item': [4, 0, 141, 0, 0], 'item_e': [4, 0, 141, 0, 0, 10], 'item_q': [4, 0, 141, 0, 0, 22], 'dlc': [20, 0, 0, 80]},\
-        18: {'item': [4, 0, 62, 0, 0, 9], 'item_q': [4, 0, 62, 0, 0, 9], 'dlc': [10, 0, 0, 80]}}
-    list_to_read = schema[game_type][entry_type]
-    start = f.tell()
-    for i in range(len(list_to_read)):
-        if list_to_read[i] == 0:
-            data = read_null_terminated_string(f)
-        else:
-            data = f.read(list_to_read[i])
-    return(f.tell() - start)
-
-def repair_tbl (table_filename, game_type = 0):
-    if game_type in [3,4,5]:
-        shutil.copy2(table_filename, table_filename + '.bak')
-        with open(table_filename, 'r+b') as f:
-            f.seek(0,2)
-            eof = f.tell()
-            f.seek(0,0)
-            total_entries, num_sections = struct.unpack("<hi",f.read(6))
-            new_section_data = {}
-            for i in range(num_sections):
-                section_name = read_null_terminated_string(f)
-                new_section_data[section_name] = {'count_offset': f.tell(), 'count': 0}
-                f.seek(4,1)
-            while f.tell() < eof:
-                start_offset = f.tell()
-                entry_type = read_null_terminated_string(f)
-                if entry_type == '':
-                    if all([x == 0 for x in f.read()]): # We have reached the padding
-                        f.seek(start_offset)
-                        f.truncate()
-                        eof = f.tell()
-                        break
-                offset = f.tell()
-                block_size, = struct.unpack("<h", f.read(2))
-                true_block_size = read_table_section (f, entry_type, game_type)
-                f.seek(offset)
-                f.write(struct.pack("<h", true_block_size))
-                f.seek(true_block_size,1)
-                if entry_type in new_section_data:
-                    new_section_data[entry_type]['count'] += 1
-            for entry_type in new_section_data:
-                f.seek(new_section_data[entry_type]['count_offset'],0)
-                f.write(struct.pack('<i', new_section_data[entry_type]['count']))
-        return
+# The table is repaired in memory (see ed8_tbl_repair.py) and staged as a single write.  Returns the report.
+def repair_tbl (table_filename, game_type = 0, transaction = None):
+    if transaction is None:
+        transaction = table_transaction()
+        report = repair_tbl(table_filename, game_type, transaction)
+        transaction.commit()
+        return(report)
+    data = bytes(transaction.read(table_filename))
+    repaired_data, report = repair_tbl_data(data, game_type)
+    if repaired_data is not None and repaired_data != data:
+        transaction.replace(table_filename, repaired_data)
+    return(report)
 
-def read_id_numbers_with_offsets(table):
-    item_numbers = {}
-    with open(table, 'rb') as f:
-        total_entries, num_sections = struct.unpack("<hi",f.read(6))
-        section_data = []
-        for i in range(num_sections):
-            section = {'name': read_null_terminated_string(f),\
-                'num_items': struct.unpack("<i", f.read(4))[0]}
-            section_data.append(section)
-        for i in range(len(section_data)):
-            for j in range(section_data[i]['num_items']):
-                entry_type = read_null_terminated_string(f)
-                offset = f.tell()
-                block_size, = struct.unpack("<h", f.read(2))
-                item_num, = struct.unpack("<h", f.read(2))
-                item_numbers[item_num] = {'table': table, 'entry_type': entry_type, 'offset': offset}
-                f.seek(block_size-2,1)
-    return(item_numbers)
-
-def get_all_id_numbers(item_tables):
-    all_item_numbers = {}
-    for i in range(len(item_tables)):
-        all_item_numbers.update({x:item_tables[i] for x in read_id_numbers_with_offsets(item_tables[i]).keys()})
-    return(all_item_numbers)
-
-def get_item_name_by_item_entry(item_entry, game_type = 0):
-    if game_type in [2,3,4,5,18]:
-        with open(item_entry['table'], 'rb') as f:
-            f.seek(item_entry['offset'] + 6,0)
-            read_null_terminated_string(f) #Flags
-            f.seek({2:0x3c, 3:0x7f, 4:0x96, 5:0x8d, 18:0x3e}[game_type],1)
-            item_name = read_null_terminated_string(f)
-        return(item_name)
-    else:
-        return("")
-
-def get_dlc_name_by_dlc_entry(dlc_entry, game_type = 0):
-    if game_type in [2,3,4,5,18]:
-        with open(dlc_entry['table'], 'rb') as f:
-            f.seek(dlc_entry['offset'],0)
-            f.seek({2:14,3:10, 4:22, 5:22, 18:12}[game_type],1)
-            item_name = read_null_terminated_string(f)
-        return(item_name)
-    else:
-        return("")
+# Reads every table once and maps each ID to all of its occurrences, as a list of
+# {'table', 'entry_type', 'offset', 'name'} in table order.  Also returns the IDs found in each table,
+# in record order.  kind is 'item' for t_item.tbl and 'dlc' for t_dlc.tbl.  If a table_scan_cache
+# is given, unchanged tables are read from the cache instead of being parsed.  The tables are read
+# in parallel, but merged in the order given.
+def build_id_index(tables, game_type = 0, kind = 'item', cache = None, workers = 1):
+    id_index = {}
+    table_ids = {}
+    scans = scan_tables(tables, kind, game_type, cache, workers)
+    for table, scan in zip(tables, scans):
+        table_ids[table] = {} # Used as an ordered set
+        for id_num, entry_type, offset, name in scan:
+            if id_num not in id_index:
+                id_index[id_num] = []
+            id_index[id_num].append({'table': table, 'entry_type': entry_type, 'offset': offset, 'name': name})
+            table_ids[table][id_num] = None
+    return(id_index, table_ids)
+
+def is_dlc_table(table):
+    return(len(table.replace('\\','/').split('/')) > 4)
 
-def replace_item_id_in_t_item (table, old_id, new_id):
+# The DLC folder a table is in, as it is named on disk (e.g. 0201), from the table path found by the install walk
+def dlc_folder_name(table):
+    return(os.path.basename(os.path.dirname(os.path.dirname(table.replace('\\','/')))))
+
+def dlc_folder_number(table):
+    return(int(dlc_folder_name(table)))
+
+# Mirrors replace_item_ids() / replace_dlc_ids() in the index, which change the ID in every table of one DLC folder.
+# Returns the index entries that were moved, whose offsets are where the ID is to be patched.
+def reassign_id_in_index(id_index, table_ids, old_id, new_id, dlc_folder_id):
+    moved = [x for x in id_index[old_id] if is_dlc_table(x['table']) and dlc_folder_number(x['table']) == dlc_folder_id]
+    id_index[old_id] = [x for x in id_index[old_id] if x not in moved]
+    if len(id_index[old_id]) == 0:
+        del(id_index[old_id])
+    if new_id not in id_index:
+        id_index[new_id] = []
+    id_index[new_id].extend(moved)
+    for table in set([x['table'] for x in moved]):
+        table_ids[table] = {(new_id if x == old_id else x):None for x in table_ids[table]}
+    return(moved)
+
+# A patch is [record_offset, entry_type, field_offset, old_id, new_id], where record_offset points at the block size
+# (as in the index) and field_offset is the position of the ID within the block.  Every patch is checked against
+# the record type and the current value first, and if any do not match (the table has changed since the offsets
+# were found), nothing is written and False is returned.  Otherwise the IDs are staged in the transaction, or without
+# a transaction, written directly into a map of the file.
+def check_id_patches (data, patches):
+    for record_offset, entry_type, field_offset, old_id, new_id in patches:
+        type_bytes = entry_type.encode('utf-8') + b'\x00'
+        if record_offset < len(type_bytes) or record_offset + 2 > len(data)\
+                or data[record_offset - len(type_bytes):record_offset] != type_bytes:
+            return(False)
+        block_size, = struct.unpack_from("<h", data, record_offset)
+        if field_offset + 2 > block_size or record_offset + 2 + block_size > len(data)\
+                or struct.unpack_from("<H", data, record_offset + 2 + field_offset)[0] != old_id:
+            return(False)
+    return(True)
+
+def patch_tbl_ids (table, patches, transaction = None):
+    if len(patches) == 0:
+        return(True)
+    if transaction is not None:
+        if not check_id_patches(transaction.read(table), patches):
+            return(False)
+        for record_offset, entry_type, field_offset, old_id, new_id in patches:
+            transaction.write(table, record_offset + 2 + field_offset, struct.pack("<H", new_id))
+        return(True)
     with open(table, 'r+b') as f:
-        total_entries, num_sections = struct.unpack("<hi",f.read(6))
-        section_data = []
-        for i in range(num_sections):
-            section = {'name': read_null_terminated_string(f),\
-                'num_items': struct.unpack("<i", f.read(4))[0]}
-            section_data.append(section)
-        for i in range(len(section_data)):
-            for j in range(section_data[i]['num_items']):
-                entry_type = read_null_terminated_string(f)
-                offset = f.tell()
-                block_size, item_num = struct.unpack("<2h", f.read(4))
-                if item_num == old_id:
-                    f.seek(-2,1)
-                    f.write(struct.pack("<h", new_id))
-                f.seek(offset + 2 + block_size,0)
+        data = mmap.mmap(f.fileno(), 0)
+        try:
+            if not check_id_patches(data, patches):
+                return(False)
+            for record_offset, entry_type, field_offset, old_id, new_id in patches:
+                struct.pack_into("<H", data, record_offset + 2 + field_offset, new_id)
+            data.flush()
+        finally:
+            data.close()
+    return(True)
+
+# Finds the patches for a mapping {old_id: new_id} in one pass over the table.  kind is 'item' for the ID at the start
+# of each record (t_item.tbl item IDs, t_dlc.tbl DLC IDs), 'attach' for the item ID in t_attach.tbl, and 'dlc_items'
+# for the 20 item slots of each t_dlc.tbl record.
+def find_id_patches (table, kind, id_map, game_type = 0, transaction = None):
+    patches = []
+    if transaction is not None:
+        data = bytes(transaction.read(table))
+        total_entries, section_data, offset = read_tbl_header(data)
+        tbl = {'data': data, 'records': read_tbl_records(data, offset, sum([x['num_items'] for x in section_data]))}
+    else:
+        tbl = read_tbl(table)
+    for record in tbl['records']:
+        if kind == 'item':
+            field_offsets = [0]
+        elif kind == 'attach':
+            field_offsets = [6]
+        elif kind == 'dlc_items' and game_type in [2,3,4,5,18]:
+            name, offset = read_null_terminated_string(tbl['data'], record['offset'] + 2 + {2:12, 3:8, 4:20, 5:20, 18:10}[game_type])
+            desc, item_struct_offset = read_null_terminated_string(tbl['data'], offset)
+            field_offsets = [item_struct_offset - (record['offset'] + 2) + x * 4 for x in range(20)]
+        else:
+            field_offsets = []
+        for field_offset in field_offsets:
+            id_num, = struct.unpack_from("<H", tbl['data'], record['offset'] + 2 + field_offset)
+            if id_num in id_map:
+                patches.append([record['offset'], record['type'], field_offset, id_num, id_map[id_num]])
+    return(patches)
+
+# The replace functions take a mapping {old_id: new_id} and patch every record that matches in a single pass per table.
+def replace_item_id_in_t_item (table, id_map, transaction = None):
+    patch_tbl_ids(table, find_id_patches(table, 'item', id_map, 0, transaction), transaction)
     return
 
-def replace_item_id_in_t_attach (table, old_id, new_id):
-    with open(table, 'r+b') as f:
-        total_entries, num_sections = struct.unpack("<hi",f.read(6))
-        section_data = []
-        for i in range(num_sections):
-            section = {'name': read_null_terminated_string(f),\
-                'num_items': struct.unpack("<i", f.read(4))[0]}
-            section_data.append(section)
-        for i in range(len(section_data)):
-            for j in range(section_data[i]['num_items']):
-                entry_type = read_null_terminated_string(f)
-                offset = f.tell()
-                block_size, chr_id, item_type, unk0, item_num = struct.unpack("<5h", f.read(10))
-                if item_num == old_id:
-                    f.seek(-2,1)
-                    f.write(struct.pack("<h", new_id))
-                f.seek(offset + 2 + block_size,0)
+def replace_item_id_in_t_attach (table, id_map, transaction = None):
+    patch_tbl_ids(table, find_id_patches(table, 'attach', id_map, 0, transaction), transaction)
     return
 
-def replace_item_id_in_t_dlc (table, old_id, new_id, game_type = 0):
-    if game_type in [2,3,4,5,18]:
-        with open(table, 'r+b') as f:
-            total_entries, num_sections = struct.unpack("<hi",f.read(6))
-            section_data = []
-            for i in range(num_sections):
-                section = {'name': read_null_terminated_string(f),\
-                    'num_items': struct.unpack("<i", f.read(4))[0]}
-                section_data.append(section)
-            for i in range(len(section_data)):
-                for j in range(section_data[i]['num_items']):
-                    entry_type = read_null_terminated_string(f)
-                    offset = f.tell()
-                    block_size, dlc_id = struct.unpack("<2h", f.read(4))
-                    f.seek(6,1)
-                    if game_type in [4,5]:
-                        f.seek(12,1)
-                    elif game_type == 2:
-                        f.seek(4,1)
-                    elif game_type == 18:
-                        f.seek(2,1)
-                    name = read_null_terminated_string(f)
-                    desc = read_null_terminated_string(f)
-                    item_struct_offset = f.tell()
-                    current_items = [list(struct.unpack("<2h",f.read(4))) for x in range(20)]
-                    if old_id in [x[0] for x in current_items]:
-                        f.seek(item_struct_offset,0)
-                        f.write(struct.pack("<40h",\
-                            *[x for y in [x if not x[0] == old_id else [new_id,x[1]] for x in current_items] for x in y]))
-                    f.seek(offset + 2 + block_size,0)
+def replace_item_id_in_t_dlc (table, id_map, game_type = 0, transaction = None):
+    patch_tbl_ids(table, find_id_patches(table, 'dlc_items', id_map, game_type, transaction), transaction)
     return
 
-def replace_item_id(dlc_id, old_id, new_id, game_type = 0):
-    folder_prefix = ''
-    if game_type in [2,3,4,5]:
-        folder_prefix = 'data/'
-    if game_type == 2:
-        dlc_folder_prefix = folder_prefix+'text_dlc/'
-    else:
-        dlc_folder_prefix = folder_prefix+'dlc/text/'
-    item_tables = [x.replace('\\','/') for x in glob.glob(dlc_folder_prefix+'{:04d}/**/t_item.tbl'.format(dlc_id), recursive = True)]
-    attach_tables = [x.replace('\\','/') for x in glob.glob(dlc_folder_prefix+'{:04d}/**/t_attach.tbl'.format(dlc_id), recursive = True)]
-    dlc_tables = [x.replace('\\','/') for x in glob.glob(dlc_folder_prefix+'{:04d}/**/t_dlc.tbl'.format(dlc_id), recursive = True)]
-    if os.path.exists('dev/'):
-        item_tables_dev = [x.replace('\\','/') for x in glob.glob('dev/'+dlc_folder_prefix+'{:04d}/**/t_item.tbl'.format(dlc_id), recursive = True)]
-        attach_tables_dev = [x.replace('\\','/') for x in glob.glob('dev/'+dlc_folder_prefix+'{:04d}/**/t_attach.tbl'.format(dlc_id), recursive = True)]
-        dlc_tables_dev = [x.replace('\\','/') for x in glob.glob('dev/'+dlc_folder_prefix+'{:04d}/**/t_dlc.tbl'.format(dlc_id), recursive = True)]
-        item_tables = ['dev/'+x if os.path.exists('dev/'+x) else x for x in item_tables]
-        item_tables.extend([x for x in item_tables_dev if x not in item_tables])
-        attach_tables = ['dev/'+x if os.path.exists('dev/'+x) else x for x in attach_tables]
-        attach_tables.extend([x for x in attach_tables_dev if x not in attach_tables])
-        dlc_tables = ['dev/'+x if os.path.exists('dev/'+x) else x for x in dlc_tables]
-        dlc_tables.extend([x for x in dlc_tables_dev if x not in dlc_tables])
+# All the tables of one kind in a DLC folder (with dev/ overlays in place), in every language.  Pass install (from
+# find_install_tables()) to look up several folders without walking the game folders each time.
+def get_dlc_folder_tables(dlc_folder_id, table_name, game_type = 0, install = None):
+    if install is None:
+        install = find_install_tables(game_type)
+    text_folder = 'text_dlc' if game_type == 2 else 'text'
+    return([x for x in select_tables(install, table_kinds[table_name], 'dlc', text_folder, folder = '{0:04d}'.format(dlc_folder_id))\
+        if x.split('/')[-1] == table_name])
+
+# known_patches is {table: patches} for tables whose record offsets are already known from the index.  Those tables
+# are patched directly, the rest (and any whose offsets turn out to be out of date) are searched.
+def replace_item_ids(dlc_id, id_map, game_type = 0, known_patches = {}, transaction = None, install = None):
+    if install is None:
+        install = find_install_tables(game_type)
+    item_tables = get_dlc_folder_tables(dlc_id, 't_item.tbl', game_type, install)
+    attach_tables = get_dlc_folder_tables(dlc_id, 't_attach.tbl', game_type, install)
+    dlc_tables = get_dlc_folder_tables(dlc_id, 't_dlc.tbl', game_type, install)
     for i in range(len(item_tables)):
-        replace_item_id_in_t_item(item_tables[i], old_id, new_id)
+        if not (item_tables[i] in known_patches and patch_tbl_ids(item_tables[i], known_patches[item_tables[i]], transaction)):
+            replace_item_id_in_t_item(item_tables[i], id_map, transaction)
     for i in range(len(attach_tables)):
-        replace_item_id_in_t_attach(attach_tables[i], old_id, new_id)
+        replace_item_id_in_t_attach(attach_tables[i], id_map, transaction)
     for i in range(len(dlc_tables)):
-        replace_item_id_in_t_dlc(dlc_tables[i], old_id, new_id, game_type)
-    return
+        replace_item_id_in_t_dlc(dlc_tables[i], id_map, game_type, transaction)
+    return(item_tables + attach_tables + dlc_tables)
 
-def replace_dlc_id(dlc_folder_id, old_id, new_id, game_type = 0):
-    folder_prefix = ''
-    if game_type in [2,3,4,5]:
-        folder_prefix = 'data/'
-    if game_type == 2:
-        dlc_folder_prefix = folder_prefix+'text_dlc/'
-    else:
-        dlc_folder_prefix = folder_prefix+'dlc/text/'
-    dlc_tables = [x.replace('\\','/') for x in glob.glob(dlc_folder_prefix+'{:04d}/**/t_dlc.tbl'.format(dlc_folder_id), recursive = True)]
-    if os.path.exists('dev/'):
-        dlc_tables_dev = [x.replace('\\','/') for x in glob.glob('dev/'+dlc_folder_prefix+'{:04d}/**/t_dlc.tbl'.format(dlc_folder_id), recursive = True)]
-        dlc_tables = ['dev/'+x if os.path.exists('dev/'+x) else x for x in dlc_tables]
-        dlc_tables.extend([x for x in dlc_tables_dev if x not in dlc_tables])
+def replace_dlc_ids(dlc_folder_id, id_map, game_type = 0, known_patches = {}, transaction = None, install = None):
+    dlc_tables = get_dlc_folder_tables(dlc_folder_id, 't_dlc.tbl', game_type, install)
     for i in range(len(dlc_tables)):
-        replace_item_id_in_t_item(dlc_tables[i], old_id, new_id)
-    return
+        if not (dlc_tables[i] in known_patches and patch_tbl_ids(dlc_tables[i], known_patches[dlc_tables[i]], transaction)):
+            replace_item_id_in_t_item(dlc_tables[i], id_map, transaction)
+    return(dlc_tables)
 
-def resolve_dlc(allow_low_numbers = False):
+# Groups a list of changes into one mapping per DLC folder, so that each table is only rewritten once.
+# If an ID is renumbered more than once, the mapping goes straight from the original ID to the last one.
+# Changes that carry the index records of the old ID ([table, entry_type, offset]) are patched at those offsets.
+def apply_id_changes(changes, game_type = 0, transaction = None):
+    id_maps = {}
+    for change in changes:
+        id_map = id_maps.setdefault((change['type'], change['dlc_folder']), {})
+        chained = [x for x in id_map if id_map[x] == change['old_id']]
+        for old_id in chained:
+            id_map[old_id] = change['new_id']
+        if len(chained) == 0:
+            id_map[change['old_id']] = change['new_id']
+    known_patches = {}
+    for change in changes:
+        id_map = id_maps[(change['type'], change['dlc_folder'])]
+        if change['old_id'] in id_map: # Not a later step of a chained renumber, which is already covered
+            for table, entry_type, offset in change.get('records', []):
+                known_patches.setdefault(table, []).append([offset, entry_type, 0, change['old_id'], id_map[change['old_id']]])
+    modified_tables = []
+    install = find_install_tables(game_type) if len(id_maps) > 0 else None
+    for (change_type, dlc_folder_id) in id_maps:
+        if change_type == 'item':
+            modified_tables.extend(replace_item_ids(dlc_folder_id, id_maps[(change_type, dlc_folder_id)], game_type, known_patches, transaction, install))
+        else:
+            modified_tables.extend(replace_dlc_ids(dlc_folder_id, id_maps[(change_type, dlc_folder_id)], game_type, known_patches, transaction, install))
+    return(modified_tables)
+
+# Finds the master item table, then the DLC t_item.tbl and t_dlc.tbl tables.  With interactive = False,
+# the first text folder and the English (otherwise the first) dat folder are used instead of asking.
+# Encrypted tables are decrypted (if enabled) and committed with the transaction, or skipped without one.
+# Encrypted tables are left out (after being decrypted in place, if attempt_cle_decrypt is on) unless include_encrypted
+# is True, for callers that only read the tables (load_tbl() decrypts them in memory).
+def get_tables(game_type, interactive = True, transaction = None, include_encrypted = False):
     global attempt_cle_decrypt
-    game_type = detect_ed8_game()
-    folder_prefix = ''
-    if game_type in [2,3,4,5]:
-        folder_prefix = 'data/'
-    text_folders = [x.replace('\\','/').split('/')[-1] for x in glob.glob(folder_prefix+'text*') if not x.replace('\\','/').split('/')[-1] == 'text_dlc']
+    item_tables, dlc_tables, dlc_folder_numbers = [], [], []
+    install = find_install_tables(game_type)
+    text_folders = list(install['master'].keys())
     if len(text_folders) > 0:
-        if len(text_folders) > 1:
+        if len(text_folders) > 1 and interactive:
             print("Multiple text folders found!  Process which set?")
             for i in range(len(text_folders)):
                 print("{0}. {1}".format(i+1, text_folders[i]))
@@ -342,174 +289,381 @@ def resolve_dlc(allow_low_numbers = False):
                 except:
                     pass
             text_folder = text_folders[i]
+        elif 'text' in text_folders:
+            text_folder = 'text'
         else:
             text_folder = text_folders[0]
-        item_tables = glob.glob(folder_prefix+'{}/**/t_item_en.tbl'.format(text_folder), recursive = True)
-        if len(item_tables) < 1:
-            item_tables = glob.glob(folder_prefix+'{}/**/t_item.tbl'.format(text_folder), recursive = True)
-            if len(item_tables) < 1:
-                input("No master item table found, is this script in the root game folder?")
-            else:
-                if len(item_tables) > 1 and 'dat_us' in item_tables[1]:
-                    item_tables = [item_tables[1]]
-                else:
-                    item_tables = [item_tables[0]]
-        else:
-            item_tables = [item_tables[0]]
+        master_item_table = find_master_item_table(install, text_folder)
+        if master_item_table is None:
+            return([], [], [])
+        item_tables = [master_item_table]
         #In reading DLC tables, default to English, otherwise the first option available (usually dat)
-        if os.path.exists (folder_prefix+'text_dlc'): #CS2 mode
-            dlc_folder_prefix = folder_prefix+'text_dlc/'
+        dlc_text_folder, dats = find_dlc_dats(install, text_folder)
+        if dlc_text_folder == 'text_dlc': #CS2 mode
             dat_name = 'dat_us'
+        elif len(dats) > 1 and interactive:
+            print("Multiple dat language folders found!  Process which set?")
+            for i in range(len(dats)):
+                print("{0}. {1}".format(i+1, dats[i]))
+            i = -1
+            while not i in range(len(dats)):
+                try:
+                    i = int(input("Please select a folder set: "))-1
+                except:
+                    pass
+            dat_name = dats[i]
+        elif 'dat_en' in dats:
+            dat_name = 'dat_en'
         else:
-            dlc_folder_prefix = folder_prefix+'dlc/{}/'.format(text_folder)
-            dats = [x.replace('\\','/').split('/')[-1] for x in glob.glob(glob.glob(folder_prefix+'dlc/{}/*'.format(text_folder))[0]+'/*')]
-            if len(dats) > 1:
-                print("Multiple dat language folders found!  Process which set?")
-                for i in range(len(dats)):
-                    print("{0}. {1}".format(i+1, dats[i]))
-                i = -1
-                while not i in range(len(dats)):
-                    try:
-                        i = int(input("Please select a folder set: "))-1
-                    except:
-                        pass
-                dat_name = dats[i]
-            else:
-                dat_name = dats[0]
-        item_tables.extend(sorted(glob.glob(dlc_folder_prefix+'**/{}/t_item.tbl'.format(dat_name), recursive = True)))
-        item_tables = [x.replace('\\','/') for x in item_tables]
-        dlc_tables = [x.replace('\\','/') for x in glob.glob(dlc_folder_prefix+'**/{}/t_dlc.tbl'.format(dat_name), recursive = True)]
-        if os.path.exists('dev/'):
-            item_tables_dev = [x.replace('\\','/') for x in sorted(glob.glob('dev/'+dlc_folder_prefix+'**/{}/t_item.tbl'.format(dat_name), recursive = True))]
-            dlc_tables_dev = [x.replace('\\','/') for x in glob.glob('dev/'+dlc_folder_prefix+'**/{}/t_dlc.tbl'.format(dat_name), recursive = True)]
-            item_tables = ['dev/'+x if os.path.exists('dev/'+x) else x for x in item_tables]
-            item_tables.extend([x for x in item_tables_dev if x not in item_tables])
-            dlc_tables = ['dev/'+x if os.path.exists('dev/'+x) else x for x in dlc_tables]
-            dlc_tables.extend([x for x in dlc_tables_dev if x not in dlc_tables])
-        dlc_folder_numbers = [re.findall(r"\d+", x) for x in dlc_tables]
+            dat_name = dats[0] if len(dats) > 0 else ''
+        item_tables.extend(select_tables(install, 'item', 'dlc', dlc_text_folder, dat_name))
+        dlc_tables = select_tables(install, 'dlc', 'dlc', dlc_text_folder, dat_name)
+        dlc_folder_numbers = [dlc_folder_number(x) for x in dlc_tables if dlc_folder_name(x).isdigit()]
         encrypted_tables = [x for x in item_tables+dlc_tables if is_cle_encrypted(x)]
-        if len(encrypted_tables) > 0 and attempt_cle_decrypt == True:
-            if "blowfish" in sys.modules:
+        if len(encrypted_tables) > 0 and attempt_cle_decrypt == True and transaction is not None:
+            if decryption_available():
+                decrypt_tables(encrypted_tables) # Fills the cache with a pool of workers
                 for i in range(len(encrypted_tables)):
-                    success = decrypt_haji_cle_file(encrypted_tables[i])
+                    success = decrypt_haji_cle_file(encrypted_tables[i], transaction)
                     if not success:
                         print("Did not successfully decrypt {}, will skip.".format(encrypted_tables[i]))
+                transaction.commit()
             else:
                 print("Encrypted tables found, but Blowfish module is not installed, will skip encrypted tables.")
-        item_tables = [x for x in item_tables if not is_cle_encrypted(x)]
-        dlc_tables = [x for x in dlc_tables if not is_cle_encrypted(x)]
+        if not include_encrypted:
+            item_tables = [x for x in item_tables if not is_cle_encrypted(x)]
+            dlc_tables = [x for x in dlc_tables if not is_cle_encrypted(x)]
+    return(item_tables, dlc_tables, dlc_folder_numbers)
+
+# Returns the tables that are valid.  Corrupt tables are repaired and committed with the transaction,
+# or left out if there is no transaction or they cannot be repaired.  The checks are cached with the scans.
+def check_tables(tables, game_type, cache = None, transaction = None):
+    valid_tables = []
+    reports = scan_tables(tables, 'check', game_type, cache, scan_workers)
+    for i in range(len(tables)):
+        if not reports[i]['valid']:
+            if transaction is not None and reports[i]['repairable']:
+                print("{0} corrupt, attempting backup and auto-repair...".format(tables[i]))
+                repair_tbl(tables[i], game_type, transaction)
+            elif transaction is not None:
+                print("{0} corrupt and cannot be repaired ({1}), skipping.".format(tables[i], reports[i]['problems'][-1]))
+                continue
+            else:
+                print("{0} corrupt, skipping.  Run the resolver interactively to auto-repair.".format(tables[i]))
+                continue
+        valid_tables.append(tables[i])
+    if transaction is not None:
+        for table in transaction.commit():
+            if cache is not None:
+                cache.invalidate(table)
+    return(valid_tables)
+
+# Each conflict is settled by choose(kind, id_num, next_available, options, current_option), where options
+# maps the option number to the index entry of each DLC that is allowed to change.  It returns the option
+# to change, or 0 to skip.
+def choose_interactively(kind, id_num, next_available, options, current_option):
+    if kind == 'item':
+        print("Item ID {0} is available, assign {0} to which item? (Do not pick official Falcom items!)".format(next_available))
     else:
-        input("No master item table found, is this script in the root game folder?")
-    #Evaluate for conflicts, one table at a time
-    for i in range(len(item_tables)):
-        if not valid_tbl(item_tables[i]):
-            print("{0} corrupt, attempting backup and auto-repair...".format(item_tables[i]))
-            repair_tbl(item_tables[i], game_type)
-    all_utilized_item_ids = sorted(list(get_all_id_numbers(item_tables).keys()))
-    dlc_ids = sorted(list(get_all_id_numbers(item_tables[1:]).keys()))
-    valid_items = []
+        print("DLC ID {0} is available, assign {0} to which DLC? (Do not pick official Falcom items!)".format(next_available))
+        print("Only allowed changes will be displayed.  In some cases, this may mean no changes are allowed.")
+    for option in sorted(options.keys()):
+        print("{0}. {1} (Table {2})".format(option, options[option]['name'], dlc_folder_number(options[option]['table'])))
+    print("0. Skip")
+    allowed_changes = [0] + sorted(options.keys())
+    table_to_fix = -1
+    while table_to_fix not in allowed_changes:
+        table_to_fix_input = input("Please enter which item should be changed: ")
+        try:
+            table_to_fix = int(table_to_fix_input)
+            if table_to_fix not in allowed_changes:
+                print("Invalid entry!")
+        except ValueError:
+            print("Invalid entry!")
+    return(table_to_fix)
+
+# Policies for non-interactive use: 'newest' renumbers the DLC whose table was modified most recently (usually the
+# DLC that was just installed), 'last' renumbers the DLC that comes later in the load order.
+def policy_chooser(policy = 'newest'):
+    def choose(kind, id_num, next_available, options, current_option):
+        if len(options) == 0:
+            return(0)
+        if policy == 'newest':
+            return(sorted(options.keys(), key = lambda x: (os.path.getmtime(options[x]['table']), x == current_option))[-1])
+        elif current_option in options:
+            return(current_option)
+        else:
+            return(sorted(options.keys())[0])
+    return(choose)
+
+# Walks the item tables in order and settles each item ID conflict with choose().  Returns the changes made
+# (or only planned, if there is no transaction), the conflicts that were skipped, and the tables that were written.
+def resolve_item_conflicts(item_tables, game_type, choose, cache = None, allow_low_numbers = False, transaction = None):
+    changes, unresolved, modified_tables = [], [], []
+    if len(item_tables) < 2:
+        return(changes, unresolved, modified_tables)
+    item_index, table_item_ids = build_id_index(item_tables, game_type, 'item', cache, scan_workers)
+    table_order = {item_tables[i]:i for i in range(len(item_tables))}
+    item_ids_in_use = id_allocator(item_index.keys())
+    min_dlc_item_id = min([x for x in item_index if any([table_order[y['table']] > 0 for y in item_index[x]])], default = 0)
     for i in range(len(item_tables)):
-        current_table_items = read_id_numbers_with_offsets(item_tables[i])
-        if any([x in valid_items for x in list(current_table_items.keys())]):
-            # There is a conflict, find the conflicts and address them one at a time
-            conflicts = [x for x in list(current_table_items.keys()) if x in valid_items]
-            all_prior_entries = get_all_id_numbers(item_tables[0:i])
-            for j in range(len(conflicts)):
-                if not get_item_name_by_item_entry(current_table_items[conflicts[j]], game_type) \
-                        == get_item_name_by_item_entry(read_id_numbers_with_offsets(all_prior_entries[conflicts[j]])[conflicts[j]], game_type):
-                    print("Conflict found in {0}, item {1} assigned to {2}.".format(item_tables[i].replace('\\','/'),\
-                        conflicts[j], get_item_name_by_item_entry(current_table_items[conflicts[j]], game_type)))
-                    print("However that item_id is already in use in {0} as {1}.".format(all_prior_entries[conflicts[j]].replace('\\','/'),\
-                        get_item_name_by_item_entry(read_id_numbers_with_offsets(all_prior_entries[conflicts[j]])[conflicts[j]], game_type)))
-                    if allow_low_numbers:
-                        next_available = [x for x in range(max(all_utilized_item_ids)) if x not in all_utilized_item_ids][0]
-                    else:
-                        next_available = [x for x in range(min(dlc_ids), max(all_utilized_item_ids)) if x not in all_utilized_item_ids][0]
-                    print("Item ID {0} is available, assign {0} to which item? (Do not pick official Falcom items!)".format(next_available))
-                    print("1. {0} (Table {1})".format(get_item_name_by_item_entry(current_table_items[conflicts[j]], game_type), \
-                        int(item_tables[i].replace('\\','/').split('/')[-3])))
-                    allowed_changes = [0,1]
-                    # Check if conflict is in DLC table; if yes then either table can be changed, if no then only the current table can be changed.
-                    if len(all_prior_entries[conflicts[j]].replace('\\','/').split('/')) > 4:
-                        print("2. {0} (Table {1})".format(get_item_name_by_item_entry(read_id_numbers_with_offsets(all_prior_entries[conflicts[j]])[conflicts[j]], game_type),\
-                            int(all_prior_entries[conflicts[j]].replace('\\','/').split('/')[-3])))
-                        allowed_changes.append(2)
-                    print("0. Skip")
-                    table_to_fix = -1
-                    while table_to_fix not in allowed_changes:
-                        table_to_fix_input = input("Please enter which item should be changed: ")
-                        try:
-                            table_to_fix = int(table_to_fix_input)
-                            if table_to_fix not in allowed_changes:
-                                print("Invalid entry!")
-                        except ValueError:
-                            print("Invalid entry!")
-                    if table_to_fix == 1:
-                        print("Replacing item ID {0} with {1} in DLC {2}.\n".format(conflicts[j], next_available, item_tables[i].replace('\\','/').split('/')[3]))
-                        replace_item_id(int(item_tables[i].replace('\\','/').split('/')[-3]), conflicts[j], next_available, game_type)
-                        all_utilized_item_ids.append(next_available)
-                    elif table_to_fix == 2:
-                        print("Replacing item ID {0} with {1} in DLC {2}.\n".format(conflicts[j], next_available, all_prior_entries[conflicts[j]].replace('\\','/').split('/')[3]))
-                        replace_item_id(int(all_prior_entries[conflicts[j]].replace('\\','/').split('/')[-3]), conflicts[j], next_available, game_type)
-                        all_utilized_item_ids.append(next_available)
-                    else:
-                        print("Skipping item ID {0}.".format(conflicts[j]))
-        valid_items.extend(list(read_id_numbers_with_offsets(item_tables[i]).keys()))
-    #Evaluate for dlc ID conflicts, one table at a time
-    all_utilized_dlc_ids = sorted(list(get_all_id_numbers(dlc_tables).keys()))
-    valid_dlcs = []
-    for i in range(len(dlc_tables)):
-        if not valid_tbl(dlc_tables[i]):
-            print("{0} corrupt, attempting backup and auto-repair...".format(dlc_tables[i]))
-            repair_tbl(dlc_tables[i], game_type)
-        current_table_dlcs = read_id_numbers_with_offsets(dlc_tables[i])
-        if any([x in valid_dlcs for x in list(current_table_dlcs.keys())]):
-            # There is a conflict, find the conflicts and report them one at a time
-            conflicts = [x for x in list(current_table_dlcs.keys()) if x in valid_dlcs]
-            all_prior_entries = get_all_id_numbers(dlc_tables[0:i])
-            for j in range(len(conflicts)):
-                print("Warning! Conflict found in {0}, dlc ID {1} also assigned to {2}.".format('/dat'.join(dlc_tables[i].split('/dat')[:-1]),\
-                    conflicts[j], '/dat'.join(all_prior_entries[conflicts[j]].split('/dat')[:-1])))
+        for item_id in list(table_item_ids[item_tables[i]].keys()):
+            prior_entries = [x for x in item_index[item_id] if table_order[x['table']] < i]
+            if len(prior_entries) == 0:
+                continue
+            # There is a conflict, address it using the last table that used the ID before this one
+            current_entry = [x for x in item_index[item_id] if x['table'] == item_tables[i]][-1]
+            prior_entry = prior_entries[-1]
+            if not current_entry['name'] == prior_entry['name']:
+                print("Conflict found in {0}, item {1} assigned to {2}.".format(item_tables[i].replace('\\','/'),\
+                    item_id, current_entry['name']))
+                print("However that item_id is already in use in {0} as {1}.".format(prior_entry['table'].replace('\\','/'),\
+                    prior_entry['name']))
+                # Prefer gaps below the highest ID in use, otherwise the first ID above it
                 if allow_low_numbers:
-                    next_available = [x for x in range(1,200) if x not in all_utilized_dlc_ids+dlc_folder_numbers][0]
+                    next_available = item_ids_in_use.next_free(0)
                 else:
-                    next_available = [x for x in range(20,200) if x not in all_utilized_dlc_ids+dlc_folder_numbers][0]
-                print("DLC ID {0} is available, assign {0} to which DLC? (Do not pick official Falcom items!)".format(next_available))
-                allowed_changes = [0]
-                print("Only allowed changes will be displayed.  In some cases, this may mean no changes are allowed.")
-                if conflicts[j] != int(all_prior_entries[conflicts[j]].replace('\\','/').split('/')[-3]):
-                    print("1. {0} (Table {1})".format(get_dlc_name_by_dlc_entry(read_id_numbers_with_offsets(all_prior_entries[conflicts[j]])[conflicts[j]], game_type),\
-                        int(all_prior_entries[conflicts[j]].replace('\\','/').split('/')[-3])))
-                    allowed_changes.append(1)
-                if conflicts[j] != int(dlc_tables[i].replace('\\','/').split('/')[-3]):
-                    print("2. {0} (Table {1})".format(get_dlc_name_by_dlc_entry(current_table_dlcs[conflicts[j]], game_type), \
-                    int(dlc_tables[i].replace('\\','/').split('/')[-3])))
-                    allowed_changes.append(2)
-                print("0. Skip")
-                table_to_fix = -1
-                while table_to_fix not in allowed_changes:
-                    table_to_fix_input = input("Please enter which item should be changed: ")
-                    try:
-                        table_to_fix = int(table_to_fix_input)
-                        if table_to_fix not in allowed_changes:
-                            print("Invalid entry!")
-                    except ValueError:
-                        print("Invalid entry!")
-                if table_to_fix == 1:
-                    print("Replacing DLC ID {0} with {1} in DLC {2}.\n".format(conflicts[j], next_available, all_prior_entries[conflicts[j]].replace('\\','/').split('/')[3]))
-                    replace_dlc_id(int(all_prior_entries[conflicts[j]].replace('\\','/').split('/')[-3]), conflicts[j], next_available, game_type)
-                    all_utilized_dlc_ids.append(next_available)
-                elif table_to_fix == 2:
-                    print("Replacing DLC ID {0} with {1} in DLC {2}.\n".format(conflicts[j], next_available, dlc_tables[i].replace('\\','/').split('/')[3]))
-                    replace_dlc_id(int(dlc_tables[i].replace('\\','/').split('/')[-3]), conflicts[j], next_available, game_type)
-                    all_utilized_dlc_ids.append(next_available)
+                    next_available = item_ids_in_use.next_free(min_dlc_item_id)
+                options = {1: current_entry}
+                # Check if conflict is in DLC table; if yes then either table can be changed, if no then only the current table can be changed.
+                if is_dlc_table(prior_entry['table']):
+                    options[2] = prior_entry
+                table_to_fix = choose('item', item_id, next_available, options, 1)
+                if table_to_fix in options:
+                    table = options[table_to_fix]['table']
+                    print("{0} item ID {1} with {2} in DLC {3}.\n".format('Replacing' if transaction is not None else 'Will replace',\
+                        item_id, next_available, dlc_folder_name(table)))
+                    moved = reassign_id_in_index(item_index, table_item_ids, item_id, next_available, dlc_folder_number(table))
+                    changes.append({'type': 'item', 'dlc_folder': dlc_folder_number(table), 'old_id': item_id, 'new_id': next_available,\
+                        'table': table, 'name': options[table_to_fix]['name'], 'records': [[x['table'], x['entry_type'], x['offset']] for x in moved]})
+                    item_ids_in_use.mark_used(next_available)
                 else:
-                    print("Skipping item ID {0}.".format(conflicts[j]))
-        valid_dlcs.extend(list(read_id_numbers_with_offsets(dlc_tables[i]).keys()))
+                    print("Skipping item ID {0}.".format(item_id))
+                    unresolved.append({'type': 'item', 'id': item_id, 'tables': [current_entry['table'], prior_entry['table']]})
+    if transaction is not None:
+        apply_id_changes(changes, game_type, transaction)
+        modified_tables = transaction.commit()
+    return(changes, unresolved, modified_tables)
+
+# Walks the dlc tables in order and settles each DLC ID conflict with choose(), same returns as resolve_item_conflicts().
+# DLC IDs that match their folder number are never changed.
+def resolve_dlc_conflicts(dlc_tables, dlc_folder_numbers, game_type, choose, cache = None, allow_low_numbers = False, transaction = None):
+    changes, unresolved, modified_tables = [], [], []
+    dlc_index, table_dlc_ids = build_id_index(dlc_tables, game_type, 'dlc', cache, scan_workers)
+    table_order = {dlc_tables[i]:i for i in range(len(dlc_tables))}
+    dlc_ids_in_use = id_allocator(list(dlc_index.keys()) + dlc_folder_numbers)
+    for i in range(len(dlc_tables)):
+        for dlc_id in list(table_dlc_ids[dlc_tables[i]].keys()):
+            prior_entries = [x for x in dlc_index[dlc_id] if table_order[x['table']] < i]
+            if len(prior_entries) == 0:
+                continue
+            # There is a conflict, report it using the last table that used the ID before this one
+            current_entry = [x for x in dlc_index[dlc_id] if x['table'] == dlc_tables[i]][-1]
+            prior_entry = prior_entries[-1]
+            print("Warning! Conflict found in {0}, dlc ID {1} also assigned to {2}.".format('/dat'.join(dlc_tables[i].split('/dat')[:-1]),\
+                dlc_id, '/dat'.join(prior_entry['table'].split('/dat')[:-1])))
+            if allow_low_numbers:
+                next_available = dlc_ids_in_use.next_free(1, 200)
+            else:
+                next_available = dlc_ids_in_use.next_free(20, 200)
+            options = {}
+            if dlc_id != dlc_folder_number(prior_entry['table']):
+                options[1] = prior_entry
+            if dlc_id != dlc_folder_number(dlc_tables[i]):
+                options[2] = current_entry
+            if next_available == -1:
+                print("No DLC ID below 200 is available, skipping DLC ID {0}.".format(dlc_id))
+                table_to_fix = 0
+            else:
+                table_to_fix = choose('dlc', dlc_id, next_available, options, 2)
+            if table_to_fix in options:
+                table = options[table_to_fix]['table']
+                print("{0} DLC ID {1} with {2} in DLC {3}.\n".format('Replacing' if transaction is not None else 'Will replace',\
+                    dlc_id, next_available, dlc_folder_name(table)))
+                moved = reassign_id_in_index(dlc_index, table_dlc_ids, dlc_id, next_available, dlc_folder_number(table))
+                changes.append({'type': 'dlc', 'dlc_folder': dlc_folder_number(table), 'old_id': dlc_id, 'new_id': next_available,\
+                    'table': table, 'name': options[table_to_fix]['name'], 'records': [[x['table'], x['entry_type'], x['offset']] for x in moved]})
+                dlc_ids_in_use.mark_used(next_available)
+            else:
+                if next_available != -1:
+                    print("Skipping item ID {0}.".format(dlc_id))
+                unresolved.append({'type': 'dlc', 'id': dlc_id, 'tables': [prior_entry['table'], current_entry['table']]})
+    if transaction is not None:
+        apply_id_changes(changes, game_type, transaction)
+        modified_tables = transaction.commit()
+    return(changes, unresolved, modified_tables)
+
+# Finds and settles all conflicts with choose().  With apply_changes = False, nothing in the game folder is written
+# (corrupt tables are skipped, not repaired) and the result is a plan that apply_resolution_plan() can carry out.
+def find_and_resolve_conflicts(choose, allow_low_numbers = False, apply_changes = True, interactive = True):
+    global use_scan_cache, scan_cache_hash
+    cache = table_scan_cache(use_hash = scan_cache_hash) if use_scan_cache else None
+    transaction = table_transaction() if apply_changes else None
+    if transaction is None and interrupted_commit_pending():
+        print("Warning! The last run was interrupted, and its unfinished changes will be undone on the next run that changes tables.")
+    game_type = detect_ed8_game(interactive)
+    item_tables, dlc_tables, dlc_folder_numbers = get_tables(game_type, interactive, transaction)
+    if len(item_tables) < 1:
+        return({'game_type': game_type, 'changes': [], 'unresolved': [], 'skipped_tables': [], 'error': 'No master item table found'})
+    valid_item_tables = check_tables(item_tables, game_type, cache, transaction)
+    item_changes, item_unresolved, item_modified = resolve_item_conflicts(valid_item_tables, game_type, choose, cache, allow_low_numbers, transaction)
+    valid_dlc_tables = check_tables(dlc_tables, game_type, cache, transaction)
+    dlc_changes, dlc_unresolved, dlc_modified = resolve_dlc_conflicts(valid_dlc_tables, dlc_folder_numbers, game_type, choose, cache, allow_low_numbers, transaction)
+    if cache is not None:
+        for table in item_modified + dlc_modified:
+            cache.invalidate(table)
+        cache.save()
+    return({'game_type': game_type, 'item_tables': valid_item_tables, 'dlc_tables': valid_dlc_tables,\
+        'changes': item_changes + dlc_changes, 'unresolved': item_unresolved + dlc_unresolved,\
+        'skipped_tables': [x for x in item_tables + dlc_tables if x not in valid_item_tables + valid_dlc_tables]})
+
+def resolve_dlc(allow_low_numbers = False):
+    results = find_and_resolve_conflicts(choose_interactively, allow_low_numbers)
+    if 'error' in results:
+        input("No master item table found, is this script in the root game folder?")
+        return
     input("Done resolving all conflicts!  Press Enter to quit.")
     return
 
+# Finds all conflicts without changing any tables, and returns the proposed renumbering as a plan
+def make_resolution_plan(policy = 'newest', allow_low_numbers = False):
+    plan = find_and_resolve_conflicts(policy_chooser(policy), allow_low_numbers, apply_changes = False, interactive = False)
+    plan['policy'] = policy
+    return(plan)
+
+def write_resolution_plan(plan, plan_filename):
+    with open(plan_filename, 'wb') as f:
+        f.write(json.dumps(plan, indent=4).encode("utf-8"))
+    return
+
+def read_resolution_plan(plan_filename):
+    with open(plan_filename, 'r', encoding='utf-8') as f:
+        return(json.loads(f.read()))
+
+# Carries out the changes in a plan, in order.  Changes whose old ID is no longer in its table, or whose new ID has
+# since been taken, are skipped.  Returns True if every change was applied.
+def apply_resolution_plan(plan):
+    global use_scan_cache, scan_cache_hash
+    if 'error' in plan:
+        print("The plan could not be made ({0}), nothing to apply.".format(plan['error']))
+        return(False)
+    cache = table_scan_cache(use_hash = scan_cache_hash) if use_scan_cache else None
+    game_type = plan['game_type']
+    indices = {'item': build_id_index(plan['item_tables'], game_type, 'item', cache, scan_workers),\
+        'dlc': build_id_index(plan['dlc_tables'], game_type, 'dlc', cache, scan_workers)}
+    all_applied = True
+    changes_to_apply = []
+    for change in plan['changes']:
+        id_index, table_ids = indices[change['type']]
+        if change['old_id'] not in table_ids.get(change['table'], {}) or change['new_id'] in id_index:
+            print("Plan is out of date, skipping {0} ID {1} in {2}.".format(change['type'], change['old_id'], change['table']))
+            all_applied = False
+            continue
+        print("Replacing {0} ID {1} with {2} in DLC {3}.".format('item' if change['type'] == 'item' else 'DLC',\
+            change['old_id'], change['new_id'], dlc_folder_name(change['table'])))
+        moved = reassign_id_in_index(id_index, table_ids, change['old_id'], change['new_id'], change['dlc_folder'])
+        changes_to_apply.append(dict(change, records = [[x['table'], x['entry_type'], x['offset']] for x in moved]))
+    transaction = table_transaction()
+    apply_id_changes(changes_to_apply, game_type, transaction)
+    modified_tables = transaction.commit()
+    if cache is not None:
+        for table in modified_tables:
+            cache.invalidate(table)
+        cache.save()
+    return(all_applied)
+
+# Checks every item, DLC, attach and shop table of the game (in every language) without changing anything.  Only new or changed tables
+# are read (the checks are cached with the scans), so this is quick enough to run every time the game is started.
+# Encrypted tables are only checked if they can be decrypted.  Returns {table: report} (see ed8_tbl_repair.py).
+def check_install(game_type = None):
+    global use_scan_cache, scan_cache_hash
+    cache = table_scan_cache(use_hash = scan_cache_hash) if use_scan_cache else None
+    if game_type is None:
+        game_type = detect_ed8_game(interactive = False)
+    tables = [x['table'] for x in find_install_tables(game_type)['tables']]
+    tables = [x for x in tables if decryption_available() or not is_cle_encrypted(x)]
+    reports = scan_tables(tables, 'check', game_type, cache, scan_workers)
+    if cache is not None:
+        cache.save()
+    return({tables[i]:reports[i] for i in range(len(tables))})
+
+def print_check_reports(reports):
+    corrupt_tables = [x for x in reports if not reports[x]['valid']]
+    for table in corrupt_tables:
+        print("{0} is corrupt{1}:".format(table, '' if reports[table]['repairable'] else ' and cannot be repaired'))
+        for problem in reports[table]['problems']:
+            print("    {0}".format(problem))
+    print("{0} table(s) checked, {1} corrupt.".format(len(reports), len(corrupt_tables)))
+    return(len(corrupt_tables))
+
+# Undoes all the changes to tables made by the last run (repairs, decryption and renumbering)
+def rollback_last_run():
+    global use_scan_cache
+    restored = table_transaction().rollback()
+    for table in restored:
+        print("Restored {0}.".format(table))
+    if use_scan_cache:
+        cache = table_scan_cache()
+        for table in restored:
+            cache.invalidate(table)
+        cache.save()
+    return(restored)
+
+def print_resolution_plan(plan):
+    for table in plan['skipped_tables']:
+        print("Corrupt table (not checked): {0}".format(table))
+    for change in plan['changes']:
+        print("{0} ID {1} -> {2} in DLC {3} ({4})".format('Item' if change['type'] == 'item' else 'DLC',\
+            change['old_id'], change['new_id'], dlc_folder_name(change['table']), change['name']))
+    for conflict in plan['unresolved']:
+        print("Unresolved {0} ID {1} conflict: {2}".format(conflict['type'], conflict['id'], ', '.join(conflict['tables'])))
+    print("{0} change(s), {1} unresolved conflict(s), {2} corrupt table(s).".format(len(plan['changes']),\
+        len(plan['unresolved']), len(plan['skipped_tables'])))
+    return
+
 if __name__ == "__main__":
-    # Set current directory
-    os.chdir(os.path.abspath(os.path.dirname(__file__)))
-    resolve_dlc()
+    if len(sys.argv) > 1:
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument('-d', '--dry_run', help="Report conflicts and the changes that would be made without changing any tables.  Exits with 1 if there are conflicts.", action="store_true")
+        parser.add_argument('-p', '--plan', help="Write the changes that would be made to a JSON plan file, without changing any tables.")
+        parser.add_argument('-a', '--apply', help="Carry out the changes in a JSON plan file.")
+        parser.add_argument('--policy', help="Which DLC to renumber without asking: newest (most recently modified, default) or last (later in load order).", choices=['newest', 'last'], default='newest')
+        parser.add_argument('-c', '--check', help="Check every table for corruption without changing anything.  Exits with 1 if any table is corrupt.", action="store_true")
+        parser.add_argument('-r', '--rollback', help="Undo all the table changes made by the last run of this script.  Run again to undo the run before that, and so on.", action="store_true")
+        parser.add_argument('-l', '--allow_low_numbers', help="Allow new item IDs below the lowest DLC item ID, and DLC IDs below 20.", action="store_true")
+        args = parser.parse_args()
+        # Plan files are relative to the folder the script was run from, not the game folder
+        if args.plan:
+            args.plan = os.path.abspath(args.plan)
+        if args.apply:
+            args.apply = os.path.abspath(args.apply)
+        # Set current directory
+        os.chdir(os.path.abspath(os.path.dirname(__file__)))
+        if args.rollback:
+            if len(rollback_last_run()) == 0:
+                print("Nothing to roll back.")
+        elif args.check:
+            reports = check_install()
+            if len(reports) == 0:
+                print("No master item table found, is this script in the root game folder?")
+                sys.exit(2)
+            sys.exit(1 if print_check_reports(reports) > 0 else 0)
+        elif args.apply:
+            sys.exit(0 if apply_resolution_plan(read_resolution_plan(args.apply)) else 1)
+        elif args.plan or args.dry_run:
+            plan = make_resolution_plan(args.policy, args.allow_low_numbers)
+            if 'error' in plan:
+                print("No master item table found, is this script in the root game folder?")
+                sys.exit(2)
+            if args.plan:
+                write_resolution_plan(plan, args.plan)
+            print_resolution_plan(plan)
+            if args.dry_run and (len(plan['changes']) + len(plan['unresolved']) + len(plan['skipped_tables'])) > 0:
+                sys.exit(1)
+        else:
+            resolve_dlc(args.allow_low_numbers)
+    else:
+        # Set current directory
+        os.chdir(os.path.abspath(os.path.dirname(__file__)))
+        resolve_dlc()
@@ -10,46 +10,31 @@
 #
 # GitHub eArmada8/ed8_dlc_tables
 
-import struct, os, glob, sys
+import os, sys
+from ed8_scan_cache import table_scan_cache, scan_tables
+from ed8_install_tables import find_install_tables, select_tables
 
-def read_null_terminated_string(f):
-    null_term_string = f.read(1)
-    while null_term_string[-1] != 0:
-        null_term_string += f.read(1)
-    return(null_term_string[:-1].decode('utf-8'))
+# Parsed tables are cached in .ed8cache so that unchanged tables are not parsed again on the next run.
+# Change use_scan_cache to False to disable, or scan_cache_hash to True to also check the contents of cached
+# tables (slower, but does not rely on file modification times).
+use_scan_cache = True
+scan_cache_hash = False
 
-def read_id_numbers(table):
-    item_numbers = []
-    with open(table, 'rb') as f:
-        total_entries, num_sections = struct.unpack("<hi",f.read(6))
-        section_data = []
-        for i in range(num_sections):
-            section = {'name': read_null_terminated_string(f),\
-                'num_items': struct.unpack("<i", f.read(4))[0]}
-            section_data.append(section)
-        for i in range(len(section_data)):
-            for j in range(section_data[i]['num_items']):
-                entry_type = read_null_terminated_string(f)
-                block_size, = struct.unpack("<h", f.read(2))
-                item_num, = struct.unpack("<h", f.read(2))
-                item_numbers.append(item_num)
-                f.seek(block_size-2,1)
-    return(item_numbers)
+# Number of tables to read at the same time, which mostly helps on slow disks.  Set to 1 to read one at a time.
+scan_workers = 8
 
 def get_all_id_numbers():
-    dlc_tables = glob.glob('data/dlc/**/t_dlc.tbl', recursive = True) \
-        + glob.glob('data/text_dlc/**/t_dlc.tbl', recursive = True) \
-        + glob.glob('text/**/t_dlc.tbl', recursive = True) \
-        + glob.glob('dlc/**/t_dlc.tbl', recursive = True)
-    dlc_tables = [x.replace('\\','/') for x in dlc_tables]
-    if os.path.exists('dev/'):
-        dlc_tables_dev = [x.replace('\\','/') for x in glob.glob('dev/**/t_dlc.tbl', recursive = True)]
-        dlc_tables = ['dev/'+x if os.path.exists('dev/'+x) else x for x in dlc_tables]
-        dlc_tables.extend([x for x in dlc_tables_dev if not x in dlc_tables])
+    install = find_install_tables()
+    # TXe keeps the official DLC tables in the master text folder (once extracted from System.bra)
+    dlc_tables = select_tables(install, 'dlc', None if install['folder_prefix'] == '' else 'dlc')
+    cache = table_scan_cache(use_hash = scan_cache_hash) if use_scan_cache else None
     all_dlc_numbers = []
+    scans = scan_tables(dlc_tables, cache = cache, workers = scan_workers)
     for i in range(len(dlc_tables)):
         print("Checking {0}...".format(dlc_tables[i]))
-        all_dlc_numbers.extend(read_id_numbers(dlc_tables[i]))
+        all_dlc_numbers.extend([x[0] for x in scans[i]])
+    if cache is not None:
+        cache.save()
     return(sorted(list(set(all_dlc_numbers))))
 
 def check_id_number(all_dlc_numbers, number = -1):
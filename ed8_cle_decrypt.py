@@ -0,0 +1,72 @@
+# In-memory decryption of CLE-encrypted tables (Trails into Reverie, Steam).  Tables are decrypted and checked
+# without writing anything to the game folders, and the decrypted tables are cached in .ed8cache/cle, named by
+# the hash of the encrypted file, so that the Blowfish work is only done once for each version of a table.
+# Requires the blowfish module (pip install blowfish).  Delete the .ed8cache folder at any time to clear the cache.
+#
+# GitHub eArmada8/ed8_dlc_tables
+
+import os, struct, hashlib, concurrent.futures
+from ed8_tbl_codec import valid_tbl_data, is_cle_encrypted_data
+
+try:
+    import blowfish
+    key = b'ed8psv5_steam'
+    cipher = blowfish.Cipher(key)
+except:
+    cipher = None
+
+# Thank you to authors of Kuro Tools for the original decrypt function and to wheat32 for the key
+# https://github.com/nnguyen259/KuroTools
+# https://github.com/wheat32/HajimariQuickTranslation
+
+cle_cache_dir = '.ed8cache/cle'
+
+def decryption_available ():
+    return(cipher is not None)
+
+# Returns the decrypted table, or None if the data is not encrypted, cannot be decrypted or is not a valid table
+def decrypt_cle_data (encrypted_data):
+    if cipher is None or not is_cle_encrypted_data(encrypted_data):
+        return(None)
+    magic, size = struct.unpack_from('<2I', encrypted_data, 0)
+    data = b"".join(cipher.decrypt_ecb(bytes(encrypted_data[8:8+(size//8)*8])))
+    try:
+        if valid_tbl_data(data):
+            return(data)
+    except (ValueError, struct.error):
+        pass
+    return(None)
+
+# Same as decrypt_cle_data(), using (and filling) the cache
+def decrypt_cle_data_cached (encrypted_data, cache_dir = cle_cache_dir):
+    if not is_cle_encrypted_data(encrypted_data):
+        return(None)
+    cache_file = os.path.join(cache_dir, hashlib.sha1(encrypted_data).hexdigest() + '.tbl')
+    if os.path.exists(cache_file):
+        with open(cache_file, 'rb') as f:
+            return(f.read())
+    data = decrypt_cle_data(encrypted_data)
+    if data is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok = True)
+            # Several processes may decrypt the same table at once, so each writes its own temporary file
+            with open(cache_file + '.{0}.tmp'.format(os.getpid()), 'wb') as f:
+                f.write(data)
+            os.replace(cache_file + '.{0}.tmp'.format(os.getpid()), cache_file)
+        except OSError:
+            pass # Failing to write the cache is not an error
+    return(data)
+
+def load_decrypted (table_filename, cache_dir = cle_cache_dir):
+    with open(table_filename, 'rb') as f:
+        return(decrypt_cle_data_cached(f.read(), cache_dir))
+
+# Decrypts a list of tables in a pool of worker processes (Blowfish is slow in Python), filling the cache.
+# Returns {table_filename: decrypted data, or None if it could not be decrypted}.
+def decrypt_tables (tables, workers = None, cache_dir = cle_cache_dir):
+    if len(tables) > 1 and workers != 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+            results = list(executor.map(load_decrypted, tables, [cache_dir] * len(tables)))
+    else:
+        results = [load_decrypted(x, cache_dir) for x in tables]
+    return({tables[i]:results[i] for i in range(len(tables))})
@@ -0,0 +1,127 @@
+# Free ID allocator for item and DLC ID numbers, used by dlc_conflict_resolver.py, item_id_checker.py
+# and dlc_id_checker.py.  Used IDs are kept as a sorted list of non-overlapping [start, end) intervals, so
+# checking an ID or finding the next free one is a binary search instead of a scan through every ID in use.
+# Marking an ID used is a binary search plus at most one list insert or delete, which moves the intervals after it.
+# The free blocks of the whole range are also kept in a heap, so that the largest one is found without a scan (blocks
+# only ever shrink or split, so entries that no longer match a free block are dropped when they reach the top).
+# IDs are unsigned 16-bit.
+#
+# GitHub eArmada8/ed8_dlc_tables
+
+import bisect, heapq
+
+class id_allocator:
+    def __init__ (self, used_ids = [], lo = 0, hi = 0x10000):
+        self.lo = lo
+        self.hi = hi
+        self.starts = []
+        self.ends = []
+        # Build the intervals directly from the sorted IDs, rather than one insert at a time
+        for id_num in sorted(set(used_ids)):
+            if len(self.ends) > 0 and self.ends[-1] == id_num:
+                self.ends[-1] = id_num + 1
+            else:
+                self.starts.append(id_num)
+                self.ends.append(id_num + 1)
+        self.free_heap = [(start - end, start) for start, end in self.free_blocks()]
+        heapq.heapify(self.free_heap)
+
+    # Index of the interval that contains id_num, or -1
+    def find_interval (self, id_num):
+        i = bisect.bisect_right(self.starts, id_num) - 1
+        if i >= 0 and id_num < self.ends[i]:
+            return(i)
+        return(-1)
+
+    def is_free (self, id_num):
+        return(self.find_interval(id_num) == -1)
+
+    # The free block around a free id_num, within [self.lo, self.hi), as a (start, end) tuple
+    def free_block_around (self, id_num):
+        i = bisect.bisect_right(self.starts, id_num) - 1
+        start = max(self.ends[i] if i >= 0 else self.lo, self.lo)
+        end = min(self.starts[i + 1] if i + 1 < len(self.starts) else self.hi, self.hi)
+        return((start, end))
+
+    def mark_used (self, id_num):
+        i = bisect.bisect_right(self.starts, id_num) - 1
+        if i >= 0 and id_num < self.ends[i]:
+            return
+        if self.lo <= id_num < self.hi:
+            # The block id_num was in is replaced by the free IDs on either side of it
+            block_start, block_end = self.free_block_around(id_num)
+            if id_num > block_start:
+                heapq.heappush(self.free_heap, (block_start - id_num, block_start))
+            if block_end > id_num + 1:
+                heapq.heappush(self.free_heap, (id_num + 1 - block_end, id_num + 1))
+        joins_left = i >= 0 and self.ends[i] == id_num
+        joins_right = i + 1 < len(self.starts) and self.starts[i + 1] == id_num + 1
+        if joins_left and joins_right:
+            self.ends[i] = self.ends[i + 1]
+            del(self.starts[i + 1])
+            del(self.ends[i + 1])
+        elif joins_left:
+            self.ends[i] = id_num + 1
+        elif joins_right:
+            self.starts[i + 1] = id_num
+        else:
+            self.starts.insert(i + 1, id_num)
+            self.ends.insert(i + 1, id_num + 1)
+        return
+
+    # The free blocks in [lo, hi), in order, as (start, end) tuples
+    def free_blocks (self, lo = None, hi = None):
+        lo = self.lo if lo is None else max(lo, 0)
+        hi = self.hi if hi is None else min(hi, 0x10000)
+        i = max(bisect.bisect_right(self.starts, lo) - 1, 0)
+        current = lo
+        while current < hi:
+            if i < len(self.starts) and self.starts[i] <= current:
+                current = max(current, self.ends[i])
+                i += 1
+            else:
+                block_end = min(self.starts[i], hi) if i < len(self.starts) else hi
+                yield((current, block_end))
+                current = block_end
+        return
+
+    # Lowest free ID in [lo, hi), or -1 if there is none.  Touching intervals are always merged, so the end of the
+    # interval that lo is in is free.
+    def next_free (self, lo = None, hi = None):
+        lo = self.lo if lo is None else max(lo, 0)
+        hi = self.hi if hi is None else min(hi, 0x10000)
+        i = self.find_interval(lo)
+        id_num = lo if i == -1 else self.ends[i]
+        return(id_num if id_num < hi else -1)
+
+    # The lowest (up to) count free IDs in [lo, hi)
+    def next_n_free (self, count, lo = None, hi = None):
+        free_ids = []
+        for block in self.free_blocks(lo, hi):
+            free_ids.extend(range(block[0], min(block[1], block[0] + count - len(free_ids))))
+            if len(free_ids) >= count:
+                break
+        return(free_ids)
+
+    # Returns (start, length) of the largest free block in [lo, hi), the lowest one if there is a tie.  Blocks in
+    # the whole range come from the heap; a narrower range is scanned.
+    def largest_free_block (self, lo = None, hi = None):
+        if lo is None and hi is None:
+            while len(self.free_heap) > 0:
+                length, start = -self.free_heap[0][0], self.free_heap[0][1]
+                if self.is_free(start) and self.free_block_around(start) == (start, start + length):
+                    return((start, length))
+                heapq.heappop(self.free_heap)
+            return((-1, 0))
+        largest = (-1, 0)
+        for block in self.free_blocks(lo, hi):
+            if block[1] - block[0] > largest[1]:
+                largest = (block[0], block[1] - block[0])
+        return(largest)
+
+    # Finds the next free ID in [lo, hi) and marks it used
+    def allocate (self, lo = None, hi = None):
+        id_num = self.next_free(lo, hi)
+        if id_num != -1:
+            self.mark_used(id_num)
+        return(id_num)
@@ -0,0 +1,110 @@
+# Finds the item, DLC, attach and shop tables of an installed game for dlc_conflict_resolver.py, item_id_checker.py
+# and dlc_id_checker.py.  The text and DLC folders of the game (and their dev/ overlays) are walked once, and every
+# table is sorted by kind, text folder and language (dat) folder, with tables in dev/ taking the place of the tables
+# they overlay.
+#
+# GitHub eArmada8/ed8_dlc_tables
+
+import os
+
+table_kinds = {'t_item.tbl': 'item', 't_item_en.tbl': 'item', 't_dlc.tbl': 'dlc', 't_attach.tbl': 'attach', 't_shop.tbl': 'shop'}
+folder_prefixes = {2: 'data/', 3: 'data/', 4: 'data/', 5: 'data/', 18: ''}
+
+# Appends the path of every table under folder to found
+def walk_tables (folder, found):
+    try:
+        entries = sorted(os.scandir(folder), key = lambda x: x.name)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir():
+            walk_tables(folder + '/' + entry.name, found)
+        elif entry.name in table_kinds:
+            found.append(folder + '/' + entry.name)
+    return
+
+# The folders that can have tables in them: text* (the master tables), text_dlc (CS2) and dlc/text* (everything else)
+def find_table_roots (folder_prefix):
+    roots = []
+    try:
+        entries = sorted(os.scandir(folder_prefix if folder_prefix != '' else '.'), key = lambda x: x.name)
+    except OSError:
+        return(roots)
+    for entry in entries:
+        if entry.is_dir() and entry.name.startswith('text'):
+            roots.append(folder_prefix + entry.name)
+        elif entry.is_dir() and entry.name == 'dlc':
+            roots.extend([folder_prefix + 'dlc/' + x.name for x in sorted(os.scandir(entry.path), key = lambda x: x.name)\
+                if x.is_dir() and x.name.startswith('text')])
+    return(roots)
+
+# Returns the scope ('master' or 'dlc'), text folder, DLC folder ('' for master tables) and language folder of a table
+# from its path (without dev/)
+def classify_table (table, folder_prefix):
+    parts = table[len(folder_prefix):].split('/')
+    if parts[0] == 'text_dlc':
+        return('dlc', 'text_dlc', parts[1], parts[-2])
+    elif parts[0] == 'dlc':
+        return('dlc', parts[1], parts[2], parts[-2])
+    else:
+        return('master', parts[0], '', parts[-2])
+
+# Walks the install in the current folder.  game_type picks the folder layout; if it is not known, the layout is
+# taken from the folders that are there.  Returns {'folder_prefix', 'overlays': {path: path of the table to use},
+# 'tables': [{'table', 'base', 'kind', 'scope', 'text_folder', 'folder', 'dat'}, ...], 'master': {text folder: {dat: {kind:
+# [tables]}}}, 'dlc': (same as master)}.  Tables are in path order, followed by tables that are only in dev/.
+def find_install_tables (game_type = None):
+    if game_type in folder_prefixes:
+        folder_prefix = folder_prefixes[game_type]
+    else:
+        folder_prefix = 'data/' if os.path.exists('data/') else ''
+    base_tables, dev_tables = [], []
+    for root in find_table_roots(folder_prefix):
+        walk_tables(root, base_tables)
+    if os.path.exists('dev/'):
+        for root in find_table_roots('dev/' + folder_prefix):
+            walk_tables(root, dev_tables)
+    overlays = {x:x for x in base_tables}
+    dev_only_tables = []
+    for table in dev_tables:
+        if table[4:] not in overlays:
+            dev_only_tables.append(table[4:])
+        overlays[table[4:]] = table
+    install = {'folder_prefix': folder_prefix, 'overlays': overlays, 'tables': [], 'master': {}, 'dlc': {}}
+    for base in sorted(base_tables) + sorted(dev_only_tables):
+        scope, text_folder, folder, dat_name = classify_table(base, folder_prefix)
+        kind = table_kinds[base.split('/')[-1]]
+        install['tables'].append({'table': overlays[base], 'base': base, 'kind': kind, 'scope': scope,\
+            'text_folder': text_folder, 'folder': folder, 'dat': dat_name})
+        install[scope].setdefault(text_folder, {}).setdefault(dat_name, {x:[] for x in ['item', 'dlc', 'attach', 'shop']})
+        install[scope][text_folder][dat_name][kind].append(overlays[base])
+    return(install)
+
+# The tables of one kind, in the same order as install['tables'].  Leave scope, text_folder, dat_name or folder as None
+# for all.
+def select_tables (install, kind, scope = None, text_folder = None, dat_name = None, folder = None):
+    return([x['table'] for x in install['tables'] if x['kind'] == kind and scope in [None, x['scope']]\
+        and text_folder in [None, x['text_folder']] and dat_name in [None, x['dat']] and folder in [None, x['folder']]])
+
+# The main item table of a text folder: t_item_en.tbl if there is one, otherwise the one in dat_us (CS2), otherwise the first.
+# item_id_checker.py checks dat_us/t_item.tbl before t_item_en.tbl (prefer_dat_us = True).
+def find_master_item_table (install, text_folder = 'text', prefer_dat_us = False):
+    item_tables = select_tables(install, 'item', 'master', text_folder)
+    dat_us_tables = [x for x in item_tables if x.split('/')[-2] == 'dat_us' and x.endswith('t_item.tbl')]
+    if prefer_dat_us and len(dat_us_tables) > 0:
+        return(dat_us_tables[0])
+    for item_table in item_tables:
+        if item_table.endswith('t_item_en.tbl'):
+            return(item_table)
+    for item_table in item_tables:
+        if item_table.split('/')[-2] == 'dat_us':
+            return(item_table)
+    return(item_tables[0] if len(item_tables) > 0 else None)
+
+# The text folder the DLC tables are under (text_dlc for CS2) and their language folders
+def find_dlc_dats (install, text_folder = 'text'):
+    if 'text_dlc' in install['dlc']:
+        text_folder = 'text_dlc'
+    return(text_folder, list(install['dlc'].get(text_folder, {}).keys()))
@@ -0,0 +1,87 @@
+# Character name index for make_dlc_tbls.py, read from the game's t_name.tbl or from the names CSVs made from it
+# with tbled.  Each file is only parsed when it changes; the index is pickled to a .ed8cache folder (next to the
+# CSV, or wherever the caller chooses), checked against the size and modification time of the file.  Delete the
+# .ed8cache folder at any time to clear the cache.
+#
+# GitHub eArmada8/ed8_dlc_tables
+
+import os, csv, glob, pickle, struct
+from ed8_tbl_codec import load_tbl, read_null_terminated_string, read_tbl_header, read_tbl_records
+
+index_version = 1
+
+# Lookups by model (e.g. C_CHR011) and by character ID.  When a model is listed more than once, the first one is used.
+class name_index:
+    def __init__ (self, chr_ids = {}, chr_names = {}):
+        self.chr_ids = dict(chr_ids) # {model: chr_id}
+        self.chr_names = dict(chr_names) # {chr_id: chr_name}
+
+    def add (self, chr_id, chr_name, model):
+        if model not in self.chr_ids:
+            self.chr_ids[model] = chr_id
+            self.chr_names.setdefault(chr_id, chr_name)
+        return
+
+    def chr_id (self, model, default = None):
+        return(self.chr_ids.get(model, default))
+
+    def chr_name (self, chr_id):
+        return(self.chr_names.get(chr_id, ''))
+
+# Only playable characters (ID below 200) with models named like C_CHR000 are indexed
+def read_names_csv (csv_filename):
+    names = name_index()
+    with open(csv_filename, encoding='utf-8') as csvfile:
+        for row in csv.reader(csvfile, delimiter=','):
+            if not row[0] == 'character' and int(row[0]) < 200 and len(row[2].split("_")) == 2:
+                names.add(int(row[0]), row[1], row[2])
+    return(names)
+
+# Every game starts NameTableData with the character ID, name and model (the first three columns of the CSVs)
+def read_name_table (table_filename):
+    names = name_index()
+    data = load_tbl(table_filename)
+    total_entries, section_data, offset = read_tbl_header(data)
+    for record in read_tbl_records(data, offset, sum([x['num_items'] for x in section_data])):
+        if record['type'] == 'NameTableData':
+            chr_id, = struct.unpack_from("<H", data, record['offset'] + 2)
+            chr_name, offset = read_null_terminated_string(data, record['offset'] + 4)
+            model, offset = read_null_terminated_string(data, offset)
+            if chr_id < 200 and len(model.split("_")) == 2:
+                names.add(chr_id, chr_name, model)
+    return(names)
+
+# The main t_name.tbl of the game installed in game_dir (English if there is a choice), or None
+def find_name_table (game_dir):
+    tables = sorted([x.replace('\\','/') for x in glob.glob(os.path.join(game_dir, 'data', 'text*', '**', 't_name.tbl'), recursive = True)\
+        + glob.glob(os.path.join(game_dir, 'text*', '**', 't_name.tbl'), recursive = True)])
+    tables = [x for x in tables if '/text_dlc/' not in x]
+    for dat_name in ['/dat_en/', '/dat_us/']:
+        if len([x for x in tables if dat_name in x]) > 0:
+            return([x for x in tables if dat_name in x][0])
+    return(tables[0] if len(tables) > 0 else None)
+
+# filename is a names CSV or a t_name.tbl
+def load_name_index (filename, cache_file = None):
+    if cache_file is None:
+        cache_file = os.path.join(os.path.dirname(filename), '.ed8cache', os.path.basename(filename) + '.index')
+    stat = os.stat(filename)
+    try:
+        with open(cache_file, 'rb') as f:
+            cache = pickle.load(f)
+        if cache['version'] == index_version and cache['source'] == os.path.abspath(filename)\
+                and cache['size'] == stat.st_size and cache['mtime'] == stat.st_mtime_ns:
+            return(name_index(cache['chr_ids'], cache['chr_names']))
+    except Exception:
+        pass # Missing, out of date or unreadable cache, parse the file instead
+    names = read_name_table(filename) if filename.endswith('.tbl') else read_names_csv(filename)
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok = True)
+        # Batch builds may write the same cache from several processes at once, so each writes its own temporary file
+        with open(cache_file + '.{0}.tmp'.format(os.getpid()), 'wb') as f:
+            pickle.dump({'version': index_version, 'source': os.path.abspath(filename), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,\
+                'chr_ids': names.chr_ids, 'chr_names': names.chr_names}, f)
+        os.replace(cache_file + '.{0}.tmp'.format(os.getpid()), cache_file)
+    except OSError:
+        pass # Failing to write the cache is not an error
+    return(names)
@@ -0,0 +1,129 @@
+# Persistent cache of parsed .tbl scans for dlc_conflict_resolver.py, item_id_checker.py and dlc_id_checker.py.
+# Stores the IDs, offsets and names of every record of each table in .ed8cache/scan_cache.json in the game
+# root folder, keyed by path and checked against file size and modification time (and optionally a hash
+# of the contents), so that later runs only parse the tables that have changed.  Delete the .ed8cache
+# folder at any time to clear the cache.
+#
+# GitHub eArmada8/ed8_dlc_tables
+
+import os, json, hashlib, struct, concurrent.futures, itertools
+from ed8_tbl_codec import load_tbl, read_tbl_header, read_tbl_records, read_record_id, name_readers, is_cle_encrypted
+from ed8_tbl_repair import check_tbl
+
+cache_version = 1
+
+def hash_file (table_filename):
+    with open(table_filename, 'rb') as f:
+        return(hashlib.sha1(f.read()).hexdigest())
+
+# Parses one table.  kind is 'item' or 'dlc' to also read the record names, or 'ids' for IDs only.
+# Returns a list of [id, entry_type, offset, name], in record order.  kind 'check' returns the report of
+# check_tbl() instead (see ed8_tbl_repair.py).
+def scan_table (table_filename, kind = 'ids', game_type = 0):
+    if kind == 'check':
+        return(check_tbl(table_filename, game_type))
+    data = load_tbl(table_filename)
+    total_entries, section_data, offset = read_tbl_header(data)
+    scan = []
+    for record in read_tbl_records(data, offset, sum([x['num_items'] for x in section_data])):
+        name = ''
+        if kind in name_readers:
+            try:
+                name = name_readers[kind](data, record['offset'] + 2, game_type)
+            except (ValueError, struct.error):
+                pass
+        scan.append([read_record_id(record), record['type'], record['offset'], name])
+    return(scan)
+
+class table_scan_cache:
+    def __init__ (self, cache_file = '.ed8cache/scan_cache.json', use_hash = False):
+        self.cache_file = cache_file
+        self.use_hash = use_hash
+        self.modified = False
+        self.tables = {}
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    cache = json.loads(f.read())
+                if cache['version'] == cache_version:
+                    self.tables = cache['tables']
+            except (ValueError, KeyError, OSError):
+                pass # Corrupt or unreadable cache, start over
+
+    def cache_key (self, table_filename, kind, game_type):
+        return('{0}|{1}|{2}'.format(table_filename.replace('\\','/'), kind, game_type))
+
+    # Returns the cached scan, or None if the table is not cached or has changed
+    def lookup (self, table_filename, kind = 'ids', game_type = 0):
+        entry = self.tables.get(self.cache_key(table_filename, kind, game_type))
+        if entry is not None:
+            stat = os.stat(table_filename)
+            if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+                if not self.use_hash or entry['hash'] == hash_file(table_filename):
+                    return(entry['records'])
+        return(None)
+
+    # stat should be taken before the table is read, so a table that changes while being read is not cached as current
+    def store (self, table_filename, kind, game_type, records, stat):
+        self.tables[self.cache_key(table_filename, kind, game_type)] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,\
+            'hash': hash_file(table_filename) if self.use_hash else '', 'records': records}
+        self.modified = True
+        return
+
+    # Same return as scan_table(), only parsing the table if it is not cached or has changed
+    def scan_table (self, table_filename, kind = 'ids', game_type = 0):
+        records = self.lookup(table_filename, kind, game_type)
+        if records is None:
+            stat = os.stat(table_filename)
+            records = scan_table(table_filename, kind, game_type)
+            self.store(table_filename, kind, game_type, records, stat)
+        return(records)
+
+    # Call after writing to a table, in case the file system does not update the modification time
+    def invalidate (self, table_filename):
+        prefix = table_filename.replace('\\','/') + '|'
+        for key in [x for x in self.tables if x.startswith(prefix)]:
+            del(self.tables[key])
+            self.modified = True
+        return
+
+    # Writes the cache, dropping tables that no longer exist.  Failing to write the cache is not an error.
+    def save (self):
+        for key in [x for x in self.tables if not os.path.exists(x.split('|')[0])]:
+            del(self.tables[key])
+            self.modified = True
+        if self.modified:
+            try:
+                if os.path.dirname(self.cache_file) != '':
+                    os.makedirs(os.path.dirname(self.cache_file), exist_ok = True)
+                with open(self.cache_file + '.tmp', 'w', encoding='utf-8') as f:
+                    f.write(json.dumps({'version': cache_version, 'tables': self.tables}))
+                os.replace(self.cache_file + '.tmp', self.cache_file)
+                self.modified = False
+            except OSError:
+                pass
+        return
+
+# Scans a list of tables, with a pool of worker threads if workers > 1.  Only tables that are not in the cache
+# are read.  The scans are returned in the same order as tables, so callers merge them with the same precedence
+# as a serial scan (master table first, then DLC tables in order, with dev/ overlays already in place of their base).
+def scan_tables (tables, kind = 'ids', game_type = 0, cache = None, workers = 1):
+    scans = [None] * len(tables)
+    if cache is not None:
+        scans = [cache.lookup(x, kind, game_type) for x in tables]
+    to_scan = [i for i in range(len(tables)) if scans[i] is None]
+    stats = [os.stat(tables[i]) for i in to_scan]
+    encrypted_tables = [tables[i] for i in to_scan if is_cle_encrypted(tables[i])]
+    if workers > 1 and len(encrypted_tables) > 1:
+        from ed8_cle_decrypt import decrypt_tables
+        decrypt_tables(encrypted_tables) # Decrypts into the cache with a pool of processes, so the scans below do not have to
+    if workers > 1 and len(to_scan) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+            results = list(executor.map(scan_table, [tables[i] for i in to_scan], itertools.repeat(kind), itertools.repeat(game_type)))
+    else:
+        results = [scan_table(tables[i], kind, game_type) for i in to_scan]
+    for i in range(len(to_scan)):
+        scans[to_scan[i]] = results[i]
+        if cache is not None:
+            cache.store(tables[to_scan[i]], kind, game_type, results[i], stats[i])
+    return(scans)
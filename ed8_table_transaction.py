@@ -0,0 +1,174 @@
+# Crash-safe table writes for dlc_conflict_resolver.py.  Changes are staged in memory, and each commit writes
+# every changed table to a temporary file, flushes it to disk and swaps it into place.  Before anything is
+# swapped, the original bytes of the changed ranges (not entire tables) are saved to a journal in the .ed8cache
+# folder.  The journal keeps the changes of every session (each run of a script), and is used to undo a commit
+# that was interrupted, and to roll back sessions one at a time, newest first.
+#
+# GitHub eArmada8/ed8_dlc_tables
+
+import os, json, hashlib
+
+journal_version = 2
+
+def hash_data (data):
+    return(hashlib.sha1(data).hexdigest())
+
+def write_file_atomic (filename, data):
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filename + '.tmp', filename)
+    return
+
+# Sorts and merges [offset, length] ranges so that each byte is only saved once
+def merge_ranges (ranges):
+    merged = []
+    for offset, length in sorted(ranges):
+        if len(merged) > 0 and offset <= merged[-1][0] + merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], offset + length - merged[-1][0])
+        else:
+            merged.append([offset, length])
+    return(merged)
+
+# The [offset, length] ranges where new_data differs from data, compared block_size bytes at a time, including any
+# part of data past the end of new_data
+def diff_ranges (data, new_data, block_size = 64):
+    ranges = []
+    common_size = min(len(data), len(new_data))
+    if data[:common_size] != new_data[:common_size]:
+        for offset in range(0, common_size, block_size):
+            end = min(offset + block_size, common_size)
+            if data[offset:end] != new_data[offset:end]:
+                if len(ranges) > 0 and ranges[-1][0] + ranges[-1][1] == offset:
+                    ranges[-1][1] += end - offset
+                else:
+                    ranges.append([offset, end - offset])
+    if len(data) > common_size:
+        ranges.append([common_size, len(data) - common_size])
+    return(ranges)
+
+# True if a commit was interrupted and has not been undone yet, which happens the next time a table_transaction is made
+def interrupted_commit_pending (journal_file = '.ed8cache/journal.json'):
+    try:
+        with open(journal_file, 'r', encoding='utf-8') as f:
+            return(json.loads(f.read())['state'] == 'pending')
+    except (ValueError, KeyError, OSError):
+        return(False)
+
+class table_transaction:
+    def __init__ (self, journal_file = '.ed8cache/journal.json'):
+        self.journal_file = journal_file
+        self.staged = {} # {table: {'original': bytes, 'data': bytearray, 'ranges': [[offset, length], ...]}}
+        self.steps = [] # The commits made in this session, each {table: undo record}
+        journal = self.read_journal()
+        if journal is not None and journal['state'] == 'pending':
+            print("The last run was interrupted, undoing its unfinished changes...")
+            self.undo_step(journal['sessions'][-1][-1])
+            journal['sessions'][-1] = journal['sessions'][-1][:-1]
+            journal['sessions'] = [x for x in journal['sessions'] if len(x) > 0]
+            journal['state'] = 'committed'
+            self.write_journal(journal)
+        self.sessions = [] if journal is None else journal['sessions'] # Earlier sessions, oldest first
+
+    def read_journal (self):
+        if os.path.exists(self.journal_file):
+            try:
+                with open(self.journal_file, 'r', encoding='utf-8') as f:
+                    journal = json.loads(f.read())
+                if journal['version'] == journal_version:
+                    return(journal)
+                elif journal['version'] == 1: # Version 1 only kept the last session
+                    return({'version': journal_version, 'state': journal['state'], 'sessions': [journal['steps']]})
+            except (ValueError, KeyError, OSError):
+                print("Journal {0} is unreadable, ignoring.".format(self.journal_file))
+        return(None)
+
+    def write_journal (self, journal):
+        if os.path.dirname(self.journal_file) != '':
+            os.makedirs(os.path.dirname(self.journal_file), exist_ok = True)
+        write_file_atomic(self.journal_file, json.dumps(journal).encode('utf-8'))
+        return
+
+    # The staged contents of a table, loaded on first use.  Changes must be made with write(), truncate() or replace().
+    def read (self, table):
+        if table not in self.staged:
+            with open(table, 'rb') as f:
+                original = f.read()
+            self.staged[table] = {'original': original, 'data': bytearray(original), 'ranges': []}
+        return(self.staged[table]['data'])
+
+    def write (self, table, offset, new_bytes):
+        data = self.read(table)
+        data[offset:offset + len(new_bytes)] = new_bytes
+        self.staged[table]['ranges'].append([offset, len(new_bytes)])
+        return
+
+    def truncate (self, table, size):
+        data = self.read(table)
+        self.staged[table]['ranges'].append([size, len(data) - size])
+        self.staged[table]['data'] = data[:size]
+        return
+
+    # Only the ranges that differ are journaled, so replacing a table with a repaired copy saves little more than write()
+    def replace (self, table, new_data):
+        data = self.read(table)
+        self.staged[table]['ranges'].extend(diff_ranges(data, new_data))
+        self.staged[table]['data'] = bytearray(new_data)
+        return
+
+    # Writes all staged changes, and returns the list of tables that were changed
+    def commit (self):
+        step = {}
+        for table in self.staged:
+            original, data = self.staged[table]['original'], self.staged[table]['data']
+            if data != original:
+                step[table] = {'original_size': len(original), 'original_hash': hash_data(original), 'new_hash': hash_data(data),\
+                    'undo': [[x[0], original[x[0]:x[0] + x[1]].hex()] for x in merge_ranges(self.staged[table]['ranges']) if x[0] < len(original)]}
+        if len(step) > 0:
+            self.write_journal({'version': journal_version, 'state': 'pending', 'sessions': self.sessions + [self.steps + [step]]})
+            for table in step:
+                write_file_atomic(table, self.staged[table]['data'])
+            self.steps.append(step)
+            self.write_journal({'version': journal_version, 'state': 'committed', 'sessions': self.sessions + [self.steps]})
+        self.staged = {}
+        return(list(step.keys()))
+
+    # Restores each table in a commit to its original contents, unless it has been changed since
+    def undo_step (self, step):
+        restored = []
+        for table in step:
+            if not os.path.exists(table):
+                print("{0} no longer exists, skipping.".format(table))
+                continue
+            with open(table, 'rb') as f:
+                current = f.read()
+            if hash_data(current) == step[table]['original_hash']:
+                continue # The commit did not reach this table
+            if hash_data(current) != step[table]['new_hash']:
+                print("{0} has been changed since it was written, skipping.".format(table))
+                continue
+            data = bytearray(current) + bytearray(max(0, step[table]['original_size'] - len(current)))
+            for offset, original_hex in step[table]['undo']:
+                original_bytes = bytes.fromhex(original_hex)
+                data[offset:offset + len(original_bytes)] = original_bytes
+            write_file_atomic(table, data[:step[table]['original_size']])
+            restored.append(table)
+        return(restored)
+
+    # Undoes every commit of the last session in the journal, newest first, and removes it from the journal so that
+    # the next rollback undoes the session before it.  Returns the list of tables that were restored.
+    def rollback (self):
+        journal = self.read_journal()
+        restored = []
+        if journal is not None and len(journal['sessions']) > 0:
+            for step in reversed(journal['sessions'][-1]):
+                restored.extend([x for x in self.undo_step(step) if x not in restored])
+            journal['sessions'] = journal['sessions'][:-1]
+            if len(journal['sessions']) > 0:
+                self.write_journal(journal)
+            else:
+                os.remove(self.journal_file)
+        self.steps = []
+        self.sessions = [] if journal is None else journal['sessions']
+        return(restored)
@@ -0,0 +1,193 @@
+# Shared reader for the .tbl format used by Trails of Cold Steel II / III / IV / into Reverie and
+# Tokyo Xanadu eX+.  The table is loaded (or mmapped) once and walked in memory, instead of being
+# read from disk one byte at a time.  Used by all the scripts in this toolset, so keep it in the
+# same folder as them.
+#
+# GitHub eArmada8/ed8_dlc_tables
+
+import struct, mmap
+
+tbl_header_struct = struct.Struct("<hi")
+section_count_struct = struct.Struct("<i")
+block_size_struct = struct.Struct("<h")
+id_number_struct = struct.Struct("<H")
+cle_magic = 0x40104241
+
+def is_cle_encrypted_data (data):
+    return(len(data) >= 8 and struct.unpack_from("<I", data, 0)[0] == cle_magic)
+
+def is_cle_encrypted (table_filename):
+    with open(table_filename, 'rb') as f:
+        return(is_cle_encrypted_data(f.read(8)))
+
+# Loads the entire table with a single read.  With use_mmap = True, the file is mapped instead,
+# which is useful for very large tables; the caller should close() the map when done.
+# CLE-encrypted tables are decrypted in memory (see ed8_cle_decrypt.py), the file itself is not changed.
+def load_tbl (table_filename, use_mmap = False):
+    with open(table_filename, 'rb') as f:
+        if use_mmap:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            except ValueError: # Empty files cannot be mapped
+                return(b'')
+        else:
+            data = f.read()
+    if is_cle_encrypted_data(data):
+        from ed8_cle_decrypt import decrypt_cle_data_cached
+        decrypted_data = decrypt_cle_data_cached(bytes(data))
+        if use_mmap:
+            data.close()
+        if decrypted_data is None:
+            raise ValueError("{0} is encrypted and could not be decrypted (is the blowfish module installed?)".format(table_filename))
+        return(decrypted_data)
+    return(data)
+
+# Returns the decoded string and the offset just past its null terminator.  data must be the
+# bytes or mmap returned by load_tbl (memoryviews do not support find), with an absolute offset.
+def read_null_terminated_string (data, offset):
+    end = data.find(b'\x00', offset)
+    if end == -1:
+        raise ValueError("Unterminated string at offset {0}".format(offset))
+    return(bytes(data[offset:end]).decode('utf-8'), end + 1)
+
+# Returns total_entries, section_data ([{'name', 'num_items'}, ...]) and the offset of the first record.
+def read_tbl_header (data):
+    total_entries, num_sections = tbl_header_struct.unpack_from(data, 0)
+    offset = tbl_header_struct.size
+    section_data = []
+    for i in range(num_sections):
+        name, offset = read_null_terminated_string(data, offset)
+        num_items, = section_count_struct.unpack_from(data, offset)
+        offset += section_count_struct.size
+        section_data.append({'name': name, 'num_items': num_items})
+    return(total_entries, section_data, offset)
+
+# Walks the records starting at offset.  If count is given, stops after that many records
+# (the section counts in the header), otherwise reads until the end of the data.
+# Each record is {'type', 'offset', 'block_size', 'data'} where offset points at the block size
+# (matching the offsets used elsewhere in this toolset) and data is a zero-copy memoryview
+# of the block contents.
+def read_tbl_records (data, offset, count = None):
+    records = []
+    view = memoryview(data)
+    eof = len(data)
+    while (offset < eof) if count is None else (len(records) < count):
+        entry_type, offset = read_null_terminated_string(data, offset)
+        block_size, = block_size_struct.unpack_from(data, offset)
+        records.append({'type': entry_type, 'offset': offset, 'block_size': block_size,\
+            'data': view[offset + 2:offset + 2 + block_size]})
+        offset += 2 + block_size
+    return(records)
+
+# Convenience function for the common case: header, section list and every record listed in the header.
+def read_tbl (table_filename):
+    data = load_tbl(table_filename)
+    total_entries, section_data, offset = read_tbl_header(data)
+    records = read_tbl_records(data, offset, sum([x['num_items'] for x in section_data]))
+    return({'data': data, 'total_entries': total_entries, 'sections': section_data, 'records': records})
+
+# The first 2 bytes after the block size (unsigned), which is the item ID in t_item.tbl and the DLC ID in t_dlc.tbl.
+def read_record_id (record):
+    return(id_number_struct.unpack_from(record['data'], 0)[0])
+
+# Record names for each game, block_start is the offset just past the block size
+def read_item_name (data, block_start, game_type = 0):
+    if game_type in [2,3,4,5,18]:
+        flags, offset = read_null_terminated_string(data, block_start + 4)
+        item_name, offset = read_null_terminated_string(data, offset + {2:0x3c, 3:0x7f, 4:0x96, 5:0x8d, 18:0x3e}[game_type])
+        return(item_name)
+    else:
+        return("")
+
+def read_dlc_name (data, block_start, game_type = 0):
+    if game_type in [2,3,4,5,18]:
+        dlc_name, offset = read_null_terminated_string(data, block_start + {2:12, 3:8, 4:20, 5:20, 18:10}[game_type])
+        return(dlc_name)
+    else:
+        return("")
+
+name_readers = {'item': read_item_name, 'dlc': read_dlc_name}
+
+# True if the header and the records agree, and there is nothing after the last record
+def valid_tbl_data (data):
+    eof = len(data)
+    total_entries, section_list, offset = read_tbl_header(data)
+    section_data = {x['name']:x['num_items'] for x in section_list}
+    section_count = {x['name']:0 for x in section_list}
+    while offset < eof:
+        try:
+            entry_type, offset = read_null_terminated_string(data, offset)
+        except ValueError:
+            return False
+        if entry_type == '': # We have reached the padding (or garbage)
+            return False
+        try:
+            block_size, = block_size_struct.unpack_from(data, offset)
+        except struct.error: 
+            return False
+        if not entry_type in section_data.keys():
+            return False
+        else: 
+            section_count[entry_type] += 1
+        offset += 2 + block_size
+    for section_name in section_data:
+        if section_data[section_name] != section_count[section_name]:
+            return False
+    return True
+
+# Builds a table in a single bytearray.  The header is written up front with zero counts, records are appended
+# as they are made, and the counts are back-patched when the table is finished.  Sections listed but never
+# added to (such as item_q in CS3 / TXe item tables) keep a count of zero.
+class tbl_writer:
+    def __init__ (self, section_names):
+        self.data = bytearray(struct.pack("<HI", 0, len(section_names)))
+        self.count_offsets = {}
+        self.counts = {}
+        for name in section_names:
+            self.data += name.encode('utf-8') + b'\x00'
+            self.count_offsets[name] = len(self.data)
+            self.counts[name] = 0
+            self.data += struct.pack("<I", 0)
+
+    def add_record (self, entry_type, block):
+        self.data += entry_type.encode('utf-8') + b'\x00'
+        self.data += struct.pack("<H", len(block))
+        self.data += block
+        self.counts[entry_type] += 1
+        return
+
+    def getvalue (self):
+        struct.pack_into("<H", self.data, 0, sum(self.counts.values()))
+        for name in self.counts:
+            struct.pack_into("<I", self.data, self.count_offsets[name], self.counts[name])
+        return(bytes(self.data))
+
+    def write (self, table_filename):
+        with open(table_filename, 'wb') as f:
+            f.write(self.getvalue())
+        return
+
+# The fixed part of a record, compiled from a layout: a list of (format, value) pairs where value is a constant,
+# the name of a field to fill in, or left out for zeros.  fill() copies the prebuilt template and only packs
+# the named fields, at offsets worked out once when the template is made.
+class record_template:
+    def __init__ (self, layout):
+        template = bytearray()
+        self.fields = []
+        for part in layout:
+            field_struct = struct.Struct('<' + part[0])
+            if len(part) > 1 and isinstance(part[1], str):
+                self.fields.append((field_struct, len(template), part[1]))
+                template += bytes(field_struct.size)
+            elif len(part) > 1:
+                template += field_struct.pack(part[1])
+            else:
+                template += bytes(field_struct.size)
+        self.template = bytes(template)
+        self.size = len(self.template)
+
+    def fill (self, values):
+        data = bytearray(self.template)
+        for field_struct, offset, name in self.fields:
+            field_struct.pack_into(data, offset, values[name])
+        return(data)
@@ -0,0 +1,134 @@
+# Checks and repairs .tbl files for dlc_conflict_resolver.py.  The whole table is walked in memory in one pass,
+# re-deriving the block size of every record and the record count of every section, and the repaired table is
+# returned as bytes so that it can be written out with a single write.  Each check returns a report (a dict that
+# can be saved as JSON) listing every problem found.
+#
+# GitHub eArmada8/ed8_dlc_tables
+
+import struct
+from ed8_tbl_codec import load_tbl, read_null_terminated_string, read_tbl_header, tbl_header_struct, section_count_struct,\
+    block_size_struct
+
+# The layout of each record type after the block size: a number is that many fixed bytes, 0 is a null-terminated string
+# and a negative number is any number of groups of that many bytes, up to the next record (the DLC item list, which
+# has at least 20 item ID / quantity pairs but can have more).
+item_layouts = {2: [4, 0, 60, 0, 0, 8], 3: [4, 0, 127, 0, 0, 8], 4: [4, 0, 150, 0, 0, 8], 5: [4, 0, 141, 0, 0], 18: [4, 0, 62, 0, 0, 9]}
+record_layouts = {2: {'item': item_layouts[2], 'item_q': item_layouts[2], 'dlc': [12, 0, 0, 80, -4],\
+        'AttachTableData': [22, 0, 0], 'ShopItem': [10]},\
+    3: {'item': item_layouts[3], 'item_q': [4, 0, 127, 0, 0, 20], 'dlc': [8, 0, 0, 80, -4],\
+        'AttachTableData': [22, 0, 0], 'ShopItem': [17]},\
+    4: {'item': item_layouts[4], 'item_q': [4, 0, 150, 0, 0, 20], 'dlc': [20, 0, 0, 80, -4],\
+        'AttachTableData': [26, 0, 0, 0], 'AttachTransformData': [2, 0, 0, 0, 0], 'ShopItem': [17]},\
+    5: {'item': item_layouts[5], 'item_e': [4, 0, 141, 0, 0, 10], 'item_q': [4, 0, 141, 0, 0, 22], 'dlc': [20, 0, 0, 80, -4],\
+        'AttachTableData': [26, 0, 0, 0], 'AttachTransformData': [2, 0, 0, 0, 0, 0], 'ShopItem': [17]},\
+    18: {'item': item_layouts[18], 'item_q': item_layouts[18], 'dlc': [10, 0, 0, 80, -4],\
+        'AttachTableData': [26, 0, 0], 'ShopItem': [10]}}
+
+# Returns the true block size of the block starting at block_start, or None if it runs past the end of the table.
+# padding_start is the offset where the zeros at the end of the table start (see find_padding_start()).
+def derive_block_size (data, block_start, layout, entry_types, padding_start):
+    offset = block_start
+    for i in range(len(layout)):
+        if layout[i] == 0:
+            string, offset = read_null_terminated_string(data, offset)
+        elif layout[i] < 0:
+            while offset < len(data) and not is_record_boundary(data, offset, entry_types, padding_start):
+                offset += -layout[i]
+        else:
+            offset += layout[i]
+    return(offset - block_start if offset <= len(data) else None)
+
+def find_padding_start (data):
+    return(len(bytes(data).rstrip(b'\x00')))
+
+# True if offset is the end of the table or the start of a record of a known type (or of the padding, if padding_start
+# is given)
+def is_record_boundary (data, offset, entry_types, padding_start = None):
+    if offset == len(data) or (padding_start is not None and padding_start <= offset < len(data)):
+        return True
+    return(offset < len(data) and any([data.startswith(x, offset) for x in entry_types]))
+
+# Walks the table once.  Returns the repaired table (the same bytes if nothing is wrong, or None if it cannot be
+# repaired) and a report: {'valid', 'repairable', 'problems', 'sections': {name: [count in header, records found]},
+# 'block_sizes': [[offset, size in table, true size], ...], 'padding'}.  A block size is only re-derived from the
+# layout if it does not lead to the next record, so records of types without a layout (or game_type 0) are kept
+# as long as their block sizes are right.
+def repair_tbl_data (data, game_type = 0):
+    report = {'valid': False, 'repairable': False, 'problems': [], 'sections': {}, 'block_sizes': [], 'padding': 0}
+    try:
+        total_entries, section_data, records_start = read_tbl_header(data)
+    except (ValueError, struct.error):
+        report['problems'].append("Header is unreadable")
+        return(None, report)
+    layouts = record_layouts.get(game_type, {})
+    section_names = [x['name'] for x in section_data]
+    counts = {x:0 for x in section_names}
+    entry_types = [(x + '\x00').encode('utf-8') for x in set(section_names + list(layouts.keys()))]
+    size_patches = []
+    eof = len(data)
+    padding_start = find_padding_start(data)
+    offset = records_start
+    while offset < eof:
+        # Padding is dropped, as the old repair_tbl() did, since the game expects nothing after the last record
+        if offset >= padding_start:
+            report['padding'] = eof - offset
+            report['problems'].append("{0} bytes of padding after the last record".format(eof - offset))
+            break
+        try:
+            entry_type, block_start = read_null_terminated_string(data, offset)
+            block_size, = block_size_struct.unpack_from(data, block_start)
+        except (ValueError, struct.error):
+            report['problems'].append("Unreadable record at offset {0}".format(offset))
+            return(None, report)
+        true_block_size = block_size
+        if block_size < 0 or not is_record_boundary(data, block_start + 2 + block_size, entry_types):
+            true_block_size = None
+            if entry_type in layouts:
+                try:
+                    true_block_size = derive_block_size(data, block_start + 2, layouts[entry_type], entry_types, padding_start)
+                except ValueError:
+                    pass
+            if true_block_size is not None and not is_record_boundary(data, block_start + 2 + true_block_size, entry_types, padding_start):
+                true_block_size = None
+            if true_block_size is None and block_size >= 0 and padding_start <= block_start + 2 + block_size < eof:
+                true_block_size = block_size # The last record, followed by padding
+            if true_block_size is None or true_block_size > 32767:
+                report['problems'].append("Record {0} at offset {1} has block size {2} and cannot be repaired".format(entry_type, block_start, block_size))
+                return(None, report)
+        if true_block_size != block_size:
+            report['block_sizes'].append([block_start, block_size, true_block_size])
+            report['problems'].append("Record {0} at offset {1} has block size {2}, should be {3}".format(entry_type, block_start, block_size, true_block_size))
+            size_patches.append(block_start)
+        if entry_type not in counts:
+            report['problems'].append("Record type {0} at offset {1} is not in the header".format(entry_type, offset))
+            section_names.append(entry_type)
+            counts[entry_type] = 0
+        counts[entry_type] += 1
+        offset = block_start + 2 + true_block_size
+    header_counts = {x['name']:x['num_items'] for x in section_data}
+    for name in section_names:
+        report['sections'][name] = [header_counts.get(name, 0), counts[name]]
+        if name in header_counts and header_counts[name] != counts[name]:
+            report['problems'].append("Section {0} lists {1} records, found {2}".format(name, header_counts[name], counts[name]))
+    report['valid'] = len(report['problems']) == 0
+    report['repairable'] = True
+    if report['valid']:
+        return(bytes(data), report)
+    # Rebuilt in one buffer: the header with the true counts, then the records with their block sizes corrected
+    repaired_data = bytearray(tbl_header_struct.pack(sum(counts.values()), len(section_names)))
+    for name in section_names:
+        repaired_data += name.encode('utf-8') + b'\x00' + section_count_struct.pack(counts[name])
+    records_offset = len(repaired_data) - records_start
+    repaired_data += data[records_start:offset]
+    for i in range(len(size_patches)):
+        block_size_struct.pack_into(repaired_data, size_patches[i] + records_offset, report['block_sizes'][i][2])
+    return(bytes(repaired_data), report)
+
+# Same report as repair_tbl_data(), for a table on disk.  Tables that cannot be read (or decrypted) are reported as such.
+def check_tbl (table_filename, game_type = 0):
+    try:
+        data = load_tbl(table_filename)
+    except (ValueError, OSError) as e:
+        return({'valid': False, 'repairable': False, 'problems': [str(e)], 'sections': {}, 'block_sizes': [], 'padding': 0})
+    repaired_data, report = repair_tbl_data(data, game_type)
+    return(report)
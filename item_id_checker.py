@@ -10,77 +10,49 @@
 #
 # GitHub eArmada8/ed8_dlc_tables
 
-import struct, os, glob, sys
+import os, sys
+from ed8_id_allocator import id_allocator
+from ed8_scan_cache import table_scan_cache, scan_tables
+from ed8_install_tables import find_install_tables, select_tables, find_master_item_table, find_dlc_dats
 
-def read_null_terminated_string(f):
-    null_term_string = f.read(1)
-    while null_term_string[-1] != 0:
-        null_term_string += f.read(1)
-    return(null_term_string[:-1].decode('utf-8'))
+# Parsed tables are cached in .ed8cache so that unchanged tables are not parsed again on the next run.
+# Change use_scan_cache to False to disable, or scan_cache_hash to True to also check the contents of cached
+# tables (slower, but does not rely on file modification times).
+use_scan_cache = True
+scan_cache_hash = False
 
-def read_id_numbers(table):
-    item_numbers = []
-    with open(table, 'rb') as f:
-        total_entries, num_sections = struct.unpack("<hi",f.read(6))
-        section_data = []
-        for i in range(num_sections):
-            section = {'name': read_null_terminated_string(f),\
-                'num_items': struct.unpack("<i", f.read(4))[0]}
-            section_data.append(section)
-        for i in range(len(section_data)):
-            for j in range(section_data[i]['num_items']):
-                entry_type = read_null_terminated_string(f)
-                block_size, = struct.unpack("<h", f.read(2))
-                item_num, = struct.unpack("<h", f.read(2))
-                item_numbers.append(item_num)
-                f.seek(block_size-2,1)
-    return(item_numbers)
+# Number of tables to read at the same time, which mostly helps on slow disks.  Set to 1 to read one at a time.
+scan_workers = 8
 
 def get_all_id_numbers():
-    if os.path.exists('data/text/'):
-        folder_prefix = 'data/'
-    elif os.path.exists('text/'): #Tokyo Xanadu eX+ mode
-        folder_prefix = ''
-    else:
+    install = find_install_tables()
+    master_item_table = find_master_item_table(install, 'text', prefer_dat_us = True)
+    if master_item_table is None:
         input("No master item table found, is this script in the root game folder?")
         return False
-    if os.path.exists(folder_prefix+'text/dat_us/t_item.tbl'):
-        item_tables = [folder_prefix+'text/dat_us/t_item.tbl']
-    else:
-        item_tables = glob.glob(folder_prefix+'text/**/t_item_en.tbl', recursive = True)
-    if len(item_tables) < 1:
-        item_tables = glob.glob(folder_prefix+'text/**/t_item.tbl', recursive = True)
-        if len(item_tables) < 1:
-            input("No master item table found, is this script in the root game folder?")
-        else:
-            item_tables = [item_tables[0]]
-    else:
-        item_tables = [item_tables[0]]
+    item_tables = [master_item_table]
     #In reading DLC tables, default to English, otherwise the first option available (usually dat)
-    if os.path.exists (folder_prefix+'text_dlc'): #CS2 mode
-        dlc_folder_prefix = folder_prefix+'text_dlc/'
+    dlc_text_folder, dats = find_dlc_dats(install, 'text')
+    if dlc_text_folder == 'text_dlc': #CS2 mode
         dat_name = 'dat_us'
+    elif 'dat_en' in dats:
+        dat_name = 'dat_en'
     else:
-        dlc_folder_prefix = folder_prefix+'dlc/'
-        dats = [x.replace('\\','/').split('/')[-1] for x in glob.glob(glob.glob(folder_prefix+'dlc/text/*')[0]+'/*')]
-        if 'dat_en' in dats:
-            dat_name = 'dat_en'
-        else:
-            dat_name = dats[0]
-    item_tables.extend(sorted(glob.glob(dlc_folder_prefix+'**/{0}/t_item.tbl'.format(dat_name), recursive = True)))
-    item_tables = [x.replace('\\','/') for x in item_tables]
-    if os.path.exists('dev/'):
-        item_tables_dev = [x.replace('\\','/') for x in sorted(glob.glob('dev/'+dlc_folder_prefix+'text/**/{0}/t_item.tbl'.format(dat_name), recursive = True))]
-        item_tables = ['dev/'+x if os.path.exists('dev/'+x) else x for x in item_tables]
-        item_tables.extend([x for x in item_tables_dev if x not in item_tables])
+        dat_name = dats[0] if len(dats) > 0 else ''
+    item_tables.extend(select_tables(install, 'item', 'dlc', 'text_dlc' if dlc_text_folder == 'text_dlc' else None, dat_name))
+    cache = table_scan_cache(use_hash = scan_cache_hash) if use_scan_cache else None
     all_item_numbers = {}
     all_dlc_item_numbers = {}
+    scans = scan_tables(item_tables, cache = cache, workers = scan_workers)
     for i in range(len(item_tables)):
         print("Checking {0}...".format(item_tables[i]))
-        all_item_numbers.update({x:item_tables[i] for x in read_id_numbers(item_tables[i])})
+        id_numbers = [x[0] for x in scans[i]]
+        all_item_numbers.update({x:item_tables[i] for x in id_numbers})
         if i > 0:
-            all_dlc_item_numbers.update({x:item_tables[i] for x in read_id_numbers(item_tables[i])})
-    dlc_available = [x for x in range(min(all_dlc_item_numbers.keys()), max(all_item_numbers.keys())) if x not in all_item_numbers.keys()]
+            all_dlc_item_numbers.update({x:item_tables[i] for x in id_numbers})
+    if cache is not None:
+        cache.save()
+    dlc_available = id_allocator(all_item_numbers.keys()).next_n_free(11, min(all_dlc_item_numbers.keys()), max(all_item_numbers.keys()))
     if len(dlc_available) > 10:
         print("The next 10 available id numbers are {0}".format(dlc_available[0:10]))
     else:
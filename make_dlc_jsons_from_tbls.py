@@ -3,13 +3,9 @@
 #
 # GitHub eArmada8/ed8_dlc_tables
 
-import struct, json, csv, os
-
-def read_null_terminated_string(f):
-    null_term_string = f.read(1)
-    while null_term_string[-1] != 0:
-        null_term_string += f.read(1)
-    return(null_term_string[:-1].decode('utf-8'))
+import struct, json, csv, os, sys, concurrent.futures
+from ed8_tbl_codec import load_tbl, read_null_terminated_string, read_tbl_header, read_tbl_records, read_tbl
+from ed8_tbl_repair import record_layouts
 
 def input_gametype():
     game_type = 0
@@ -26,203 +22,242 @@ def input_gametype():
                 print("Invalid entry!")
     return(game_type)
 
+# The fixed-size part of each record (between the strings) is kept as hex, so that nothing is left out.  The named
+# fields are read from the fixed part at these offsets.
+item_fields = {2: [('item_type', 'B', 0), ('target_type', 'B', 2), ('item_sort_id', 'H', 56)],\
+    3: [('item_type', 'H', 0), ('target_type', 'B', 10), ('item_sort_id', 'H', 123)],\
+    4: [('item_type', 'H', 2), ('target_type', 'B', 12), ('item_sort_id', 'H', 146)],\
+    5: [('item_type', 'H', 2), ('target_type', 'B', 13), ('item_sort_id', 'H', 137)],\
+    18: [('item_type', 'H', 0), ('item_sort_id', 'H', 58)]}
+item_fixed_sizes = {x:record_layouts[x]['item'][2] for x in record_layouts} # item, item_q and item_e all share this layout
+dlc_fixed_sizes = {2: 10, 3: 6, 4: 18, 5: 18, 18: 8} # After the DLC ID
+attach_fixed_sizes = {2: 14, 3: 14, 4: 18, 5: 18, 18: 18} # After char_id, item_type, unk0 and item_id
+
+# Everything after the last field of a record, so that nothing is lost
+def read_tail (record, offset):
+    return(bytes(record['data'][offset - record['offset'] - 2:]).hex())
+
+# The fields after the item description, whose size is in the record layouts of ed8_tbl_repair.py (item_q and
+# item_e records have more than item records).  They are read as 16-bit numbers, with a last byte if the size is odd.
+def item_tail_struct (game_type, entry_type):
+    layout = record_layouts[game_type].get(entry_type, record_layouts[game_type]['item'])
+    size = layout[5] if len(layout) > 5 else 0
+    return(struct.Struct("<" + "H" * (size // 2) + "B" * (size % 2)))
+
 def read_dlc_table(dlc_table, game_type = 4):
     dlcs = []
-    with open(dlc_table, 'rb') as f:
-        total_entries, num_sections = struct.unpack("<hi",f.read(6))
-        section_data = []
-        for i in range(num_sections):
-            section = {'name': read_null_terminated_string(f),\
-                'num_items': struct.unpack("<i", f.read(4))[0]}
-            section_data.append(section)
-        for i in range(len(section_data)):
-            for j in range(section_data[i]['num_items']):
-                entry_type = read_null_terminated_string(f)
-                block_size, = struct.unpack("<h", f.read(2))
-                if section_data[i]['name'] == 'dlc':
-                    dlc = {}
-                    dlc['dlc_id'], = struct.unpack("<H", f.read(2))
-                    if game_type in [3,4,5]:
-                        dlc['dlc_sort_id'], = struct.unpack("<H", f.read(2))
-                    if game_type == 2:
-                        f.seek(10,1)
-                    elif game_type == 3:
-                        f.seek(4,1)
-                    elif game_type == 18:
-                        f.seek(8,1)
-                    else:
-                        f.seek(16,1)
-                    dlc['dlc_name'] = read_null_terminated_string(f)
-                    dlc['dlc_desc'] = read_null_terminated_string(f)
-                    dlc['items'] = []
-                    for k in range(20):
-                        dlc['items'].append(list(struct.unpack("<2h", f.read(4))))
-                    dlcs.append(dlc)
-                else:
-                    f.seek(block_size,1)
+    tbl = read_tbl(dlc_table)
+    data = tbl['data']
+    for record in tbl['records']:
+        if record['type'] == 'dlc':
+            offset = record['offset'] + 2
+            dlc = {'entry_type': 'dlc'}
+            dlc['dlc_id'], = struct.unpack_from("<H", data, offset)
+            if game_type in [3,4,5]:
+                dlc['dlc_sort_id'], = struct.unpack_from("<H", data, offset + 2)
+            dlc['dlc_data'] = bytes(data[offset + 2:offset + 2 + dlc_fixed_sizes[game_type]]).hex()
+            offset += 2 + dlc_fixed_sizes[game_type]
+            dlc['dlc_name'], offset = read_null_terminated_string(data, offset)
+            dlc['dlc_desc'], offset = read_null_terminated_string(data, offset)
+            # Item ID / quantity pairs to the end of the record, at least 20 (padded with 9999) but there can be more
+            items_end = offset + (record['offset'] + 2 + record['block_size'] - offset) // 4 * 4
+            dlc['items'] = [list(x) for x in struct.iter_unpack("<2h", data[offset:items_end])]
+            dlc['dlc_tail'] = read_tail(record, items_end)
+            dlcs.append(dlc)
     return(dlcs)
 
 def read_attach_table(attach_table, game_type = 4):
     attach_data = []
     attach_transform_data = []
-    with open(attach_table, 'rb') as f:
-        f.seek(0,2)
-        f_len = f.tell()
-        f.seek(0,0)
-        total_entries, num_sections = struct.unpack("<hi",f.read(6))
-        section_data = []
-        for i in range(num_sections):
-            section = {'name': read_null_terminated_string(f),\
-                'num_items': struct.unpack("<i", f.read(4))[0]}
-            section_data.append(section)
-        while f.tell() < f_len:
-            entry_type = read_null_terminated_string(f)
-            block_size, = struct.unpack("<h", f.read(2))
-            if entry_type == 'AttachTableData':
-                attach = {}
-                attach['char_id'], attach['item_type'], unk0, attach['item_id'] = struct.unpack("<4H", f.read(8))
-                if game_type in [2,3]:
-                    f.seek(14,1)
-                elif game_type == 18:
-                    f.seek(18,1)
-                else:
-                    f.seek(8,1)
-                    attach['rev_voice_flag'], attach['item_cs4rev_scraft_cutin'] = struct.unpack("<2I", f.read(8))
-                    f.seek(2,1)
-                    pkg_name = read_null_terminated_string(f)
-                attach['model'] = read_null_terminated_string(f)
-                attach['attach_point'] = read_null_terminated_string(f)
-                attach_data.append(attach)
-            elif entry_type == 'AttachTransformData':
-                attach_transform = {}
-                attach_transform['char_id'], = struct.unpack("<H", f.read(2))
-                if game_type == 5:
-                    attach_transform['costume_id'] = read_null_terminated_string(f)
-                else:
-                    attach_transform['costume_id'] = 'null'
-                attach_transform['pkg_name'] = read_null_terminated_string(f)
-                attach_transform['translate'] = read_null_terminated_string(f)
-                attach_transform['rotate'] = read_null_terminated_string(f)
-                attach_transform['scale'] = read_null_terminated_string(f)
-                attach_transform_data.append(attach_transform)
+    data = load_tbl(attach_table)
+    total_entries, section_data, offset = read_tbl_header(data)
+    for record in read_tbl_records(data, offset):
+        offset = record['offset'] + 2
+        if record['type'] == 'AttachTableData':
+            attach = {'entry_type': 'AttachTableData'}
+            attach['char_id'], attach['item_type'], attach['unk0'], attach['item_id'] = struct.unpack_from("<4H", data, offset)
+            offset += 8
+            attach['attach_data'] = bytes(data[offset:offset + attach_fixed_sizes[game_type]]).hex()
+            if game_type in [4,5]:
+                attach['rev_voice_flag'], attach['item_cs4rev_scraft_cutin'] = struct.unpack_from("<2I", data, offset + 8)
+            offset += attach_fixed_sizes[game_type]
+            if game_type in [4,5]:
+                attach['pkg_name'], offset = read_null_terminated_string(data, offset)
+            attach['model'], offset = read_null_terminated_string(data, offset)
+            attach['attach_point'], offset = read_null_terminated_string(data, offset)
+            attach['attach_tail'] = read_tail(record, offset)
+            attach_data.append(attach)
+        elif record['type'] == 'AttachTransformData':
+            attach_transform = {'entry_type': 'AttachTransformData'}
+            attach_transform['char_id'], = struct.unpack_from("<H", data, offset)
+            offset += 2
+            if game_type == 5:
+                attach_transform['costume_id'], offset = read_null_terminated_string(data, offset)
             else:
-                f.seek(block_size,1)
+                attach_transform['costume_id'] = 'null'
+            attach_transform['pkg_name'], offset = read_null_terminated_string(data, offset)
+            attach_transform['translate'], offset = read_null_terminated_string(data, offset)
+            attach_transform['rotate'], offset = read_null_terminated_string(data, offset)
+            attach_transform['scale'], offset = read_null_terminated_string(data, offset)
+            attach_transform['transform_tail'] = read_tail(record, offset)
+            attach_transform_data.append(attach_transform)
     return(attach_data, attach_transform_data)
 
-# Currently only supports item, not item_q or item_e
+# Reads item, item_q and item_e records (entry_type tells them apart), in table order
 def read_item_table(item_table, game_type = 4):
     items = []
-    with open(item_table, 'rb') as f:
-        total_entries, num_sections = struct.unpack("<hi",f.read(6))
-        section_data = []
-        for i in range(num_sections):
-            section = {'name': read_null_terminated_string(f),\
-                'num_items': struct.unpack("<i", f.read(4))[0]}
-            section_data.append(section)
-        for i in range(len(section_data)):
-            for j in range(section_data[i]['num_items']):
-                entry_type = read_null_terminated_string(f)
-                block_size, = struct.unpack("<h", f.read(2))
-                if section_data[i]['name'] == 'item':
-                    item = {}
-                    item['item_id'], item['chr_id'] = struct.unpack("<2H", f.read(4))
-                    item['flags'] = read_null_terminated_string(f)
-                    if game_type == 5:
-                        f.seek(2,1)
-                        item['item_type'], = struct.unpack("<H", f.read(2))
-                        f.seek(9,1)
-                        item['target_type'], = struct.unpack("<B", f.read(1))
-                        f.seek(123,1)
-                        item['item_sort_id'], = struct.unpack("<H", f.read(2))
-                        f.seek(2,1)
-                    elif game_type == 4:
-                        f.seek(2,1)
-                        item['item_type'], = struct.unpack("<H", f.read(2))
-                        f.seek(8,1)
-                        item['target_type'], = struct.unpack("<B", f.read(1))
-                        f.seek(133,1)
-                        item['item_sort_id'], = struct.unpack("<H", f.read(2))
-                        f.seek(2,1)
-                    elif game_type == 3:
-                        item['item_type'], = struct.unpack("<H", f.read(2))
-                        f.seek(8,1)
-                        item['target_type'], = struct.unpack("<B", f.read(1))
-                        f.seek(112,1)
-                        item['item_sort_id'], = struct.unpack("<H", f.read(2))
-                        f.seek(2,1)
-                    elif game_type == 2:
-                        item['item_type'], = struct.unpack("<B", f.read(1))
-                        f.seek(1,1)
-                        item['target_type'], = struct.unpack("<B", f.read(1))
-                        f.seek(53,1)
-                        item['item_sort_id'], = struct.unpack("<H", f.read(2))
-                        f.seek(2,1)
-                    elif game_type == 18:
-                        item['item_type'], = struct.unpack("<H", f.read(2))
-                        f.seek(56,1)
-                        item['item_sort_id'], = struct.unpack("<H", f.read(2))
-                        f.seek(2,1)
-                    item['item_name'] = read_null_terminated_string(f)
-                    item['item_desc'] = read_null_terminated_string(f)
-                    if game_type in [3,4]:
-                        f.seek(8,1)
-                    elif game_type == 18:
-                        f.seek(9,1)
-                    items.append(item)
-                else:
-                    f.seek(block_size,1)
+    tbl = read_tbl(item_table)
+    data = tbl['data']
+    for record in tbl['records']:
+        if record['type'] in ['item', 'item_q', 'item_e']:
+            offset = record['offset'] + 2
+            item = {'entry_type': record['type']}
+            item['item_id'], item['chr_id'] = struct.unpack_from("<2H", data, offset)
+            item['flags'], offset = read_null_terminated_string(data, offset + 4)
+            for field_name, field_format, field_offset in item_fields[game_type]:
+                item[field_name], = struct.unpack_from("<" + field_format, data, offset + field_offset)
+            item['item_data'] = bytes(data[offset:offset + item_fixed_sizes[game_type]]).hex()
+            offset += item_fixed_sizes[game_type]
+            item['item_name'], offset = read_null_terminated_string(data, offset)
+            item['item_desc'], offset = read_null_terminated_string(data, offset)
+            tail_struct = item_tail_struct(game_type, record['type'])
+            item['item_tail'] = list(tail_struct.unpack_from(record['data'], offset - record['offset'] - 2))
+            item['item_extra'] = read_tail(record, offset + tail_struct.size)
+            items.append(item)
     return(items)
 
-def write_struct_to_json(struct, filename):
+def write_struct_to_json(struct, filename, output_dir = ''):
     if not filename[:-5] == '.json':
         filename += '.json'
-    with open(filename, "wb") as f:
+    with open(os.path.join(output_dir, filename), "wb") as f:
         f.write(json.dumps(struct, indent=4).encode("utf-8"))
     return
 
-def write_dlc_json(dlcs, game_type):
+def write_dlc_json(dlcs, game_type, output_dir = ''):
     for i in range(len(dlcs)):
         write_struct_to_json({'game_type': game_type,\
             'dlc_id': dlcs[i]['dlc_id'],\
             'dlc_sort_id': dlcs[i]['dlc_sort_id'] if 'dlc_sort_id' in dlcs[i] else 0,\
             'dlc_name': dlcs[i]['dlc_name'], 'dlc_desc': dlcs[i]['dlc_desc']},\
-            'dlc{}'.format(str(i) if i > 0 else ''))
+            'dlc{}'.format(str(i) if i > 0 else ''), output_dir)
     return
 
-def write_pkg_jsons(attaches, attach_transforms, items, dlcs):
-    packages = list(set([x['model'] for x in attaches]))
-    for i in range(len(packages)):
-        attach = attaches[[j for j in range(len(attaches)) if attaches[j]['model'] == packages[i]][0]]
-        matching_items = [j for j in range(len(items)) if items[j]['item_id'] == attach['item_id']]
-        if len(matching_items) > 0:
-            item = items[matching_items[0]]
-            matching_dlcs = [x for x in dlcs if item['item_id'] in [y for z in x['items'] for y in z]]
-            if len(matching_dlcs) > 0:
-                item_quantity = sum([x[1] for x in matching_dlcs[0]['items'] if x[0] == item['item_id']])
-                pkg_metadata = {'item_id': item['item_id'],\
-                    'item_type': item['item_type'], 'item_name': item['item_name'], 'item_desc': item['item_desc'],\
-                    'flags': item['flags'], 'target_type': item['target_type'] if 'target_type' in item else 0,\
-                    'attach_point': attach['attach_point'],\
-                    'chr_id': item['chr_id'], 'chr_id_a': attach['char_id'], 'item_sort_id': item['item_sort_id'],\
-                    'item_cs4rev_scraft_cutin': (item['item_cs4rev_scraft_cutin'] if 'item_cs4rev_scraft_cutin' in item else 0),\
-                    'rev_voice_flag': (item['rev_voice_flag'] if 'rev_voice_flag' in item else 0),\
-                    'item_quantity': item_quantity}
-                pkg_attach_transforms = [x for x in attach_transforms if x['pkg_name'] == packages[i]]
-                if len(pkg_attach_transforms) > 0:
-                    pkg_metadata['attach_transform_data'] = [{k:x[k] for k in x if k != 'pkg_name'} for x in pkg_attach_transforms]
-                    with open(packages[i]+'.transform.csv', 'w', newline = '', encoding='utf-8') as csvfile:
-                        writer = csv.DictWriter(csvfile, fieldnames = list(pkg_metadata['attach_transform_data'][0].keys()))
-                        writer.writeheader()
-                        for j in range(len(pkg_metadata['attach_transform_data'])):
-                            writer.writerow(pkg_metadata['attach_transform_data'][j])
-                write_struct_to_json(pkg_metadata, packages[i]+'.pkg')
+def write_pkg_jsons(attaches, attach_transforms, items, dlcs, output_dir = ''):
+    # Index everything once, keeping the first match (as the tables are read in order)
+    attach_by_model = {}
+    for i in range(len(attaches)):
+        attach_by_model.setdefault(attaches[i]['model'], attaches[i])
+    item_by_id = {}
+    for i in range(len(items)):
+        if items[i]['entry_type'] == 'item':
+            item_by_id.setdefault(items[i]['item_id'], items[i])
+    quantity_by_id = {} # The quantity of each item in the first DLC that lists it
+    for i in range(len(dlcs)):
+        dlc_quantities = {}
+        for item_id, quantity in dlcs[i]['items']:
+            dlc_quantities[item_id] = dlc_quantities.get(item_id, 0) + quantity
+        for item_id in dlc_quantities:
+            quantity_by_id.setdefault(item_id, dlc_quantities[item_id])
+    transforms_by_pkg = {}
+    for i in range(len(attach_transforms)):
+        transforms_by_pkg.setdefault(attach_transforms[i]['pkg_name'], []).append(attach_transforms[i])
+    for package in attach_by_model:
+        attach = attach_by_model[package]
+        if attach['item_id'] in item_by_id and attach['item_id'] in quantity_by_id:
+            item = item_by_id[attach['item_id']]
+            pkg_metadata = {'item_id': item['item_id'],\
+                'item_type': item['item_type'], 'item_name': item['item_name'], 'item_desc': item['item_desc'],\
+                'flags': item['flags'], 'target_type': item['target_type'] if 'target_type' in item else 0,\
+                'attach_point': attach['attach_point'],\
+                'chr_id': item['chr_id'], 'chr_id_a': attach['char_id'], 'item_sort_id': item['item_sort_id'],\
+                'item_cs4rev_scraft_cutin': (item['item_cs4rev_scraft_cutin'] if 'item_cs4rev_scraft_cutin' in item else 0),\
+                'rev_voice_flag': (item['rev_voice_flag'] if 'rev_voice_flag' in item else 0),\
+                'item_quantity': quantity_by_id[item['item_id']]}
+            if package in transforms_by_pkg:
+                pkg_metadata['attach_transform_data'] = [{k:x[k] for k in x if k not in ['entry_type', 'pkg_name', 'transform_tail']}\
+                    for x in transforms_by_pkg[package]]
+                with open(os.path.join(output_dir, package+'.transform.csv'), 'w', newline = '', encoding='utf-8') as csvfile:
+                    writer = csv.DictWriter(csvfile, fieldnames = list(pkg_metadata['attach_transform_data'][0].keys()))
+                    writer.writeheader()
+                    for j in range(len(pkg_metadata['attach_transform_data'])):
+                        writer.writerow(pkg_metadata['attach_transform_data'][j])
+            write_struct_to_json(pkg_metadata, package+'.pkg', output_dir)
+
+# Extracts the DLC, attach and item tables of one DLC folder into a project in output_dir
+def extract_tables(dlc_table, attach_table, item_table, output_dir, game_type = 4):
+    summary = {'dlc_table': dlc_table, 'output_dir': output_dir, 'success': False, 'dlcs': 0, 'packages': 0, 'error': ''}
+    try:
+        dlcs = read_dlc_table(dlc_table, game_type)
+        attaches, attach_transforms = read_attach_table(attach_table, game_type)
+        items = read_item_table(item_table, game_type)
+        os.makedirs(output_dir, exist_ok = True)
+        write_dlc_json(dlcs, game_type, output_dir)
+        write_pkg_jsons(attaches, attach_transforms, items, dlcs, output_dir)
+        summary.update({'success': True, 'dlcs': len(dlcs), 'packages': len(set([x['model'] for x in attaches]))})
+    except Exception as e:
+        summary['error'] = '{0}: {1}'.format(type(e).__name__, str(e))
+    return(summary)
+
+# Extracts every DLC folder of the game installed in game_dir into its own project folder (named after the DLC
+# folder) in output_dir.  The DLC tables and dev/ overlays are found the same way as dlc_conflict_resolver.py.
+def extract_install(game_dir = '.', output_dir = 'dlc_projects', workers = None):
+    from dlc_conflict_resolver import detect_ed8_game, get_tables
+    from ed8_install_tables import find_install_tables, select_tables
+    if not os.path.isdir(game_dir):
+        print("{0} is not a folder.".format(game_dir))
+        return(False)
+    output_dir = os.path.abspath(output_dir)
+    current_dir = os.getcwd()
+    os.chdir(game_dir)
+    try:
+        game_type = detect_ed8_game(interactive = False)
+        if game_type not in [2,3,4,5,18]:
+            print("No supported game found in {0}.".format(os.path.abspath(game_dir)))
+            return(False)
+        item_tables, dlc_tables, dlc_folder_numbers = get_tables(game_type, interactive = False, include_encrypted = True)
+        # The attach and item tables are looked up the same way as the DLC table, so that each can come from dev/
+        install = find_install_tables(game_type)
+        table_entries = {x['table']:x for x in install['tables']}
+        table_sets = []
+        for dlc_table in dlc_tables:
+            entry = table_entries[dlc_table]
+            table_set = [dlc_table]
+            for kind, name in [('attach', 't_attach.tbl'), ('item', 't_item.tbl')]:
+                tables = select_tables(install, kind, 'dlc', entry['text_folder'], entry['dat'], entry['folder'])
+                table_set.append(tables[0] if len(tables) > 0 else os.path.join(os.path.dirname(entry['base']), name))
+            table_sets.append([os.path.abspath(x) for x in table_set])
+        project_dirs = [os.path.join(output_dir, x.replace('\\','/').split('/')[-3]) for x in dlc_tables]
+    finally:
+        os.chdir(current_dir)
+    if len(table_sets) == 0:
+        print("No DLC tables found.")
+        return(False)
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(extract_tables, *table_sets[i], project_dirs[i], game_type) for i in range(len(table_sets))]
+        summaries = [x.result() for x in futures]
+    for summary in summaries:
+        if summary['success']:
+            print("{0}: {1} DLC, {2} packages".format(summary['output_dir'], summary['dlcs'], summary['packages']))
+        else:
+            print("{0}: FAILED - {1}".format(summary['dlc_table'], summary['error']))
+    print("Extracted {0} of {1} DLC folders.".format(len([x for x in summaries if x['success']]), len(summaries)))
+    return(all([x['success'] for x in summaries]))
 
 if __name__ == "__main__":
-    # Set current directory
-    os.chdir(os.path.abspath(os.path.dirname(__file__)))
-    game_type = input_gametype()
-    dlcs = read_dlc_table('t_dlc.tbl', game_type)
-    attaches, attach_transforms = read_attach_table('t_attach.tbl', game_type)
-    items = read_item_table('t_item.tbl', game_type)
-    write_dlc_json(dlcs, game_type)
-    write_pkg_jsons(attaches, attach_transforms, items, dlcs)
\ No newline at end of file
+    if len(sys.argv) > 1:
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument('-i', '--install', help="Extract every DLC folder of the game installed in this folder (the folder with the bin and data folders).", required=True)
+        parser.add_argument('-o', '--output_dir', help="Folder to put the extracted projects in (default: dlc_projects).", default='dlc_projects')
+        parser.add_argument('-j', '--workers', help="Number of DLC folders to extract at the same time (default: number of CPUs).", type=int)
+        args = parser.parse_args()
+        sys.exit(0 if extract_install(args.install, args.output_dir, args.workers) else 1)
+    else:
+        # Set current directory
+        os.chdir(os.path.abspath(os.path.dirname(__file__)))
+        game_type = input_gametype()
+        dlcs = read_dlc_table('t_dlc.tbl', game_type)
+        attaches, attach_transforms = read_attach_table('t_attach.tbl', game_type)
+        items = read_item_table('t_item.tbl', game_type)
+        write_dlc_json(dlcs, game_type)
+        write_pkg_jsons(attaches, attach_transforms, items, dlcs)
\ No newline at end of file
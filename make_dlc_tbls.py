@@ -1,230 +1,444 @@
 # Short script to generate a set of dlc tables for custom costumes in
 # Trails of Cold Steel II / III / IV / into Reverie and Tokyo Xanadu eX+.
-# Uses the decoded t_name.tbl from tbled.
+# Uses t_name.tbl from the game, or the decoded t_name.tbl from tbled.
 #
 # GitHub eArmada8/ed8_dlc_tables
 
-import os, csv, json, struct, glob, random
+import os, sys, csv, json, struct, glob, random, hashlib, concurrent.futures
+from ed8_tbl_codec import tbl_writer, record_template
+from ed8_name_index import name_index, load_name_index, find_name_table
 
+# To read the character names straight from the game instead of from the csv files, put the game folder of each
+# game here, for example game_dirs = {4: 'C:/Games/Trails of Cold Steel IV'}.  (Game types: 2 = CS2, 3 = CS3,
+# 4 = CS4, 5 = Reverie, 18 = TXe.)  A t_name.tbl in the project folder is also used instead of the csv file.
+game_dirs = {}
+
+# Record layouts for each game, see record_template.  Named fields are filled from the package details, plus
+# dlc_id, attach_type and voice_flag.  The item layouts are the fixed part between the flags and the item name.
+item_layouts = {2: [('B', 'item_type'), ('B', 0), ('B', 'target_type'), ('52x',), ('B', 99), ('H', 'item_sort_id'), ('H', 'dlc_id')],\
+    3: [('H', 'item_type'), ('8x',), ('B', 'target_type'), ('111x',), ('B', 99), ('H', 'item_sort_id'), ('H', 0)],\
+    4: [('H', 0), ('H', 'item_type'), ('8x',), ('B', 'target_type'), ('131x',), ('H', 99), ('H', 'item_sort_id'), ('H', 'dlc_id')],\
+    # The last two numbers of Reverie seem random, maybe sorting or a timestamp?
+    5: [('H', 0), ('H', 'item_type'), ('9x',), ('B', 'target_type'), ('119x',), ('H', 99), ('H', 0), ('H', 'item_sort_id'), ('H', 32)],\
+    18: [('H', 'item_type'), ('54x',), ('H', 99), ('H', 'item_sort_id'), ('H', 'dlc_id')]}
+item_tails = {2: bytes(8), 3: bytes(8), 4: bytes(8), 5: b'', 18: bytes(9)} # After the item description
+attach_common_layout = [('H', 'chr_id_a'), ('H', 'attach_type'), ('H', 0), ('I', 'item_id')]
+attach_layouts = {2: attach_common_layout + [('12x',)], 3: attach_common_layout + [('12x',)],\
+    4: attach_common_layout + [('i', 0), ('i', 0), ('i', 'voice_flag'), ('i', 'item_cs4rev_scraft_cutin'), ('H', 48)],\
+    5: attach_common_layout + [('i', 0), ('i', 0), ('i', 'voice_flag'), ('i', 'item_cs4rev_scraft_cutin'), ('H', 48)],\
+    18: attach_common_layout + [('I', 0), ('I', 0), ('I', 0), ('I', 255)]}
+# The dlc layouts are the fixed part before the DLC name
+dlc_layouts = {2: [('H', 'dlc_id'), ('H', 65535), ('H', 100), ('I', 0), ('H', 0)],\
+    3: [('H', 'dlc_id'), ('H', 'dlc_sort_id'), ('4x',)],\
+    4: [('H', 'dlc_id'), ('H', 'dlc_sort_id'), ('16x',)],\
+    5: [('H', 'dlc_id'), ('H', 'dlc_sort_id'), ('16x',)],\
+    18: [('H', 'dlc_id'), ('H', 65535), ('H', 100), ('I', 0)]}
+item_templates = {x:record_template(item_layouts[x]) for x in item_layouts}
+attach_templates = {x:record_template(attach_layouts[x]) for x in attach_layouts}
+dlc_templates = {x:record_template(dlc_layouts[x]) for x in dlc_layouts}
+attach_types = {193:5, 194:67, 195: 9, 454: 5}
+names_csvs = {2:'ed82xseed.csv', 3:'ed83nisa.csv', 4:'ed84nisa.csv', 5:'ed85nisa.csv', 18:'txe_names.csv'}
+item_header_struct = struct.Struct("<2H")
+dlc_item_struct = struct.Struct("<2H")
+struct_ranges = {'B': (0, 0xFF), 'H': (0, 0xFFFF), 'I': (0, 0xFFFFFFFF), 'i': (-0x80000000, 0x7FFFFFFF)}
+
+manifest_filename = 'build_manifest.json'
+table_names = ['t_item.tbl', 't_attach.tbl', 't_dlc.tbl']
+
+def hash_data (data):
+    return(hashlib.sha1(data).hexdigest())
+
+def hash_file (filename):
+    with open(filename, 'rb') as f:
+        return(hash_data(f.read()))
+
+# Only writes the file if its contents would change, so that unchanged files keep their modification times
+def write_file_if_changed (filename, data):
+    if os.path.exists(filename) and os.path.getsize(filename) == len(data):
+        with open(filename, 'rb') as f:
+            if f.read() == data:
+                return(False)
+    with open(filename, 'wb') as f:
+        f.write(data)
+    return(True)
+
+def write_json_if_changed (filename, data):
+    return(write_file_if_changed(filename, json.dumps(data, indent=4).encode("utf-8")))
+
+# The names CSV is read from the project folder if it is there, otherwise from names_dir
+def find_names_csv (project_dir, names_dir, tablename):
+    if os.path.exists(os.path.join(project_dir, tablename)):
+        return(os.path.join(project_dir, tablename))
+    return(os.path.join(names_dir, tablename))
+
+# Character names are read from t_name.tbl in the project folder, the t_name.tbl of the game in game_dirs, or the names
+# CSV, in that order.  Returns the file and where to cache its index (None for the default, next to the file).
+def find_names_source (project_dir, names_dir, game_type):
+    if os.path.exists(os.path.join(project_dir, 't_name.tbl')):
+        return(os.path.join(project_dir, 't_name.tbl'), None)
+    if game_type in game_dirs:
+        name_table = find_name_table(game_dirs[game_type])
+        if name_table is not None:
+            return(name_table, os.path.join(names_dir, '.ed8cache', 't_name_{0}.tbl.index'.format(game_type)))
+    return(find_names_csv(project_dir, names_dir, names_csvs[game_type]), None)
+
+# Hashes of everything the tables are built from: dlc.json, the .pkg.json and .transform.csv files, and the character names,
+# and the list of .pkg files
+def project_input_hashes (project_dir, names_dir):
+    inputs = {}
+    for filename in ['dlc.json'] + sorted([os.path.basename(x) for x in glob.glob(os.path.join(project_dir, '*.pkg.json'))\
+            + glob.glob(os.path.join(project_dir, '*.transform.csv'))]):
+        if os.path.exists(os.path.join(project_dir, filename)):
+            inputs[filename] = hash_file(os.path.join(project_dir, filename))
+    # Adding or removing a .pkg (which may not have a .json yet) also needs a new build
+    inputs['packages'] = sorted([os.path.basename(x) for x in glob.glob(os.path.join(project_dir, '*.pkg'))])
+    try:
+        with open(os.path.join(project_dir, 'dlc.json'), 'r') as f:
+            game_type = json.loads(f.read())['game_type']
+        names_file, cache_file = find_names_source(project_dir, names_dir, game_type)
+        inputs['game_type'] = game_type
+        inputs['names'] = hash_file(names_file) if os.path.exists(names_file) else ''
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return(inputs)
+
+def read_manifest (output_dir):
+    try:
+        with open(os.path.join(output_dir, manifest_filename), 'r') as f:
+            return(json.loads(f.read()))
+    except (OSError, ValueError):
+        return({'inputs': {}, 'outputs': {}})
+
+# True if none of the inputs have changed since the last build, and the tables are still the ones it wrote
+def build_is_current (project_dir, output_dir, names_dir):
+    manifest = read_manifest(output_dir)
+    if len(manifest['inputs']) == 0 or manifest['inputs'] != project_input_hashes(project_dir, names_dir):
+        return(False)
+    for table_name in table_names:
+        if not os.path.exists(os.path.join(output_dir, table_name))\
+                or manifest['outputs'].get(table_name) != hash_file(os.path.join(output_dir, table_name)):
+            return(False)
+    return(True)
+
+# The range of every setting that is packed into the records of a game, from the record layouts and the item header
+# (item ID, character ID) and DLC item list (item ID, quantity).  A setting in more than one record gets the narrowest.
+def setting_ranges (game_type):
+    ranges = {'item_id': struct_ranges['H'], 'chr_id': struct_ranges['H'], 'item_quantity': struct_ranges['H']}
+    for layouts in [item_layouts, attach_layouts, dlc_layouts]:
+        for part in layouts.get(game_type, []):
+            if len(part) > 1 and isinstance(part[1], str):
+                key = 'rev_voice_flag' if part[1] == 'voice_flag' else part[1]
+                lo, hi = struct_ranges[part[0]]
+                if key in ranges:
+                    lo, hi = max(lo, ranges[key][0]), min(hi, ranges[key][1])
+                ranges[key] = (lo, hi)
+    return(ranges)
+
+def read_transform_csv (filename):
+    with open(filename, encoding='utf-8') as csvfile:
+        transform_data = [row for row in csv.reader(csvfile, delimiter=',')]
+    return([dict(zip(transform_data[0],x)) for x in transform_data[1:]])
+
+# Reads the settings of a project from its .json files without asking any questions.  Returns dlc_details and
+# packages ({pkg_name: pkg_details}) for dlc_table_maker, with whatever settings are missing left out.
+def load_project (project_dir = '.'):
+    dlc_details = {}
+    if os.path.exists(os.path.join(project_dir, 'dlc.json')):
+        with open(os.path.join(project_dir, 'dlc.json'), 'r') as f:
+            dlc_details = json.loads(f.read())
+    packages = {}
+    for pkg_name in sorted(list(set([os.path.basename(x).split('.json')[0] for x in glob.glob(os.path.join(project_dir, '*.pkg*'))]))):
+        packages[pkg_name] = {}
+        if os.path.exists(os.path.join(project_dir, pkg_name + '.json')):
+            with open(os.path.join(project_dir, pkg_name + '.json'), 'r') as f:
+                packages[pkg_name] = json.loads(f.read())
+        transform_csv = os.path.join(project_dir, pkg_name[:-4] + '.transform.csv')
+        if packages[pkg_name].get('attach_point', '') != 'null' and os.path.exists(transform_csv):
+            packages[pkg_name]['attach_transform_data'] = read_transform_csv(transform_csv)
+    return(dlc_details, packages)
+
+# project_dir is the folder with the .pkg files and .json settings, and output_dir is where the tables are written
+# (the project folder, if not given).  The character names are read as described in find_names_source(); the names
+# CSV is read from the project folder, or from names_dir if it is not there (the folder this script is in, if not given).
+# Without dlc_details and packages, the settings are read from the .json files in project_dir, asking for anything
+# that is missing.  With them (e.g. from load_project()), nothing is asked: settings with defaults are filled in,
+# validate() lists any problems with the rest, and build_tables() returns the tables as bytes.
 class dlc_table_maker:
-    def __init__ (self):
+    def __init__ (self, project_dir = '.', output_dir = None, names_dir = None, dlc_details = None, packages = None):
+        self.project_dir = project_dir
+        self.output_dir = output_dir if output_dir is not None else project_dir
+        self.names_dir = names_dir if names_dir is not None else os.path.abspath(os.path.dirname(__file__))
         random.seed()
         self.random_number = round(random.random()*888+2000)
-        self.dlc_details = self.get_dlc_details()
-        self.name_dict = self.get_names({2:'ed82xseed.csv', 3:'ed83nisa.csv',\
-            4:'ed84nisa.csv', 5:'ed85nisa.csv', 18:'txe_names.csv'}[self.dlc_details['game_type']])
-        self.packages = self.get_pkg_details()
-        self.package_list = list(self.packages.keys())
         self.transform_counter = 0
-
-    def get_dlc_details (self):
-        if os.path.exists('dlc.json'):
-            with open('dlc.json', 'r') as f:
-                dlc_details = json.loads(f.read())
+        self.asking = None
+        interactive = dlc_details is None or packages is None
+        if interactive:
+            dlc_details, packages = load_project(project_dir)
+        self.dlc_details = dict(dlc_details)
+        self.packages = {x:dict(packages[x]) for x in packages}
+        self.names = name_index()
+        self.load_names()
+        if interactive:
+            self.ask_missing_settings()
+            self.save_project()
         else:
-            dlc_details = {}
-        while 'game_type' not in dlc_details.keys() or dlc_details['game_type'] not in [2,3,4,5,18]:
-            item_type_raw = input("Which game? [2=CS2, 3=CS3, 4=CS4, 5=NISA Reverie, 18=TXe, leave blank for 4] ")
-            if item_type_raw == '':
-                dlc_details['game_type'] = 4
-            else:
-                try:
-                    dlc_details['game_type'] = int(item_type_raw)
-                    if dlc_details['game_type'] not in [2,3,4,5,18]:
-                        print("Invalid entry!")
-                except ValueError:
-                    print("Invalid entry!")
-        while 'dlc_id' not in dlc_details.keys():
-            dlc_id_raw = input("DLC ID number: ")
-            try:
-                dlc_details['dlc_id'] = int(dlc_id_raw)
-            except ValueError:
-                print("Invalid entry!")
-        while 'dlc_sort_id' not in dlc_details.keys():
-            dlc_details['dlc_sort_id'] = self.random_number
-        while 'dlc_name' not in dlc_details.keys() or dlc_details['dlc_name'] == '':
-            dlc_details['dlc_name'] = str(input("DLC Name: ")).encode('utf-8').decode('utf-8')
-        while 'dlc_desc' not in dlc_details.keys() or dlc_details['dlc_desc'] == '':
-            dlc_details['dlc_desc'] = str(input("DLC Description: ")).encode('utf-8').decode('utf-8')
-        with open('dlc.json', "wb") as f:
-            f.write(json.dumps(dlc_details, indent=4).encode("utf-8"))
-        return(dlc_details)
-
-    #Takes NameTableData.csv from tbled
-    def get_names (self, tablename = 'ed84nisa.csv'):
-        import csv
-        name_dict = {}
-        with open(tablename, encoding='utf-8') as csvfile:
-            names = csv.reader(csvfile, delimiter=',')
-            for row in names:
-                #if not row[0] == 'character' and not row[0] == '65535':
-                if not row[0] == 'character' and int(row[0]) < 200 and len(row[2].split("_")) == 2:
-                    if row[2] not in name_dict.keys():
-                        name_dict[row[2]] = {'chr_id': int(row[0]), 'chr_name': row[1]}
-        return(name_dict)
-
-    def get_items_from_jsons (self):
-        items = {}
-        jsons = glob.glob('*.pkg.json')
-        for i in range(len(jsons)):
-            with open(jsons[i], 'r') as f:
-                pkg_details = json.loads(f.read())
-            if 'item_id' in pkg_details.keys():
-                items[pkg_details['item_id']] = pkg_details
-        return(items)
+            self.apply_defaults()
+        self.package_list = list(self.packages.keys())
+
+    def project_path (self, filename):
+        return(os.path.join(self.project_dir, filename))
+
+    #Takes t_name.tbl, or NameTableData.csv from tbled
+    def get_names (self, game_type = 4):
+        names_file, cache_file = find_names_source(self.project_dir, self.names_dir, game_type)
+        return(load_name_index(names_file, cache_file))
 
     def get_chr_id (self, pkg_name):
-        try:
-            base_name = "_".join(pkg_name.split('.')[0].split("_")[0:2])
-            if base_name[:2] == 'FC':
-                base_name = base_name[1:]
-            return(self.name_dict[base_name]['chr_id'])
-        except KeyError:
-            return 0x1FFFFFFF # This number is meaningless, just used to catch errors
+        base_name = "_".join(pkg_name.split('.')[0].split("_")[0:2])
+        if base_name[:2] == 'FC':
+            base_name = base_name[1:]
+        return(self.names.chr_id(base_name, 0x1FFFFFFF)) # This number is meaningless, just used to catch errors
 
     def get_chr_name (self, chr_id):
-        try:
-            return([x['chr_name'] for x in self.name_dict.values() if x['chr_id'] == chr_id][0])
-        except KeyError:
-            return ''
-
-    def get_pkg_details (self):
-        packages = sorted(list(set([x.split('.json')[0] for x in glob.glob('*.pkg*')])))
-        unique_chars = list(set([self.get_chr_id(x) for x in packages if self.get_chr_id(x) != 0x1FFFFFFF]))
-        existing_items = self.get_items_from_jsons()
-        pkg_dict = {}
-        for i in range(len(packages)):
-            print("\nProcessing {0}...\n".format(packages[i]))
-            if os.path.exists(packages[i] + '.json'):
-                with open(packages[i] + '.json', 'r') as f:
-                    pkg_details = json.loads(f.read())
-            else:
-                pkg_details = {}
-            while 'item_id' not in pkg_details.keys():
-                print("Note: If you want two attachments to be grouped, give them the same item ID.")
-                item_id_raw = input("Item ID number for {0}: ".format(packages[i]))
+        return(self.names.chr_name(chr_id))
+
+    # Only needed to fill in character IDs from the .pkg names, so it is not an error if there is no names file
+    def load_names (self):
+        if self.dlc_details.get('game_type') in names_csvs:
+            try:
+                self.names = self.get_names(self.dlc_details['game_type'])
+            except OSError:
+                pass
+        return
+
+    # Asks for the settings that validate() finds missing or invalid, one at a time, so that each answer can fill in
+    # others through apply_defaults() (e.g. the details of items grouped under the same item ID)
+    def ask_missing_settings (self):
+        while True:
+            self.apply_defaults()
+            problems = self.find_problems()
+            if len(problems) == 0:
+                return
+            source, key, problem = problems[0]
+            if not self.ask_setting(source, key, problem):
+                raise ValueError("Cannot build tables:\n" + "\n".join([x[2] for x in problems]))
+
+    # Asks for one setting of dlc.json (source = 'dlc.json') or of a package.  Returns False if it is not a setting
+    # that can be asked for.
+    def ask_setting (self, source, key, problem = ''):
+        if source == 'dlc.json' and key in ['game_type', 'dlc_id', 'dlc_name', 'dlc_desc']:
+            details, pkg_name = self.dlc_details, ''
+        elif source in self.packages and (key in ['item_id', 'item_type', 'attach_point', 'chr_id', 'chr_id_a', 'item_name',\
+                'item_desc', 'item_quantity'] or (key == 'target_type' and self.packages[source].get('item_type') == 454)):
+            details, pkg_name = self.packages[source], source
+            if self.asking != source:
+                print("\nProcessing {0}...\n".format(source))
+                self.asking = source
+        else:
+            return False
+        if key in details and details[key] != '':
+            print("{0}, please enter it again.".format(problem))
+        details.pop(key, None)
+        if key == 'game_type':
+            while 'game_type' not in details.keys():
+                item_type_raw = input("Which game? [2=CS2, 3=CS3, 4=CS4, 5=NISA Reverie, 18=TXe, leave blank for 4] ")
+                if item_type_raw == '':
+                    details['game_type'] = 4
+                else:
+                    try:
+                        details['game_type'] = int(item_type_raw)
+                    except ValueError:
+                        print("Invalid entry!")
+            self.load_names()
+        elif key == 'dlc_id':
+            while 'dlc_id' not in details.keys():
+                dlc_id_raw = input("DLC ID number: ")
                 try:
-                    pkg_details['item_id'] = int(item_id_raw)
-                    if pkg_details['item_id'] in list(existing_items.keys()):
-                        pkg_details['item_type'] = existing_items[pkg_details['item_id']]['item_type']
-                        pkg_details['item_quantity'] = existing_items[pkg_details['item_id']]['item_quantity']
-                        #pkg_details['chr_id'] = existing_items[pkg_details['item_id']]['chr_id']
-                        pkg_details['item_name'] = existing_items[pkg_details['item_id']]['item_name']
-                        pkg_details['item_desc'] = existing_items[pkg_details['item_id']]['item_desc']
+                    details['dlc_id'] = int(dlc_id_raw)
                 except ValueError:
                     print("Invalid entry!")
-            while 'item_type' not in pkg_details.keys() or pkg_details['item_type'] not in [193,194,195,454]:
-                print("Item type: [193=costume, 194=attachment, 195=hair color, 454=ARCUS cover, leave blank for 193]")
-                item_type_raw = input("Item type for {0}: ".format(packages[i]))
+        elif key in ['dlc_name', 'dlc_desc']:
+            details[key] = str(input({'dlc_name': "DLC Name: ", 'dlc_desc': "DLC Description: "}[key])).encode('utf-8').decode('utf-8')
+        elif key == 'item_id':
+            print("Note: If you want two attachments to be grouped, give them the same item ID.")
+            while 'item_id' not in details.keys():
+                item_id_raw = input("Item ID number for {0}: ".format(pkg_name))
+                try:
+                    details['item_id'] = int(item_id_raw)
+                except ValueError:
+                    print("Invalid entry!")
+        elif key == 'item_type':
+            print("Item type: [193=costume, 194=attachment, 195=hair color, 454=ARCUS cover, leave blank for 193]")
+            while 'item_type' not in details.keys():
+                item_type_raw = input("Item type for {0}: ".format(pkg_name))
                 if item_type_raw == '':
                     print("No entry given, setting item type to default of 193.")
-                    pkg_details['item_type'] = 193
+                    details['item_type'] = 193
                 else:
                     try:
-                        pkg_details['item_type'] = int(item_type_raw)
-                        if pkg_details['item_type'] not in [193,194,195,454]:
-                            print("Invalid entry!")
-                        if pkg_details['item_type'] == 454:
-                            if len(packages[i].split('I_3D_ARC_C')) > 1:
-                                try:
-                                    pkg_details['target_type'] = int(packages[i].split('I_3D_ARC_C')[1].split('.')[0])
-                                    if not pkg_details['target_type'] in range(256):
-                                        print("Item type 454 was specified, but xxx in I_3D_ARC_Cxxx.pkg must be between 000 and 255!")
-                                        pkg_details['item_type'] = 0
-                                        pkg_details['target_type'] = 0
-                                except ValueError:
-                                    print("Item type 454 was specified, but the pkg name must be I_3D_ARC_Cxxx.pkg!")
-                                    pkg_details['item_type'] = 0
-                            else:
-                                print("Item type 454 was specified, but the pkg name must be I_3D_ARC_Cxxx.pkg!")
-                                pkg_details['item_type'] = 0
+                        details['item_type'] = int(item_type_raw)
                     except ValueError:
                         print("Invalid entry!")
-            while 'target_type' not in pkg_details.keys() or pkg_details['target_type'] == '':
-                pkg_details['target_type'] = 0
-            while 'attach_point' not in pkg_details.keys() or pkg_details['attach_point'] == '':
-                if pkg_details['item_type'] == 194:
-                    pkg_details['attach_point'] = str(input("Attach point for {0}: (e.g. head_point - check .inf file for valid options)  ".format(packages[i]))).encode('utf-8').decode('utf-8')
+        elif key == 'target_type':
+            # Taken from the .pkg name by apply_defaults(), so the item type is asked again instead
+            print("Item type 454 was specified, but the pkg name must be I_3D_ARC_Cxxx.pkg, with xxx between 000 and 255!")
+            details.pop('item_type', None)
+        elif key == 'attach_point':
+            details['attach_point'] = str(input("Attach point for {0}: (e.g. head_point - check .inf file for valid options)  ".format(pkg_name))).encode('utf-8').decode('utf-8')
+        elif key in ['chr_id', 'chr_id_a']:
+            unique_chars = list(set([x for x in [self.get_chr_id(y) for y in self.packages] if x != 0x1FFFFFFF]))
+            print("{0} Character Restriction: Please choose a character for {1}: ".format({'chr_id': 'Item Select', 'chr_id_a': 'Attachment'}[key], pkg_name))
+            print("-1. Any character")
+            for j in range(len(unique_chars)):
+                print("{0}. {1}".format(unique_chars[j], self.get_chr_name(unique_chars[j])))
+            print("(Any number <65536 is accepted, see {0} for other options)".format(names_csvs[self.dlc_details['game_type']]))
+            while key not in details.keys():
+                chr_id_raw = input("Character restriction for {0}: ".format(pkg_name))
+                try:
+                    details[key] = 0xFFFF if int(chr_id_raw) == -1 else int(chr_id_raw)
+                except ValueError:
+                    print("Invalid entry!")
+        elif key in ['item_name', 'item_desc']:
+            details[key] = str(input("{0} for {1}: ".format({'item_name': "Item Name", 'item_desc': "Item Description"}[key], pkg_name))).encode('utf-8').decode('utf-8')
+        elif key == 'item_quantity':
+            while 'item_quantity' not in details.keys():
+                item_quant_raw = input("How many should be included in the DLC? [Leave blank for 1] ")
+                if item_quant_raw == '':
+                    details['item_quantity'] = 1
                 else:
-                    pkg_details['attach_point'] = 'null'
-            while 'chr_id' not in pkg_details.keys() or pkg_details['chr_id'] == 0x1FFFFFFF:
-                pkg_details['chr_id'] = self.get_chr_id(packages[i])
-                if pkg_details['chr_id'] == 0x1FFFFFFF: #Non-costume
-                    print("Item Select Character Restriction: Please choose a character for {0}: ".format(packages[i]))
-                    print("-1. Any character")
-                    for j in range(len(unique_chars)):
-                        print("{0}. {1}".format(unique_chars[j], self.get_chr_name(unique_chars[j])))
-                    print("(Any number <65536 is accepted, see {0} for other options)".format({3:'ed83nisa.csv', 4:'ed84nisa.csv', 5:'ed85nisa.csv', 18:'txe_names.csv'}[self.dlc_details['game_type']]))
-                    chr_id_raw = input("Character restriction for {0}: ".format(packages[i]))
                     try:
-                        if int(chr_id_raw) == -1:
-                            pkg_details['chr_id'] = 0xFFFF
-                        else:
-                            if int(chr_id_raw) < 0x10000:
-                                pkg_details['chr_id'] = int(chr_id_raw)
-                            else:
-                                print("Invalid entry!")
+                        details['item_quantity'] = min(max(int(item_quant_raw),1),99)
                     except ValueError:
                         print("Invalid entry!")
-            if pkg_details['chr_id'] < 1000 and 'chr_id_a' not in pkg_details:
-                pkg_details['chr_id_a'] = pkg_details['chr_id']
-            while 'chr_id_a' not in pkg_details.keys() or pkg_details['chr_id_a'] == 0x1FFFFFFF:
-                pkg_details['chr_id_a'] = self.get_chr_id(packages[i])
-                if pkg_details['chr_id_a'] == 0x1FFFFFFF: #Non-costume
-                    print("Attachment Character Restriction: Please choose a character for {0}: ".format(packages[i]))
-                    print("-1. Any character")
-                    for j in range(len(unique_chars)):
-                        print("{0}. {1}".format(unique_chars[j], self.get_chr_name(unique_chars[j])))
-                    print("(Any number <65536 is accepted, see {0} for other options)".format({3:'ed83nisa.csv', 4:'ed84nisa.csv', 5:'ed85nisa.csv', 18:'txe_names.csv'}[self.dlc_details['game_type']]))
-                    chr_id_raw = input("Character restriction for {0}: ".format(packages[i]))
+        return True
+
+    # Fills in the settings that have a default or can be worked out from the .pkg name or from the other packages
+    # with the same item ID.  Anything else is left missing for validate() to report (and ask_setting() to ask for).
+    def apply_defaults (self):
+        if 'dlc_sort_id' not in self.dlc_details:
+            self.dlc_details['dlc_sort_id'] = self.random_number
+        for pkg_name in self.packages:
+            pkg_details = self.packages[pkg_name]
+            # Grouped items (same item ID) share their details
+            for key in ['item_type', 'item_quantity', 'item_name', 'item_desc']:
+                shared = [self.packages[x][key] for x in self.packages if key in self.packages[x]\
+                    and 'item_id' in pkg_details and self.packages[x].get('item_id') == pkg_details['item_id']]
+                if key not in pkg_details and len(shared) > 0:
+                    pkg_details[key] = shared[0]
+            if 'item_quantity' not in pkg_details:
+                pkg_details['item_quantity'] = 1
+            if ('target_type' not in pkg_details or pkg_details['target_type'] == '') and 'item_type' in pkg_details:
+                if pkg_details['item_type'] == 454:
                     try:
-                        if int(chr_id_raw) == -1:
-                            pkg_details['chr_id_a'] = 0xFFFF
-                        else:
-                            if int(chr_id_raw) < 0x10000:
-                                pkg_details['chr_id_a'] = int(chr_id_raw)
-                            else:
-                                print("Invalid entry!")
-                    except ValueError:
-                        print("Invalid entry!")
-            while 'item_sort_id' not in pkg_details.keys():
+                        pkg_details['target_type'] = int(pkg_name.split('I_3D_ARC_C')[1].split('.')[0])
+                    except (IndexError, ValueError):
+                        pkg_details.pop('target_type', None)
+                else:
+                    pkg_details['target_type'] = 0
+            if ('attach_point' not in pkg_details or pkg_details['attach_point'] == '') and pkg_details.get('item_type', 194) != 194:
+                pkg_details['attach_point'] = 'null'
+            if ('chr_id' not in pkg_details or pkg_details['chr_id'] == 0x1FFFFFFF) and self.get_chr_id(pkg_name) != 0x1FFFFFFF:
+                pkg_details['chr_id'] = self.get_chr_id(pkg_name)
+            if 'chr_id_a' not in pkg_details or pkg_details['chr_id_a'] == 0x1FFFFFFF:
+                if isinstance(pkg_details.get('chr_id'), int) and pkg_details['chr_id'] < 1000:
+                    pkg_details['chr_id_a'] = pkg_details['chr_id']
+                elif self.get_chr_id(pkg_name) != 0x1FFFFFFF:
+                    pkg_details['chr_id_a'] = self.get_chr_id(pkg_name)
+            if 'item_sort_id' not in pkg_details and self.dlc_details.get('game_type') in names_csvs:
                 pkg_details['item_sort_id'] = self.random_number + {2:0, 3:0, 4:3000, 5:10000, 18: 2000}[self.dlc_details['game_type']]
                 self.random_number += 1
-            while 'item_name' not in pkg_details.keys() or pkg_details['item_name'] == '':
-                pkg_details['item_name'] = str(input("Item Name for {0}: ".format(packages[i]))).encode('utf-8').decode('utf-8')
-            while 'item_desc' not in pkg_details.keys() or pkg_details['item_desc'] == '':
-                pkg_details['item_desc'] = str(input("Item Description for {0}: ".format(packages[i]))).encode('utf-8').decode('utf-8')
-            while 'item_cs4rev_scraft_cutin' not in pkg_details.keys() or pkg_details['item_cs4rev_scraft_cutin'] == '':
-                pkg_details['item_cs4rev_scraft_cutin'] = 0
-            while 'rev_voice_flag' not in pkg_details.keys() or pkg_details['rev_voice_flag'] == '':
-                pkg_details['rev_voice_flag'] = 0
-            while 'item_quantity' not in pkg_details.keys():
-                item_quant_raw = input("How many should be included in the DLC? [Leave blank for 1] ".format(packages[i]))
-                if item_quant_raw == '':
-                    pkg_details['item_quantity'] = 1
-                else:
-                    try:
-                        pkg_details['item_quantity'] = min(max(int(item_quant_raw),1),99)
-                    except ValueError:
-                        print("Invalid entry!")
-            while 'flags' not in pkg_details.keys():
+            for key in ['item_cs4rev_scraft_cutin', 'rev_voice_flag']:
+                if key not in pkg_details or pkg_details[key] == '':
+                    pkg_details[key] = 0
+            if 'flags' not in pkg_details and all([x in pkg_details for x in ['item_type', 'chr_id']]):
                 if pkg_details['item_type'] == 454:
                     pkg_details['flags'] = 'S1'
                 elif pkg_details['chr_id'] != 0xFFFF and pkg_details['item_quantity'] < 99:
                     pkg_details['flags'] = 'S{}'.format(pkg_details['item_quantity'])
                 else:
                     pkg_details['flags'] = '0'
-            if not pkg_details['attach_point'] == 'null': #and 'attach_transform_data' not in pkg_details:
-                if os.path.exists(packages[i][:-4] + '.transform.csv'):
-                    with open(packages[i][:-4] + '.transform.csv', encoding='utf-8') as csvfile:
-                        transform_data = [row for row in csv.reader(csvfile, delimiter=',')]
-                        pkg_details['attach_transform_data'] = [dict(zip(transform_data[0],x)) for x in transform_data[1:]]
-            pkg_dict[packages[i]] = pkg_details
-            if pkg_details['item_id'] not in list(existing_items.keys()):
-                existing_items[pkg_details['item_id']] = pkg_details
-            with open(packages[i] + '.json', "wb") as f:
-                f.write(json.dumps(pkg_details, indent=4).encode("utf-8"))
-        return(pkg_dict)
+        return
+
+    # Returns a list of every missing or invalid setting, which is empty if the tables can be built
+    def validate (self):
+        return([x[2] for x in self.find_problems()])
+
+    # The problems found by validate(), as (source, setting, problem) with source 'dlc.json' or the package name.
+    # The settings of each package are in the order they are asked for.
+    def find_problems (self):
+        problems = []
+        ranges = setting_ranges(self.dlc_details.get('game_type'))
+        def check_int (source, details, key, lo = 0, hi = 0xFFFF):
+            lo, hi = ranges.get(key, (lo, hi))
+            if key not in details:
+                problems.append((source, key, "{0}: {1} is missing".format(source, key)))
+            elif not isinstance(details[key], int) or not lo <= details[key] <= hi:
+                problems.append((source, key, "{0}: {1} ({2}) must be a number from {3} to {4}".format(source, key, details[key], lo, hi)))
+        def check_str (source, details, key):
+            if key not in details or not isinstance(details[key], str) or details[key] == '':
+                problems.append((source, key, "{0}: {1} is missing".format(source, key)))
+        if self.dlc_details.get('game_type') not in [2,3,4,5,18]:
+            problems.append(('dlc.json', 'game_type', "dlc.json: game_type must be 2, 3, 4, 5 or 18"))
+        check_int('dlc.json', self.dlc_details, 'dlc_id')
+        check_int('dlc.json', self.dlc_details, 'dlc_sort_id')
+        check_str('dlc.json', self.dlc_details, 'dlc_name')
+        check_str('dlc.json', self.dlc_details, 'dlc_desc')
+        if len(self.packages) == 0:
+            problems.append(('', '', "No .pkg files"))
+        for pkg_name in self.packages:
+            pkg_details = self.packages[pkg_name]
+            check_int(pkg_name, pkg_details, 'item_id')
+            if pkg_details.get('item_type') not in [193,194,195,454]:
+                problems.append((pkg_name, 'item_type', "{0}: item_type must be 193, 194, 195 or 454".format(pkg_name)))
+            else:
+                check_int(pkg_name, pkg_details, 'item_type')
+            check_int(pkg_name, pkg_details, 'target_type', 0, 255)
+            check_str(pkg_name, pkg_details, 'attach_point')
+            for key in ['chr_id', 'chr_id_a']:
+                check_int(pkg_name, pkg_details, key)
+            for key in ['item_name', 'item_desc']:
+                check_str(pkg_name, pkg_details, key)
+            for key in ['item_quantity', 'item_sort_id']:
+                check_int(pkg_name, pkg_details, key)
+            for key in ['item_cs4rev_scraft_cutin', 'rev_voice_flag']:
+                check_int(pkg_name, pkg_details, key, -0x80000000, 0x7FFFFFFF)
+            check_str(pkg_name, pkg_details, 'flags')
+            for row in pkg_details.get('attach_transform_data', []):
+                if not all([x in row for x in ['char_id', 'translate', 'rotate', 'scale']]) or not str(row['char_id']).isdigit():
+                    problems.append((pkg_name, 'attach_transform_data', "{0}: attach_transform_data row {1} is invalid".format(pkg_name, row)))
+        return(problems)
+
+    # Returns {'t_item.tbl': bytes, 't_attach.tbl': bytes, 't_dlc.tbl': bytes} without writing anything
+    def build_tables (self):
+        problems = self.validate()
+        if len(problems) > 0:
+            raise ValueError("Cannot build tables:\n" + "\n".join(problems))
+        return({'t_item.tbl': self.make_item_tbl(False), 't_attach.tbl': self.make_attach_tbl(False), 't_dlc.tbl': self.make_dlc_tbl(False)})
+
+    # Saves the settings (including any filled in by apply_defaults()) to the .json files in project_dir
+    def save_project (self):
+        write_json_if_changed(self.project_path('dlc.json'), self.dlc_details)
+        for pkg_name in self.packages:
+            write_json_if_changed(self.project_path(pkg_name + '.json'), self.packages[pkg_name])
+        return
+
+    # Writes the tables to output_dir, skipping any that have not changed unless force = True, and records the
+    # inputs and tables in the build manifest.  Returns the list of tables that were written.
+    def write_tables (self, tables = None, force = False):
+        if tables is None:
+            tables = self.build_tables()
+        written = []
+        for table_name in tables:
+            if force:
+                with open(os.path.join(self.output_dir, table_name), 'wb') as f:
+                    f.write(tables[table_name])
+                written.append(table_name)
+            elif write_file_if_changed(os.path.join(self.output_dir, table_name), tables[table_name]):
+                written.append(table_name)
+        write_json_if_changed(os.path.join(self.output_dir, manifest_filename), {'inputs': project_input_hashes(self.project_dir, self.names_dir),\
+            'outputs': {x:hash_data(tables[x]) for x in tables}})
+        return(written)
 
     def make_tbl_header (self, item_count, name, second_name = ''):
         if len(second_name) > 0:
@@ -234,152 +448,184 @@ class dlc_table_maker:
         else:
             return(struct.pack("<HI", item_count, 1) + name.encode() + b'\x00' + struct.pack("<I", item_count))
 
+    # The make_*_block functions return the contents of one record, for tbl_writer.add_record().
+    # The make_*_entry functions return the entire record, including the type and block size.
+    def make_item_block (self, pkg_name):
+        package = self.packages[pkg_name]
+        item_tbl_entry = bytearray(item_header_struct.pack(package['item_id'], package['chr_id']))
+        item_tbl_entry += package['flags'].encode() + b'\x00'
+        item_tbl_entry += item_templates[self.dlc_details['game_type']].fill(dict(package, dlc_id = self.dlc_details['dlc_id']))
+        item_tbl_entry += package['item_name'].encode('utf-8') + b'\x00'
+        item_tbl_entry += package['item_desc'].encode('utf-8') + b'\x00'
+        item_tbl_entry += item_tails[self.dlc_details['game_type']]
+        return(bytes(item_tbl_entry))
+
     def make_item_entry (self, pkg_name):
-        item_tbl_entry = struct.pack("<2H", self.packages[pkg_name]['item_id'], self.packages[pkg_name]['chr_id'])
-        item_tbl_entry += self.packages[pkg_name]['flags'].encode() + b'\x00'
-        if self.dlc_details['game_type'] == 5: #NISA Reverie
-            item_tbl_entry += struct.pack("<2H", 0, self.packages[pkg_name]['item_type'])
-            item_tbl_entry += struct.pack("<B4H", *[0]*5)
-            item_tbl_entry += struct.pack("<B", self.packages[pkg_name]['target_type'])
-            item_tbl_entry += struct.pack("<B59H", *[0]*60)
-            # The first two numbers are constant and same as CS4, the second two seem random, maybe sorting or a timestamp?
-            item_tbl_entry += struct.pack("<4H", 99, 0, self.packages[pkg_name]['item_sort_id'], 32)
-        elif self.dlc_details['game_type'] == 3: #CS3
-            item_tbl_entry += struct.pack("<H", self.packages[pkg_name]['item_type'])
-            item_tbl_entry += struct.pack("<4H", *[0]*4)
-            item_tbl_entry += struct.pack("<B", self.packages[pkg_name]['target_type'])
-            item_tbl_entry += struct.pack("<B55H", *[0]*56)
-            item_tbl_entry += struct.pack("<BHH", 99, self.packages[pkg_name]['item_sort_id'], 0) # Second number is sort, third number may also be sort?
-        elif self.dlc_details['game_type'] == 2: #CS2
-            item_tbl_entry += struct.pack("<B", self.packages[pkg_name]['item_type'])
-            item_tbl_entry += struct.pack("<B", 0)
-            item_tbl_entry += struct.pack("<B", self.packages[pkg_name]['target_type'])
-            item_tbl_entry += struct.pack("<26H", *[0]*26)
-            item_tbl_entry += struct.pack("<B2H", 99, self.packages[pkg_name]['item_sort_id'], self.dlc_details['dlc_id'])
-        elif self.dlc_details['game_type'] == 18: #TXe
-            item_tbl_entry += struct.pack("<H", self.packages[pkg_name]['item_type'])
-            item_tbl_entry += struct.pack("<27H", *[0]*27)
-            item_tbl_entry += struct.pack("<3H", 99, self.packages[pkg_name]['item_sort_id'], self.dlc_details['dlc_id'])
-        else: #Defaults to Cold Steel IV
-            item_tbl_entry += struct.pack("<2H", 0, self.packages[pkg_name]['item_type'])
-            item_tbl_entry += struct.pack("<4H", *[0]*4)
-            item_tbl_entry += struct.pack("<B", self.packages[pkg_name]['target_type'])
-            item_tbl_entry += struct.pack("<B65H", *[0]*66)
-            item_tbl_entry += struct.pack("<3H", 99, self.packages[pkg_name]['item_sort_id'], self.dlc_details['dlc_id'])
-        item_tbl_entry += self.packages[pkg_name]['item_name'].encode('utf-8') + b'\x00'
-        item_tbl_entry += self.packages[pkg_name]['item_desc'].encode('utf-8') + b'\x00'
-        if self.dlc_details['game_type'] == 5: #NISA Reverie
-            pass
-        elif self.dlc_details['game_type'] == 18: #TXe
-            item_tbl_entry += struct.pack("<2IB", *[0]*3)
-        else: #Defaults to Cold Steel II/III/IV
-            item_tbl_entry += struct.pack("<2I", 0, 0)
+        item_tbl_entry = self.make_item_block(pkg_name)
         return(b'item\x00' + struct.pack("<H",len(item_tbl_entry)) + item_tbl_entry)
 
-    def make_attach_entry (self, pkg_name):
-        attach_tbl_entry = struct.pack("<3HI", self.packages[pkg_name]['chr_id_a'],\
-            {193:5, 194:67, 195: 9, 454: 5}[self.packages[pkg_name]['item_type']], 0, self.packages[pkg_name]['item_id'])
-        if self.dlc_details['game_type'] in [2,3]: #CS2/CS3
-            attach_tbl_entry += struct.pack("<6H", *[0]*6)
-        elif self.dlc_details['game_type'] == 18: #TXe
-            attach_tbl_entry += struct.pack("<4I", 0,0,0,255)
-        else: #Defaults to Cold Steel IV / Reverie
-            voice_flag = self.packages[pkg_name]['rev_voice_flag'] if self.dlc_details['game_type'] == 5 else 0
-            attach_tbl_entry += struct.pack("<4iH", 0, 0, voice_flag, self.packages[pkg_name]['item_cs4rev_scraft_cutin'], 48)
+    def make_attach_block (self, pkg_name):
+        package = self.packages[pkg_name]
+        voice_flag = package['rev_voice_flag'] if self.dlc_details['game_type'] == 5 else 0
+        attach_tbl_entry = attach_templates[self.dlc_details['game_type']].fill(dict(package,\
+            attach_type = attach_types[package['item_type']], voice_flag = voice_flag))
         attach_tbl_entry += pkg_name.split('.')[0].encode() + b'\x00' #Split is to remove the .pkg
-        attach_tbl_entry += self.packages[pkg_name]['attach_point'].encode() + b'\x00'
+        attach_tbl_entry += package['attach_point'].encode() + b'\x00'
+        return(bytes(attach_tbl_entry))
+
+    def make_attach_entry (self, pkg_name):
+        attach_tbl_entry = self.make_attach_block(pkg_name)
         return(b'AttachTableData\x00' + struct.pack("<H",len(attach_tbl_entry)) + attach_tbl_entry)
 
-    def make_attach_transform_entries (self, pkg_name):
-        transform_entries = b''
+    # Returns a list of blocks, one per row of attach_transform_data
+    def make_attach_transform_blocks (self, pkg_name):
+        transform_blocks = []
         for entry in self.packages[pkg_name]['attach_transform_data']:
-            attach_transform_entry = struct.pack("<H", int(entry['char_id']))
+            attach_transform_entry = bytearray(struct.pack("<H", int(entry['char_id'])))
             if self.dlc_details['game_type'] == 5: #Reverie
                 attach_transform_entry += entry['costume_id'].encode('utf-8') + b'\x00'
             attach_transform_entry += pkg_name.split('.pkg')[0].encode('utf-8') + b'\x00'
             attach_transform_entry += entry['translate'].encode('utf-8') + b'\x00'
             attach_transform_entry += entry['rotate'].encode('utf-8') + b'\x00'
             attach_transform_entry += entry['scale'].encode('utf-8') + b'\x00'
-            transform_entries += b'AttachTransformData\x00' + struct.pack("<H",len(attach_transform_entry)) + attach_transform_entry
+            transform_blocks.append(bytes(attach_transform_entry))
             self.transform_counter += 1
-        return(transform_entries)
+        return(transform_blocks)
 
-    def make_dlc_entry (self):
-        if self.dlc_details['game_type'] in [2, 18]: #CS2/TXe
-            dlc_tbl_entry = struct.pack("<H", self.dlc_details['dlc_id'])
-        else:
-            dlc_tbl_entry = struct.pack("<2H", self.dlc_details['dlc_id'], self.dlc_details['dlc_sort_id'])
-        if self.dlc_details['game_type'] == 3: #CS3
-            dlc_tbl_entry += struct.pack("<2H", *[0]*2)
-        elif self.dlc_details['game_type'] in [2, 18]: #CS2/TXe
-            # I have no idea if there is a sort ID here, every entry I examined had the same values
-            dlc_tbl_entry += struct.pack("<2HI", 65535, 100, 0)
-            if self.dlc_details['game_type'] == 2:
-                dlc_tbl_entry += struct.pack("<H", 0)
-        else: #Defaults to Cold Steel IV / Reverie
-            dlc_tbl_entry += struct.pack("<8H", *[0]*8)
+    def make_attach_transform_entries (self, pkg_name):
+        return(b''.join([b'AttachTransformData\x00' + struct.pack("<H",len(x)) + x for x in self.make_attach_transform_blocks(pkg_name)]))
+
+    def make_dlc_block (self):
+        dlc_tbl_entry = dlc_templates[self.dlc_details['game_type']].fill(self.dlc_details)
         dlc_tbl_entry += self.dlc_details['dlc_name'].encode('utf-8') + b'\x00'
         dlc_tbl_entry += self.dlc_details['dlc_desc'].encode('utf-8') + b'\x00'
-        items_added = []
+        items_added = set()
         for i in range(len(self.package_list)):
             if self.packages[self.package_list[i]]['item_id'] not in items_added:
-                dlc_tbl_entry += struct.pack("<2H", self.packages[self.package_list[i]]['item_id'],\
+                dlc_tbl_entry += dlc_item_struct.pack(self.packages[self.package_list[i]]['item_id'],\
                     self.packages[self.package_list[i]]['item_quantity']) # Second number is quantity
-                items_added.append(self.packages[self.package_list[i]]['item_id'])
+                items_added.add(self.packages[self.package_list[i]]['item_id'])
         if 20 - len(items_added) > 0:
-            for i in range(20 - len(items_added)):
-                dlc_tbl_entry += struct.pack("<2H", 9999, 0)
+            dlc_tbl_entry += dlc_item_struct.pack(9999, 0) * (20 - len(items_added))
+        return(bytes(dlc_tbl_entry))
+
+    def make_dlc_entry (self):
+        dlc_tbl_entry = self.make_dlc_block()
         return(b'dlc\x00' + struct.pack("<H",len(dlc_tbl_entry)) + dlc_tbl_entry)
 
     def make_item_tbl (self, write_table = True):
-        items_added = []
-        item_tbl = bytes()
-        for i in range(len(self.package_list)):
-            if self.packages[self.package_list[i]]['item_id'] not in items_added:
-                item_tbl += self.make_item_entry(self.package_list[i])
-                items_added.append(self.packages[self.package_list[i]]['item_id'])
+        items_added = set()
         if self.dlc_details['game_type'] in [3,18]:
-            item_tbl = self.make_tbl_header(len(items_added), 'item', 'item_q') + item_tbl
+            item_tbl = tbl_writer(['item', 'item_q'])
         else:
-            item_tbl = self.make_tbl_header(len(items_added), 'item') + item_tbl
+            item_tbl = tbl_writer(['item'])
+        for i in range(len(self.package_list)):
+            if self.packages[self.package_list[i]]['item_id'] not in items_added:
+                item_tbl.add_record('item', self.make_item_block(self.package_list[i]))
+                items_added.add(self.packages[self.package_list[i]]['item_id'])
         if write_table == True:
-            with open("t_item.tbl","wb") as f:
-                f.write(item_tbl)
-        return(item_tbl)
+            item_tbl.write(os.path.join(self.output_dir, "t_item.tbl"))
+        return(item_tbl.getvalue())
 
     def make_attach_tbl (self, write_table = True):
         self.transform_counter = 0
-        table_counter = len(self.package_list)
-        attach_tbl_data = b''
+        if self.dlc_details['game_type'] in [4,5]:
+            attach_tbl = tbl_writer(['AttachTableData', 'AttachTransformData'])
+        else:
+            attach_tbl = tbl_writer(['AttachTableData'])
         for i in range(len(self.package_list)):
-            attach_tbl_data += self.make_attach_entry(self.package_list[i])
+            attach_tbl.add_record('AttachTableData', self.make_attach_block(self.package_list[i]))
             if not self.packages[self.package_list[i]]['attach_point'] == 'null'\
                     and self.dlc_details['game_type'] in [4,5]\
                     and 'attach_transform_data' in self.packages[self.package_list[i]]\
                     and len(self.packages[self.package_list[i]]['attach_transform_data']) > 0:
-                attach_tbl_data += self.make_attach_transform_entries(self.package_list[i])
-        attach_tbl = struct.pack("<HI", table_counter+self.transform_counter, {2:1,3:1,4:2,5:2,18:1}[self.dlc_details['game_type']])
-        attach_tbl += 'AttachTableData'.encode() + b'\x00' + struct.pack("<I", table_counter)
-        if self.dlc_details['game_type'] in [4,5]:
-            attach_tbl += 'AttachTransformData'.encode() + b'\x00' + struct.pack("<I", self.transform_counter)
-        attach_tbl += attach_tbl_data
+                for transform_block in self.make_attach_transform_blocks(self.package_list[i]):
+                    attach_tbl.add_record('AttachTransformData', transform_block)
         if write_table == True:
-            with open("t_attach.tbl","wb") as f:
-                f.write(attach_tbl)
-        return(attach_tbl)
+            attach_tbl.write(os.path.join(self.output_dir, "t_attach.tbl"))
+        return(attach_tbl.getvalue())
 
     def make_dlc_tbl (self, write_table = True):
-        dlc_tbl = self.make_tbl_header(1, 'dlc')
-        dlc_tbl += self.make_dlc_entry() # I think we can put more than one entry
+        dlc_tbl = tbl_writer(['dlc'])
+        dlc_tbl.add_record('dlc', self.make_dlc_block()) # I think we can put more than one entry
         if write_table == True:
-            with open("t_dlc.tbl","wb") as f:
-                f.write(dlc_tbl)
-        return(dlc_tbl)
+            dlc_tbl.write(os.path.join(self.output_dir, "t_dlc.tbl"))
+        return(dlc_tbl.getvalue())
+
+# Builds the tables of one project, for batch builds.  No questions can be asked in a batch build, so a project
+# with missing settings fails instead (run this script in its folder once to answer them).  Returns a summary.
+def build_project (project_dir, names_dir = None, force = False):
+    summary = {'project': project_dir, 'success': False, 'items': 0, 'attachments': 0, 'transforms': 0, 'written': [], 'error': ''}
+    try:
+        if names_dir is None:
+            names_dir = os.path.abspath(os.path.dirname(__file__))
+        if not force and build_is_current(project_dir, project_dir, names_dir):
+            summary.update({'success': True, 'up_to_date': True})
+            return(summary)
+        dlc_details, packages = load_project(project_dir)
+        maker = dlc_table_maker(project_dir, names_dir = names_dir, dlc_details = dlc_details, packages = packages)
+        problems = maker.validate()
+        if len(problems) > 0:
+            summary['error'] = '; '.join(problems)
+            return(summary)
+        tables = maker.build_tables()
+        maker.save_project()
+        summary['written'] = maker.write_tables(tables, force)
+        summary.update({'success': True, 'items': len(set([maker.packages[x]['item_id'] for x in maker.package_list])),\
+            'attachments': len(maker.package_list), 'transforms': maker.transform_counter})
+    except Exception as e:
+        summary['error'] = '{0}: {1}'.format(type(e).__name__, e)
+    return(summary)
+
+# Every folder with a dlc.json in it, searching each path and all its subfolders
+def find_projects (paths):
+    projects = []
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            if 'dlc.json' in files:
+                projects.append(root)
+    return(sorted(set(projects)))
+
+# Builds many projects at once, each in its own process.  Returns True if every project was built.
+def batch_build (paths, workers = None, names_dir = None, force = False):
+    projects = find_projects(paths)
+    if len(projects) == 0:
+        print("No projects (folders with dlc.json) found.")
+        return(False)
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(build_project, x, names_dir, force) for x in projects]
+        summaries = [x.result() for x in futures]
+    for summary in summaries:
+        if summary.get('up_to_date', False):
+            print("{0}: up to date".format(summary['project']))
+        elif summary['success']:
+            print("{0}: {1} items, {2} attachments, {3} transforms, {4}".format(summary['project'],\
+                summary['items'], summary['attachments'], summary['transforms'],\
+                'wrote ' + ', '.join(summary['written']) if len(summary['written']) > 0 else 'tables unchanged'))
+        else:
+            print("{0}: FAILED - {1}".format(summary['project'], summary['error']))
+    print("Built {0} of {1} projects.".format(len([x for x in summaries if x['success']]), len(summaries)))
+    return(all([x['success'] for x in summaries]))
 
 if __name__ == "__main__":
-    # Set current directory
-    os.chdir(os.path.abspath(os.path.dirname(__file__)))
-    dlc_table_maker = dlc_table_maker()
-    dlc_table_maker.make_item_tbl()
-    dlc_table_maker.make_attach_tbl()
-    dlc_table_maker.make_dlc_tbl()
+    if len(sys.argv) > 1:
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument('-b', '--batch', help="Build every project (folder with dlc.json) in these folders and their subfolders.", nargs='+')
+        parser.add_argument('-j', '--workers', help="Number of projects to build at the same time (default: number of CPUs).", type=int)
+        parser.add_argument('-n', '--names_dir', help="Folder with the names CSVs, for projects that do not have their own (default: the folder this script is in).")
+        parser.add_argument('-f', '--force', help="Rebuild and rewrite the tables even if nothing has changed since the last build.", action="store_true")
+        args = parser.parse_args()
+    else:
+        args = None
+    if args is not None and args.batch:
+        sys.exit(0 if batch_build(args.batch, args.workers, args.names_dir, args.force) else 1)
+    else:
+        # Set current directory
+        os.chdir(os.path.abspath(os.path.dirname(__file__)))
+        force = args is not None and args.force
+        if not force and build_is_current('.', '.', '.'):
+            print("Nothing has changed since the last build, the tables are up to date.  (Use --force to rebuild anyway.)")
+        else:
+            dlc_table_maker = dlc_table_maker()
+            dlc_table_maker.write_tables(dlc_table_maker.build_tables(), force = force)